@@ -0,0 +1,156 @@
+# bridge_filters.py
+"""
+Фильтры моста Telegram → Discord; собираются один раз на снимок конфига
+вместе с таблицей маршрутов (bridge_routes.py), у каждого маршрута — свои.
+
+• TG_FILTER_BLOCK — стоп-слова (подстроки без учёта регистра); все сразу ищутся
+  автоматом Ахо–Корасик за один проход по тексту, сколько бы слов ни было;
+• TG_FILTER_ALLOW — слова-исключения: если в посте есть хоть одно, стоп-слова не действуют;
+• TG_FILTER_REGEX — регулярные выражения (без учёта регистра); совпадение — пост не пересылаем;
+• регулярка для вырезания эмодзи и проверка «есть буквы или цифры» скомпилированы заранее.
+
+Бенчмарк наивной проверки против автомата:
+    python bridge_filters.py --keywords 500
+"""
+import logging
+import re
+from typing import Dict, Iterable, List, Mapping, Optional
+
+log = logging.getLogger("bridge_filters")
+
+EMOJI_RE = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"
+    "\U0001F300-\U0001F5FF"
+    "\U0001F680-\U0001F6FF"
+    "\U0001F1E0-\U0001F1FF"
+    "\U00002700-\U000027BF"
+    "\U000024C2-\U0001F251"
+    "]+",
+    flags=re.UNICODE
+)
+ALNUM_RE = re.compile(r"[^\W_]")  # то же, что any(ch.isalnum() for ch in text)
+
+
+def strip_emoji(text: str) -> str:
+    return EMOJI_RE.sub("", text).strip()
+
+
+def has_letters_or_digits(text: str) -> bool:
+    return ALNUM_RE.search(text) is not None
+
+
+class AhoCorasick:
+    """Автомат для поиска множества подстрок за один проход (без учёта регистра)."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Optional[str]] = [None]  # самое короткое слово, заканчивающееся в узле
+        for pattern in patterns:
+            self._add(pattern.casefold(), pattern)
+        self._build()
+
+    def __bool__(self) -> bool:
+        return len(self._goto) > 1
+
+    def _add(self, word: str, original: str) -> None:
+        if not word:
+            return
+        node = 0
+        for ch in word:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(None)
+            node = nxt
+        if self._out[node] is None:
+            self._out[node] = original
+
+    def _build(self) -> None:
+        queue = list(self._goto[0].values())
+        for node in queue:  # обход в ширину: у родителя fail уже посчитан
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                if self._out[child] is None:
+                    self._out[child] = self._out[self._fail[child]]
+
+    def search(self, text: str) -> Optional[str]:
+        """Первое найденное слово (в исходном написании) или None."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text.casefold():
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node] is not None:
+                return out[node]
+        return None
+
+
+class BridgeFilter:
+    def __init__(self, cfg: Mapping):
+        self.block = AhoCorasick(str(w) for w in cfg.get("TG_FILTER_BLOCK", ()))
+        self.allow = AhoCorasick(str(w) for w in cfg.get("TG_FILTER_ALLOW", ()))
+        self.rules: List[re.Pattern] = []
+        for pattern in cfg.get("TG_FILTER_REGEX", ()):
+            try:
+                self.rules.append(re.compile(pattern, re.IGNORECASE))
+            except re.error as e:
+                log.error("TG_FILTER_REGEX: пропускаю «%s»: %s", pattern, e)
+
+    def blocked_by(self, text: str) -> Optional[str]:
+        """Почему пост не пересылаем (стоп-слово или регулярка) или None."""
+        if not text:
+            return None
+        for rule in self.rules:
+            if rule.search(text):
+                return rule.pattern
+        if self.block and not (self.allow and self.allow.search(text)):
+            return self.block.search(text)
+        return None
+
+
+def _benchmark() -> None:
+    import argparse
+    import random
+    import string
+    import timeit
+
+    parser = argparse.ArgumentParser(description="Стоп-слова: наивный поиск против Ахо–Корасик")
+    parser.add_argument("--keywords", type=int, default=500)
+    parser.add_argument("--text-len", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    alphabet = string.ascii_lowercase + "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+    keywords = ["".join(rnd.choices(alphabet, k=rnd.randint(5, 12))) for _ in range(args.keywords)]
+    text = " ".join("".join(rnd.choices(alphabet, k=rnd.randint(2, 9))) for _ in range(args.text_len // 6))
+
+    def naive() -> bool:
+        text_lower = text.lower()
+        return any(word.lower() in text_lower for word in keywords)
+
+    automaton = AhoCorasick(keywords)
+    assert naive() == (automaton.search(text) is not None)
+
+    t_naive = timeit.timeit(naive, number=args.runs) / args.runs
+    t_aho = timeit.timeit(lambda: automaton.search(text), number=args.runs) / args.runs
+    t_build = timeit.timeit(lambda: AhoCorasick(keywords), number=10) / 10
+    print(f"слов: {args.keywords}, текст: {len(text)} символов")
+    print(f"наивно:        {t_naive * 1e6:9.1f} мкс на пост")
+    print(f"Ахо–Корасик:   {t_aho * 1e6:9.1f} мкс на пост")
+    print(f"сборка автомата: {t_build * 1e3:7.1f} мс (один раз на снимок конфига)")
+
+
+if __name__ == "__main__":
+    _benchmark()
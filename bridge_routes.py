@@ -0,0 +1,108 @@
+# bridge_routes.py
+"""
+Таблица маршрутов моста Telegram → Discord.
+
+BRIDGE_ROUTES — список маршрутов:
+    {
+      "name": "news",
+      "source": "@channel" | -100123 | ["@a", "@b"],   # откуда (username или id чата)
+      "webhooks": "https://..." | ["https://...", ...], # куда
+      "color": "00BFFF", "footer": "Текст подвала",     # необязательно
+      "block": [...], "allow": [...], "regex": [...]    # необязательно, фильтры маршрута
+    }
+Чего нет в маршруте — берётся из общих DISCORD_EMBED_COLOR, DISCORD_FOOTER_TEXT, TG_FILTER_*.
+Без BRIDGE_ROUTES работает прежняя пара TG_NEWS_SOURCE → DISCORD_NEWS_WEBHOOK.
+
+Таблица строится один раз на снимок конфига и индексирована по id и username чата —
+поиск маршрутов для апдейта — два обращения к словарю.
+"""
+import logging
+from collections import ChainMap
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from telegram import Chat
+
+from bridge_filters import BridgeFilter
+from config_service import parse_color
+
+log = logging.getLogger("bridge_routes")
+
+# ключ маршрута -> общий ключ конфига с тем же смыслом
+_ROUTE_OVERRIDES = {
+    "color": "DISCORD_EMBED_COLOR",
+    "footer": "DISCORD_FOOTER_TEXT",
+    "block": "TG_FILTER_BLOCK",
+    "allow": "TG_FILTER_ALLOW",
+    "regex": "TG_FILTER_REGEX",
+}
+
+
+def _as_list(value) -> List:
+    if value is None or value == "":
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _source_key(source) -> str:
+    # id чата — строкой, username — без @ и в нижнем регистре
+    return str(source).strip().lstrip("@").lower()
+
+
+class Route:
+    def __init__(self, name: str, sources: List, webhooks: List[str], cfg: Mapping):
+        self.name = name
+        self.sources = [_source_key(s) for s in sources]
+        self.webhooks = webhooks
+        self.color = parse_color(cfg.get("DISCORD_EMBED_COLOR", "00BFFF"))
+        self.footer: Optional[str] = cfg.get("DISCORD_FOOTER_TEXT")
+        self.filter = BridgeFilter(cfg)
+
+
+class RouteTable:
+    def __init__(self, cfg: Mapping):
+        self.routes: List[Route] = []
+        self._index: Dict[str, List[Route]] = {}
+
+        raw_routes = cfg.get("BRIDGE_ROUTES")
+        if raw_routes is None:
+            raw_routes = [{
+                "name": "default",
+                "source": cfg.get("TG_NEWS_SOURCE"),
+                "webhooks": cfg.get("DISCORD_NEWS_WEBHOOK"),
+            }]
+
+        for i, raw in enumerate(raw_routes, 1):
+            sources, webhooks = _as_list(raw.get("source")), _as_list(raw.get("webhooks"))
+            if not sources or not webhooks:
+                continue
+            overrides = {key: raw[field] for field, key in _ROUTE_OVERRIDES.items() if field in raw}
+            route = Route(str(raw.get("name") or f"route{i}"), sources, webhooks, ChainMap(overrides, cfg))
+            self.routes.append(route)
+            for source in route.sources:
+                self._index.setdefault(source, []).append(route)
+
+    def sources(self) -> List[str]:
+        return list(self._index)
+
+    def match(self, chat: Chat) -> Tuple[Route, ...]:
+        """Маршруты, источник которых — этот чат (по id или username)."""
+        routes = self._index.get(str(chat.id), [])
+        if chat.username:
+            routes = routes + [r for r in self._index.get(chat.username.lower(), []) if r not in routes]
+        return tuple(routes)
+
+
+_cached: Tuple[Optional[Mapping], Optional[RouteTable]] = (None, None)
+
+
+def get_routes(cfg: Mapping) -> RouteTable:
+    """Таблица для данного снимка конфига: пересобирается, только когда снимок сменился."""
+    global _cached
+    snapshot, table = _cached
+    if snapshot is not cfg or table is None:
+        table = RouteTable(cfg)
+        _cached = (cfg, table)
+        log.info("Мост Telegram → Discord: маршрутов %s", len(table.routes))
+    return table
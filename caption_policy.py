@@ -0,0 +1,81 @@
+# caption_policy.py
+"""
+Когда правка подписи живого анонса действительно нужна.
+
+Во время эфира подпись меняется почти на каждом опросе (зрители, длительность), но
+каждая правка расходует лимиты канала. Политика:
+
+• смена названия, категории, кнопок, конец эфира — правим сразу;
+• иначе не чаще min_interval;
+• после него — если зрители сдвинулись на ≥ viewer_delta_abs или ≥ viewer_delta_rel
+  от последнего отправленного значения, либо сменилась картинка;
+• и в любом случае раз в max_interval, чтобы длительность не застывала.
+
+should_edit() только решает; mark_sent() вызывается, когда правка действительно дошла до чата —
+иначе упавшая правка придержала бы следующую на min_interval. Пропущенные правки считаются
+в stats['suppressed'].
+"""
+import time
+from typing import Dict, Optional
+
+
+class CaptionEditPolicy:
+    def __init__(
+        self,
+        *,
+        min_interval: float = 120,
+        max_interval: float = 600,
+        viewer_delta_rel: float = 0.1,
+        viewer_delta_abs: int = 5,
+    ):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.viewer_delta_rel = viewer_delta_rel
+        self.viewer_delta_abs = viewer_delta_abs
+        # ключ анонса -> что и когда последний раз ушло в чат
+        self._last: Dict[str, dict] = {}
+        self.stats = {"edits": 0, "forced": 0, "suppressed": 0}
+
+    def _viewers_moved(self, before: Optional[int], now: Optional[int]) -> bool:
+        if before is None or now is None:
+            return before != now
+        delta = abs(now - before)
+        return delta >= self.viewer_delta_abs or delta >= self.viewer_delta_rel * max(before, 1)
+
+    def should_edit(
+        self,
+        key: str,
+        *,
+        title: str,
+        game: str,
+        viewers: Optional[int],
+        media_changed: bool = False,
+        force: bool = False,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Решает, отправлять ли правку. Ничего не запоминает — после успешной отправки нужен mark_sent()."""
+        now = time.monotonic() if now is None else now
+        last = self._last.get(key)
+
+        if force or last is None or title != last["title"] or game != last["game"]:
+            self.stats["forced"] += 1
+        else:
+            elapsed = now - last["at"]
+            significant = (
+                elapsed >= self.max_interval
+                or (elapsed >= self.min_interval and (media_changed or self._viewers_moved(last["viewers"], viewers)))
+            )
+            if not significant:
+                self.stats["suppressed"] += 1
+                return False
+
+        self.stats["edits"] += 1
+        return True
+
+    def mark_sent(self, key: str, *, title: str, game: str, viewers: Optional[int], now: Optional[float] = None) -> None:
+        """Запоминает отправленную подпись — от неё отсчитывается следующий интервал."""
+        now = time.monotonic() if now is None else now
+        self._last[key] = {"at": now, "title": title, "game": game, "viewers": viewers}
+
+    def forget(self, key: str) -> None:
+        self._last.pop(key, None)
@@ -0,0 +1,222 @@
+# config_service.py
+"""
+Единая точка чтения config.json для всех модулей.
+
+• get_config() — неизменяемый снимок: словари — MappingProxyType, списки — кортежи;
+  его можно отдавать куда угодно, никто не испортит общий конфиг;
+• файл перечитывается только когда меняется (mtime/размер — фоновая проверка раз в
+  CONFIG_RELOAD_SECONDS), обработчики апдейтов диск не трогают;
+• новый снимок проходит проверку; битый файл не применяется — остаётся прежний снимок;
+• subscribe(fn) — fn(снимок) вызывается после каждой успешной перезагрузки,
+  так ссылки, правила и фильтры применяются без рестарта.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from types import MappingProxyType
+from typing import Any, Callable, List, Mapping, Optional, Tuple
+
+log = logging.getLogger("config_service")
+
+CONFIG_PATH = "config.json"
+
+# ключи, тип которых проверяем (в снимке dict станет Mapping, list — tuple)
+_DICT_KEYS = ("SOCIAL_LINKS", "STREAM_LINKS", "LINKS_COMMAND")
+_LIST_KEYS = (
+    "ANNOUNCE_TARGETS", "IRL_CATEGORIES", "TG_FILTER_BLOCK", "TG_FILTER_ALLOW", "TG_FILTER_REGEX", "BRIDGE_ROUTES",
+    "CANCEL_PROTECTED_USERS", "ROLL_LUCKY_USERS", "ROLL_UNLUCKY_USERS", "LOVE_SPECIAL_PAIRS",
+)
+_INT_LIST_KEYS = ("CANCEL_PROTECTED_USERS", "ROLL_LUCKY_USERS", "ROLL_UNLUCKY_USERS")
+_STR_LIST_KEYS = ("TG_FILTER_BLOCK", "TG_FILTER_ALLOW", "TG_FILTER_REGEX")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def parse_color(value: Any) -> int:
+    """«#9146FF», «9146FF» -> 0x9146FF; ValueError, если это не цвет."""
+    color = int(str(value).strip().lstrip("#"), 16)
+    if not 0 <= color <= 0xFFFFFF:
+        raise ValueError(f"цвет вне диапазона: {value}")
+    return color
+
+
+def _check_color(where: str, value: Any) -> None:
+    try:
+        parse_color(value)
+    except (TypeError, ValueError):
+        raise ConfigError(f"{where}: «{value}» — не цвет (нужно вида \"9146FF\")") from None
+
+
+def _check_strings(where: str, value: Any) -> None:
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ConfigError(f"{where} должен быть списком строк")
+
+
+def _check_regex(where: str, patterns: List[str]) -> None:
+    for pattern in patterns:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ConfigError(f"{where}: «{pattern}» — неверное регулярное выражение: {e}") from None
+
+
+def _one_or_many(value: Any, kinds: tuple) -> list:
+    # «одно значение или список» — как в маршрутах моста; пустое — None
+    items = value if isinstance(value, list) else [value]
+    if not items or not all(isinstance(v, kinds) and not isinstance(v, bool) and v != "" for v in items):
+        return None
+    return items
+
+
+def _check_route(i: int, route: Any) -> None:
+    where = f"BRIDGE_ROUTES[{i}]"
+    if not isinstance(route, dict) or not route.get("source") or not route.get("webhooks"):
+        raise ConfigError("BRIDGE_ROUTES: у каждого маршрута должны быть source и webhooks")
+    if "name" in route and not isinstance(route["name"], str):
+        raise ConfigError(f"{where}.name должен быть строкой")
+    if _one_or_many(route["source"], (str, int)) is None:
+        raise ConfigError(f"{where}.source — username или id чата (или их список)")
+    webhooks = _one_or_many(route["webhooks"], (str,))
+    if webhooks is None or not all(url.startswith(("http://", "https://")) for url in webhooks):
+        raise ConfigError(f"{where}.webhooks — ссылка на вебхук (или их список)")
+    if "color" in route:
+        _check_color(f"{where}.color", route["color"])
+    if route.get("footer") is not None and not isinstance(route["footer"], str):
+        raise ConfigError(f"{where}.footer должен быть строкой")
+    for field in ("block", "allow", "regex"):
+        if field in route:
+            _check_strings(f"{where}.{field}", route[field])
+    _check_regex(f"{where}.regex", route.get("regex", []))
+
+
+def validate(raw: Any) -> None:
+    if not isinstance(raw, dict):
+        raise ConfigError("config.json должен быть JSON-объектом")
+    for key in _DICT_KEYS:
+        if key in raw and not isinstance(raw[key], dict):
+            raise ConfigError(f"{key} должен быть объектом {{\"название\": \"ссылка\"}}")
+    for key in _LIST_KEYS:
+        if key in raw and not isinstance(raw[key], list):
+            raise ConfigError(f"{key} должен быть списком")
+    for key in _INT_LIST_KEYS:
+        for item in raw.get(key, []):
+            try:
+                int(item)
+            except (TypeError, ValueError):
+                raise ConfigError(f"{key}: «{item}» — не числовой id") from None
+    for key in _STR_LIST_KEYS:
+        if key in raw:
+            _check_strings(key, raw[key])
+    _check_regex("TG_FILTER_REGEX", raw.get("TG_FILTER_REGEX", []))
+    if "VIEWER_SERIES_CAPACITY" in raw:
+        # ряд зрителей прореживается попарно — ёмкость должна быть чётной
+        try:
+            capacity = int(raw["VIEWER_SERIES_CAPACITY"])
+        except (TypeError, ValueError):
+            capacity = 0
+        if capacity < 2 or capacity % 2:
+            raise ConfigError("VIEWER_SERIES_CAPACITY должен быть чётным числом не меньше 2")
+    if "DISCORD_EMBED_COLOR" in raw:
+        _check_color("DISCORD_EMBED_COLOR", raw["DISCORD_EMBED_COLOR"])
+    if raw.get("DISCORD_FOOTER_TEXT") is not None and not isinstance(raw["DISCORD_FOOTER_TEXT"], str):
+        raise ConfigError("DISCORD_FOOTER_TEXT должен быть строкой")
+    for i, route in enumerate(raw.get("BRIDGE_ROUTES", [])):
+        _check_route(i, route)
+    for pair in raw.get("LOVE_SPECIAL_PAIRS", []):
+        if not isinstance(pair, list) or len(pair) != 2:
+            raise ConfigError("LOVE_SPECIAL_PAIRS: каждая пара — список из двух id")
+
+
+class ConfigService:
+    def __init__(self, path: str = CONFIG_PATH, reload_seconds: float = 5.0):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._snapshot: Optional[Mapping[str, Any]] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._subscribers: List[Callable[[Mapping[str, Any]], None]] = []
+        self._watcher: Optional[asyncio.Task] = None
+
+    def _file_stamp(self) -> Tuple[int, int]:
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self) -> Mapping[str, Any]:
+        with open(self.path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        validate(raw)
+        return freeze(raw)
+
+    def get(self) -> Mapping[str, Any]:
+        if self._snapshot is None:
+            stamp = self._file_stamp()
+            self._snapshot = self._read()
+            self._stamp = stamp
+        return self._snapshot
+
+    def reload_if_changed(self) -> bool:
+        """Перечитывает файл, если он изменился; True — если применён новый снимок."""
+        try:
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp  # битый файл не перечитываем, пока его не поправят
+            snapshot = self._read()
+        except (OSError, ValueError) as e:
+            log.error("config.json не перечитан, работаем на прежнем: %s", e)
+            return False
+        if snapshot == self._snapshot:
+            return False
+        self._snapshot = snapshot
+        log.info("config.json перечитан")
+        for fn in list(self._subscribers):
+            try:
+                fn(snapshot)
+            except Exception as e:
+                log.exception("Ошибка в подписчике конфига %s: %s", getattr(fn, "__qualname__", fn), e)
+        return True
+
+    def subscribe(self, fn: Callable[[Mapping[str, Any]], None]) -> None:
+        self._subscribers.append(fn)
+
+    def start(self) -> None:
+        """Запускает фоновую проверку файла (нужен работающий event loop)."""
+        if self._watcher is None or self._watcher.done():
+            self.reload_seconds = float(self.get().get("CONFIG_RELOAD_SECONDS", self.reload_seconds))
+            self._watcher = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            self.reload_if_changed()
+
+    async def stop(self) -> None:
+        if self._watcher:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+
+
+config_service = ConfigService()
+
+
+def get_config() -> Mapping[str, Any]:
+    return config_service.get()
+
+
+def subscribe(fn: Callable[[Mapping[str, Any]], None]) -> None:
+    config_service.subscribe(fn)
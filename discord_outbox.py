@@ -0,0 +1,268 @@
+# discord_outbox.py
+"""
+Надёжная очередь пересылки постов в Discord (SQLite).
+
+• пост сначала записывается в базу, потом отправляется — упавший запрос или рестарт
+  посреди загрузки не теряют его: после старта неотправленное уходит снова
+  (доставка «хотя бы один раз»);
+• ключ дедупликации — (chat_id, message_id, вебхук): повторный апдейт или повтор того же
+  поста второй раз в очередь не встанут, в том числе уже отправленные;
+• вложения хранятся как file_id Telegram и скачиваются в момент отправки;
+  слишком большие ужимаются (media_pipeline), не вышло — уходят ссылкой;
+• аватар чата в подвале хранится как chat_icon_ref(chat_id): ссылка на файл Telegram
+  содержит токен бота, поэтому в базу она не пишется и получается только перед отправкой;
+• OUTBOX_WORKERS воркеров; неудача — повтор через OUTBOX_BACKOFF_BASE * 2^попытка
+  (не больше OUTBOX_BACKOFF_MAX), после OUTBOX_MAX_ATTEMPTS попыток или отказа
+  Discord (4xx) — запись помечается dead и остаётся в базе для разбора.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional, Set, Tuple
+
+from telegram import Bot
+
+from config_service import get_config
+from discord_webhook import discord_webhooks, DiscordWebhookError
+from media_pipeline import FileRef, fit_media, oversize_note
+from media_relay import relay_files
+from state_store import open_db
+
+log = logging.getLogger("discord_outbox")
+
+_cfg = get_config()
+OUTBOX_DB_PATH = _cfg.get("OUTBOX_DB_PATH") or os.path.join(_cfg.get("DATA_DIR", "data"), "discord_outbox.db")
+OUTBOX_WORKERS = int(_cfg.get("OUTBOX_WORKERS", 4))
+OUTBOX_MAX_ATTEMPTS = int(_cfg.get("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_BACKOFF_BASE = float(_cfg.get("OUTBOX_BACKOFF_BASE", 5))
+OUTBOX_BACKOFF_MAX = float(_cfg.get("OUTBOX_BACKOFF_MAX", 3600))
+OUTBOX_KEEP_DAYS = float(_cfg.get("OUTBOX_KEEP_DAYS", 7))  # сколько помнить отправленное для дедупликации
+
+CHAT_ICON_PREFIX = "tg-chat-icon:"
+IconResolver = Callable[[Bot, int], Awaitable[Optional[str]]]
+
+
+def chat_icon_ref(chat_id: int) -> str:
+    """Заглушка вместо ссылки на аватар чата — её подставит воркер перед отправкой."""
+    return f"{CHAT_ICON_PREFIX}{chat_id}"
+
+
+def _replace_with_links(payload: dict, attached: List[str], links: List[str]) -> None:
+    """Файлы, которые не удалось ужать, заменяются в сообщении ссылкой."""
+    notes = "\n".join(oversize_note(link) for link in links)
+    embeds = payload.get("embeds")
+    if embeds:
+        embed = embeds[0]
+        embed["description"] = f"{embed.get('description', '').strip()}\n\n{notes}".strip()
+        image = embed.get("image", {}).get("url", "")
+        if image.startswith("attachment://") and image[len("attachment://"):] not in attached:
+            del embed["image"]
+    else:
+        payload["content"] = f"{payload.get('content', '')}\n{notes}".strip()
+
+
+class DiscordOutbox:
+    def __init__(self, path: str, *, workers: int = 2):
+        self.path = path
+        self.workers = workers
+        self._conn = open_db(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " dedupe_key TEXT NOT NULL UNIQUE,"
+            " webhook_url TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " files TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"  # pending | sent | dead
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_at REAL NOT NULL,"
+            " last_error TEXT,"
+            " created_at REAL NOT NULL,"
+            " done_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_at)")
+        self._db_lock = threading.Lock()
+        self._claimed: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+        self._resolve_icon: Optional[IconResolver] = None
+        self.stats = {"queued": 0, "duplicates": 0, "sent": 0, "retried": 0, "dead": 0}
+
+    # ---------- база ----------
+    def _db(self, sql: str, params: tuple = ()) -> Tuple[list, int]:
+        with self._db_lock:
+            cur = self._conn.execute(sql, params)
+            return cur.fetchall(), cur.rowcount
+
+    async def _query(self, sql: str, params: tuple = ()):
+        return await asyncio.to_thread(self._db, sql, params)
+
+    # ---------- постановка ----------
+    async def enqueue(self, dedupe_key: str, webhook_url: str, payload: dict, files: List[FileRef]) -> bool:
+        """Ставит пост в очередь; False — такой ключ уже был (дубль)."""
+        now = time.time()
+        _, inserted = await self._query(
+            "INSERT OR IGNORE INTO outbox (dedupe_key, webhook_url, payload, files, next_at, created_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (dedupe_key, webhook_url, json.dumps(payload, ensure_ascii=False), json.dumps(files), now, now),
+        )
+        if not inserted:
+            self.stats["duplicates"] += 1
+            log.info(f"Пост {dedupe_key} уже в очереди или отправлен — пропускаем")
+            return False
+        self.stats["queued"] += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    # ---------- воркеры ----------
+    async def _claim(self) -> Optional[tuple]:
+        rows, _ = await self._query(
+            "SELECT id, dedupe_key, webhook_url, payload, files, attempts FROM outbox"
+            " WHERE status = 'pending' AND next_at <= ? ORDER BY next_at LIMIT ?",
+            (time.time(), len(self._claimed) + 1),
+        )
+        for row in rows:
+            if row[0] not in self._claimed:
+                self._claimed.add(row[0])
+                return row
+        return None
+
+    async def _next_due_in(self) -> Optional[float]:
+        # то, что уже отправляют другие воркеры, не считаем — иначе холостой цикл
+        claimed = tuple(self._claimed)
+        rows, _ = await self._query(
+            "SELECT MIN(next_at) FROM outbox WHERE status = 'pending'"
+            f" AND id NOT IN ({', '.join('?' * len(claimed))})",
+            claimed,
+        )
+        next_at = rows[0][0]
+        return None if next_at is None else max(0.0, next_at - time.time())
+
+    async def _resolve_icons(self, payload: dict) -> None:
+        for embed in payload.get("embeds", []):
+            footer = embed.get("footer", {})
+            ref = footer.get("icon_url", "")
+            if not ref.startswith(CHAT_ICON_PREFIX):
+                continue
+            url = None
+            if self._resolve_icon is not None:
+                try:
+                    url = await self._resolve_icon(self._bot, int(ref[len(CHAT_ICON_PREFIX):]))
+                except Exception as e:
+                    log.debug(f"Аватар чата для подвала не получен: {e}")
+            if url:
+                footer["icon_url"] = url
+            else:
+                del footer["icon_url"]
+
+    async def _deliver(self, webhook_url: str, payload: dict, files: List[FileRef]) -> None:
+        await self._resolve_icons(payload)
+        if not files:
+            await discord_webhooks.send(webhook_url, payload)
+            return
+        async with relay_files(self._bot, [ref[2] for ref in files]) as media:
+            async with fit_media(files, media) as (attachments, links):
+                if links:
+                    _replace_with_links(payload, [a[1] for a in attachments], links)
+                await discord_webhooks.send(webhook_url, payload, files=attachments)
+
+    async def _process(self, row: tuple) -> None:
+        job_id, key, webhook_url, payload, files, attempts = row
+        try:  # запись остаётся «занятой», пока её статус не обновлён в базе
+            try:
+                await self._deliver(webhook_url, json.loads(payload), [tuple(f) for f in json.loads(files)])
+            except Exception as e:
+                await self._failed(job_id, key, attempts + 1, e)
+                return
+            self.stats["sent"] += 1
+            await self._query(
+                "UPDATE outbox SET status = 'sent', attempts = ?, last_error = NULL, done_at = ? WHERE id = ?",
+                (attempts + 1, time.time(), job_id),
+            )
+        finally:
+            self._claimed.discard(job_id)
+
+    async def _failed(self, job_id: int, key: str, attempts: int, error: Exception) -> None:
+        # 4xx — пост битый, повтор не поможет; 429, 5xx и сетевые сбои повторяем здесь с паузой
+        permanent = isinstance(error, DiscordWebhookError) and 400 <= error.status < 500 and error.status != 429
+        if permanent or attempts >= OUTBOX_MAX_ATTEMPTS:
+            self.stats["dead"] += 1
+            log.error(f"Пост {key} не переслан в Discord после {attempts} попыток: {error}")
+            await self._query(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ?, done_at = ? WHERE id = ?",
+                (attempts, str(error)[:500], time.time(), job_id),
+            )
+            return
+        self.stats["retried"] += 1
+        delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+        delay *= random.uniform(0.8, 1.2)
+        log.warning(f"Пост {key}: ошибка отправки ({error}), повтор через {delay:.0f} с")
+        await self._query(
+            "UPDATE outbox SET attempts = ?, next_at = ?, last_error = ? WHERE id = ?",
+            (attempts, time.time() + delay, str(error)[:500], job_id),
+        )
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                row = await self._claim()
+                if row is not None:
+                    await self._process(row)
+                    continue
+                self._wakeup.clear()
+                timeout = await self._next_due_in()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"Ошибка воркера очереди Discord: {e}")
+                await asyncio.sleep(5)
+
+    async def _prune(self) -> None:
+        while True:
+            _, removed = await self._query(
+                "DELETE FROM outbox WHERE status IN ('sent', 'dead') AND done_at < ?",
+                (time.time() - OUTBOX_KEEP_DAYS * 86400,),
+            )
+            if removed:
+                log.info(f"Очередь Discord: удалено старых записей: {removed}")
+            await asyncio.sleep(3600)
+
+    # ---------- жизненный цикл ----------
+    def start(self, bot: Bot, resolve_icon: Optional[IconResolver] = None) -> None:
+        """
+        Запускает воркеры (нужен работающий event loop); неотправленное до рестарта уйдёт первым.
+        resolve_icon(bot, chat_id) превращает chat_icon_ref в ссылку на аватар.
+        """
+        if self._tasks:
+            return
+        self._bot = bot
+        self._resolve_icon = resolve_icon
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._prune()))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        with self._db_lock:
+            self._conn.close()
+
+
+outbox = DiscordOutbox(OUTBOX_DB_PATH, workers=OUTBOX_WORKERS)
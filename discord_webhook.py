@@ -0,0 +1,145 @@
+# discord_webhook.py
+"""
+Долгоживущий клиент Discord-вебхуков для моста Telegram → Discord.
+
+• соединения берутся из общего пула (transport.http_session);
+• лимиты: запоминаем X-RateLimit-Bucket / Remaining / Reset-After каждого вебхука и,
+  если запросов в окне не осталось, ждём сброса заранее, а не ловим 429;
+• 429 всё же пришёл — ждём retry_after (глобальный лимит ставит на паузу все вебхуки) и повторяем;
+• 5xx и сетевые ошибки не повторяем, а сразу отдаём наверх: повторы с паузой — дело очереди
+  (discord_outbox), иначе один битый пост держал бы вебхук занятым для всех остальных;
+• в один вебхук — строго по очереди, разные вебхуки отправляются параллельно.
+
+Использование:
+    await discord_webhooks.send(url, {"embeds": [...]}, files=[("file", "a.jpg", data, "image/jpeg")])
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from transport import http_session
+
+log = logging.getLogger("discord_webhook")
+
+# (имя поля, имя файла, содержимое, content-type);
+# содержимое — bytes или media_relay.RelayedFile (уходит кусками из буфера)
+Attachment = Tuple[str, str, Any, str]
+
+
+class DiscordWebhookError(Exception):
+    def __init__(self, status: int, text: str):
+        super().__init__(f"Discord webhook: HTTP {status}: {text[:200]}")
+        self.status = status
+
+
+class _Bucket:
+    __slots__ = ("remaining", "reset_at")
+
+    def __init__(self):
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0
+
+    def delay(self, now: float) -> float:
+        if self.remaining is not None and self.remaining <= 0 and now < self.reset_at:
+            return self.reset_at - now
+        return 0.0
+
+
+def _build_form(payload: dict, files: List[Attachment]) -> aiohttp.FormData:
+    # FormData одноразовая — на каждую попытку собираем заново
+    form = aiohttp.FormData()
+    form.add_field("payload_json", json.dumps(payload, ensure_ascii=False))
+    for field, filename, content, content_type in files:
+        if hasattr(content, "as_payload"):
+            content = content.as_payload(content_type)
+        form.add_field(field, content, filename=filename, content_type=content_type)
+    return form
+
+
+class DiscordWebhookClient:
+    def __init__(self, *, max_retries: int = 5, timeout: float = 60.0):
+        self.max_retries = max_retries  # сколько раз подождать 429 и повторить
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._bucket_of: Dict[str, str] = {}       # url вебхука -> id бакета Discord
+        self._buckets: Dict[str, _Bucket] = {}
+        self._global_until = 0.0
+        self.stats = {"sent": 0, "waited": 0, "rate_limited": 0, "failed": 0}
+
+    def _bucket(self, url: str) -> _Bucket:
+        key = self._bucket_of.get(url, url)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        return bucket
+
+    def _update_bucket(self, url: str, headers) -> None:
+        bucket_id = headers.get("X-RateLimit-Bucket")
+        if bucket_id:
+            self._bucket_of[url] = bucket_id
+        bucket = self._bucket(url)
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if remaining is not None:
+            bucket.remaining = int(remaining)
+        if reset_after is not None:
+            bucket.reset_at = time.monotonic() + float(reset_after)
+
+    async def _wait_turn(self, url: str) -> None:
+        while True:
+            now = time.monotonic()
+            delay = max(self._global_until - now, self._bucket(url).delay(now))
+            if delay <= 0:
+                return
+            self.stats["waited"] += 1
+            await asyncio.sleep(delay)
+
+    async def send(self, url: str, payload: dict, *, files: Optional[List[Attachment]] = None) -> None:
+        """
+        Отправляет сообщение в вебхук. Повторяет только после 429; ответ с ошибкой —
+        DiscordWebhookError, сетевой сбой — исключение aiohttp/asyncio как есть.
+        """
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            for attempt in range(self.max_retries + 1):
+                await self._wait_turn(url)
+                kwargs = {"data": _build_form(payload, files)} if files else {"json": payload}
+                try:
+                    async with http_session().post(url, timeout=self.timeout, **kwargs) as resp:
+                        self._update_bucket(url, resp.headers)
+                        if resp.status < 300:
+                            self.stats["sent"] += 1
+                            return
+                        text = await resp.text()
+                        if resp.status != 429:
+                            self.stats["failed"] += 1
+                            raise DiscordWebhookError(resp.status, text)
+                        self.stats["rate_limited"] += 1
+                        retry_after = self._retry_after(resp.headers, text)
+                        if resp.headers.get("X-RateLimit-Global"):
+                            self._global_until = time.monotonic() + retry_after
+                        else:
+                            bucket = self._bucket(url)
+                            bucket.remaining = 0
+                            bucket.reset_at = time.monotonic() + retry_after
+                        log.warning("Discord 429: ждём %.1f с (попытка %s)", retry_after, attempt + 1)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self.stats["failed"] += 1
+                    raise
+            self.stats["failed"] += 1
+            raise DiscordWebhookError(429, "лимит запросов не отпускает")
+
+    @staticmethod
+    def _retry_after(headers, text: str) -> float:
+        try:
+            return float(json.loads(text).get("retry_after"))
+        except Exception:
+            return float(headers.get("Retry-After", 1))
+
+
+# Один клиент на процесс: лимиты вебхуков общие для всех отправителей
+discord_webhooks = DiscordWebhookClient()
@@ -0,0 +1,200 @@
+# eventsub_fake.py
+"""
+Локальный фейковый EventSub для офлайн-проверки режима EventSub.
+
+Эмулирует нужный кусок Helix (/users, /streams, /eventsub/subscriptions) и доставляет
+события на webhook бота с настоящей HMAC-подписью — как это делает Twitch.
+
+Запуск:
+    python eventsub_fake.py --port 8081
+
+В config.json бота:
+    "EVENTSUB_ENABLED": true,
+    "EVENTSUB_API_URL": "http://127.0.0.1:8081",
+    "HELIX_API_URL": "http://127.0.0.1:8081",
+    "EVENTSUB_CALLBACK_URL": "http://127.0.0.1:8080/eventsub",
+    "EVENTSUB_SECRET": "любая-строка-10-100-символов"
+
+Отправить событие:
+    curl -X POST 'http://127.0.0.1:8081/trigger?type=stream.online&login=streamer'
+    curl -X POST 'http://127.0.0.1:8081/trigger?type=channel.update&login=streamer&title=Новый&category=IRL'
+    curl -X POST 'http://127.0.0.1:8081/trigger?type=stream.offline&login=streamer'
+"""
+import argparse
+import asyncio
+import json
+import logging
+import uuid
+import zlib
+from datetime import datetime, timezone
+
+import aiohttp
+from aiohttp import web
+
+from twitch_eventsub import (
+    HDR_ID, HDR_SIGNATURE, HDR_TIMESTAMP, HDR_TYPE, SUBSCRIPTION_VERSIONS, sign_message,
+)
+
+log = logging.getLogger("eventsub_fake")
+
+
+def _now_rfc3339() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _user_id(login: str) -> str:
+    # стабильный «id» канала без похода в Twitch
+    return str(zlib.crc32(login.lower().encode()) % 10**9)
+
+
+class FakeEventSub:
+    def __init__(self):
+        self.subscriptions: dict = {}
+        self.live: dict = {}  # login -> объект Get Streams
+        self._tasks: set = set()  # проверки callback, держим ссылки до завершения
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/users", self.get_users)
+        app.router.add_get("/streams", self.get_streams)
+        app.router.add_get("/eventsub/subscriptions", self.list_subscriptions)
+        app.router.add_post("/eventsub/subscriptions", self.create_subscription)
+        app.router.add_delete("/eventsub/subscriptions", self.delete_subscription)
+        app.router.add_post("/trigger", self.trigger)
+        return app
+
+    # ---------- Helix ----------
+    async def get_users(self, request: web.Request) -> web.Response:
+        logins = request.query.getall("login", [])
+        data = [{"id": _user_id(login), "login": login.lower(), "display_name": login} for login in logins]
+        return web.json_response({"data": data})
+
+    async def get_streams(self, request: web.Request) -> web.Response:
+        logins = {login.lower() for login in request.query.getall("user_login", [])}
+        data = [stream for login, stream in self.live.items() if login in logins]
+        return web.json_response({"data": data, "pagination": {}})
+
+    def _track_live(self, sub_type: str, event: dict) -> None:
+        login = event["broadcaster_user_login"]
+        if sub_type == "stream.online":
+            self.live[login] = {
+                "id": event["id"], "user_id": event["broadcaster_user_id"], "user_login": login,
+                "user_name": event["broadcaster_user_name"], "game_id": "509658", "game_name": "Just Chatting",
+                "type": "live", "title": "Тестовый стрим", "viewer_count": 1, "started_at": event["started_at"],
+                "language": "ru", "thumbnail_url": "https://static-cdn.jtvnw.net/previews-ttv/live_user_test-{width}x{height}.jpg",
+                "tags": [], "is_mature": False,
+            }
+        elif sub_type == "stream.offline":
+            self.live.pop(login, None)
+        elif sub_type == "channel.update" and login in self.live:
+            self.live[login].update({"title": event["title"], "game_name": event["category_name"]})
+
+    async def list_subscriptions(self, request: web.Request) -> web.Response:
+        public = [{k: v for k, v in sub.items() if k != "secret"} for sub in self.subscriptions.values()]
+        return web.json_response({"data": public, "total": len(public), "pagination": {}})
+
+    async def create_subscription(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("type") not in SUBSCRIPTION_VERSIONS:
+            return web.json_response({"error": "Bad Request", "message": "unknown type"}, status=400)
+        transport = body.get("transport") or {}
+        sub = {
+            "id": str(uuid.uuid4()),
+            "status": "webhook_callback_verification_pending",
+            "type": body["type"],
+            "version": body.get("version", "1"),
+            "condition": body.get("condition") or {},
+            "created_at": _now_rfc3339(),
+            "transport": {"method": "webhook", "callback": transport.get("callback")},
+            "secret": transport.get("secret", ""),
+        }
+        self.subscriptions[sub["id"]] = sub
+        task = asyncio.create_task(self._verify(sub))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        public = {k: v for k, v in sub.items() if k != "secret"}
+        return web.json_response({"data": [public], "total": len(self.subscriptions)}, status=202)
+
+    async def delete_subscription(self, request: web.Request) -> web.Response:
+        self.subscriptions.pop(request.query.get("id", ""), None)
+        return web.Response(status=204)
+
+    # ---------- доставка ----------
+    async def _post(self, sub: dict, message_type: str, payload: dict) -> tuple:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        message_id = str(uuid.uuid4())
+        timestamp = _now_rfc3339()
+        headers = {
+            HDR_ID: message_id,
+            HDR_TIMESTAMP: timestamp,
+            HDR_SIGNATURE: sign_message(sub["secret"], message_id, timestamp, body),
+            HDR_TYPE: message_type,
+            "Content-Type": "application/json",
+        }
+        async with aiohttp.ClientSession() as session:
+            async with session.post(sub["transport"]["callback"], data=body, headers=headers) as resp:
+                return resp.status, await resp.text()
+
+    async def _verify(self, sub: dict) -> None:
+        challenge = uuid.uuid4().hex
+        public = {k: v for k, v in sub.items() if k != "secret"}
+        try:
+            status, text = await self._post(
+                sub, "webhook_callback_verification", {"challenge": challenge, "subscription": public}
+            )
+            ok = status == 200 and text == challenge
+        except aiohttp.ClientError as e:
+            log.warning("verification %s: %s", sub["type"], e)
+            ok = False
+        sub["status"] = "enabled" if ok else "webhook_callback_verification_failed"
+        log.info("subscription %s %s -> %s", sub["type"], sub["condition"], sub["status"])
+
+    def _event(self, sub_type: str, login: str, query) -> dict:
+        event = {
+            "broadcaster_user_id": _user_id(login),
+            "broadcaster_user_login": login.lower(),
+            "broadcaster_user_name": login,
+        }
+        if sub_type == "stream.online":
+            event.update({"id": uuid.uuid4().hex[:11], "type": "live", "started_at": _now_rfc3339()})
+        elif sub_type == "channel.update":
+            event.update({
+                "title": query.get("title", "Тестовый стрим"),
+                "language": "ru",
+                "category_id": "509658",
+                "category_name": query.get("category", "Just Chatting"),
+                "content_classification_labels": [],
+            })
+        return event
+
+    async def trigger(self, request: web.Request) -> web.Response:
+        sub_type = request.query.get("type", "")
+        login = request.query.get("login", "")
+        if sub_type not in SUBSCRIPTION_VERSIONS or not login:
+            return web.json_response({"error": "нужны type и login"}, status=400)
+
+        event = self._event(sub_type, login, request.query)
+        self._track_live(sub_type, event)
+        delivered = 0
+        for sub in list(self.subscriptions.values()):
+            if sub["type"] != sub_type or sub["status"] != "enabled":
+                continue
+            if sub["condition"].get("broadcaster_user_id") != event["broadcaster_user_id"]:
+                continue
+            public = {k: v for k, v in sub.items() if k != "secret"}
+            status, _ = await self._post(sub, "notification", {"subscription": public, "event": event})
+            delivered += status < 300
+        return web.json_response({"delivered": delivered, "event": event})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Фейковый Twitch EventSub для офлайн-тестов")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    web.run_app(FakeEventSub().build_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# media_pipeline.py
+"""
+Медиа моста Telegram → Discord с учётом лимитов размера.
+
+• plan_media() решает по метаданным Telegram (file_size), ДО скачивания:
+  не влезает в лимит Discord, а ужать нечем или файл больше 20 МБ (Bot API такие
+  не отдаёт) — вместо файла ссылка на пост, такой файл не скачивается вовсе;
+  остальные идут вложениями со своей долей лимита;
+• fit_media() при отправке сверяет настоящий размер скачанного файла (Telegram
+  сообщает file_size не всегда): больше доли — картинки ужимает Pillow, видео и
+  анимации — ffmpeg, не больше MEDIA_WORKERS преобразований одновременно;
+  не вышло, ужать нечем или файл не скачался — вместо него ссылка (или пометка,
+  если у поста нет ссылки).
+
+Лимит Discord на сообщение — DISCORD_UPLOAD_LIMIT_BYTES (10 МБ), в альбоме
+он делится поровну между файлами.
+"""
+import asyncio
+import io
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+from telegram import Message
+
+from config_service import get_config
+from media_relay import RelayedFile
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow большие картинки уходят ссылкой
+    Image = None
+
+log = logging.getLogger("media_pipeline")
+
+_cfg = get_config()
+DISCORD_UPLOAD_LIMIT_BYTES = int(_cfg.get("DISCORD_UPLOAD_LIMIT_BYTES", 10 * 1024 * 1024))
+MEDIA_WORKERS = int(_cfg.get("MEDIA_WORKERS", 2))
+MEDIA_TRANSCODE_TIMEOUT = float(_cfg.get("MEDIA_TRANSCODE_TIMEOUT", 300))
+TELEGRAM_DOWNLOAD_LIMIT_BYTES = 20 * 1024 * 1024  # больше Bot API скачать не даёт
+FFMPEG = shutil.which("ffmpeg")
+
+# (имя поля, имя файла, file_id Telegram, content-type,
+#  {"max_bytes", "kind", "duration", "link", "shrink"} — доля лимита и как ужимать)
+FileRef = Tuple[str, str, str, str, dict]
+
+_pool = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix="media")
+_slots: Optional[asyncio.Semaphore] = None
+
+
+class MediaItem:
+    __slots__ = ("kind", "file_id", "size", "filename", "content_type", "duration")
+
+    def __init__(self, kind: str, file_id: str, size: Optional[int], filename: str, content_type: str,
+                 duration: Optional[int] = None):
+        self.kind = kind
+        self.file_id = file_id
+        self.size = size
+        self.filename = filename
+        self.content_type = content_type
+        self.duration = duration
+
+    @property
+    def shrinkable(self) -> bool:
+        if self.kind == "photo" or (self.kind == "document" and self.content_type in ("image/jpeg", "image/png")):
+            return Image is not None
+        if self.kind in ("video", "animation", "video_note"):
+            return FFMPEG is not None and bool(self.duration)
+        return False
+
+
+def media_of(msg: Message) -> Optional[MediaItem]:
+    """Вложение сообщения (фото, видео, GIF, кружок, документ) или None."""
+    if msg.photo:
+        p = msg.photo[-1]
+        return MediaItem("photo", p.file_id, p.file_size, "telegram_photo.jpg", "image/jpeg")
+    if msg.animation:
+        a = msg.animation
+        return MediaItem("animation", a.file_id, a.file_size, a.file_name or "telegram_animation.mp4",
+                         a.mime_type or "video/mp4", a.duration)
+    if msg.video:
+        v = msg.video
+        return MediaItem("video", v.file_id, v.file_size, v.file_name or "telegram_video.mp4",
+                         v.mime_type or "video/mp4", v.duration)
+    if msg.video_note:
+        v = msg.video_note
+        return MediaItem("video_note", v.file_id, v.file_size, "telegram_video.mp4", "video/mp4", v.duration)
+    if msg.document:
+        d = msg.document
+        return MediaItem("document", d.file_id, d.file_size, d.file_name or "telegram_file",
+                         d.mime_type or "application/octet-stream")
+    return None
+
+
+def _unique_names(items: List[MediaItem]) -> List[str]:
+    if len(items) == 1:
+        return [items[0].filename]
+    names = []
+    for i, item in enumerate(items, 1):
+        stem, ext = os.path.splitext(item.filename)
+        names.append(f"{stem}_{i}{ext}")
+    return names
+
+
+def plan_media(items: List[MediaItem], link: Optional[str]) -> Tuple[List[Tuple[MediaItem, FileRef]], List[MediaItem]]:
+    """Что отправить вложениями (с пометкой, если ужать), а что — ссылкой; только по метаданным."""
+    planned: List[Tuple[MediaItem, FileRef]] = []
+    skipped: List[MediaItem] = []
+    if not items:
+        return planned, skipped
+    share = DISCORD_UPLOAD_LIMIT_BYTES // len(items)
+    for i, (item, name) in enumerate(zip(items, _unique_names(items))):
+        if item.size and item.size > share and (item.size > TELEGRAM_DOWNLOAD_LIMIT_BYTES or not item.shrinkable):
+            skipped.append(item)
+            continue
+        # доля лимита нужна и файлам без file_size: их размер станет известен только после скачивания
+        opts = {"max_bytes": share, "kind": item.kind, "duration": item.duration, "link": link,
+                "shrink": item.shrinkable}
+        planned.append((item, (f"files[{i}]", name, item.file_id, item.content_type, opts)))
+    return planned, skipped
+
+
+def oversize_note(link: Optional[str]) -> str:
+    return "📎 Вложение слишком большое для Discord" + (f": {link}" if link else "")
+
+
+# ---------- ужатие ----------
+def _shrink_image(media: RelayedFile, max_bytes: int) -> Optional[bytes]:
+    # читаем буфер уже в пуле: картинка до лимита Telegram, а после переполнения буфер — на диске
+    data = media.read_at(0, media.size)
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        scale = min(1.0, (max_bytes / len(data)) ** 0.5)
+        for _ in range(6):
+            size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+            out = io.BytesIO()
+            img.resize(size, Image.LANCZOS).save(out, "JPEG", quality=85, optimize=True)
+            if out.tell() <= max_bytes:
+                return out.getvalue()
+            scale *= 0.8
+    return None
+
+
+def _save(media: RelayedFile, path: str) -> None:
+    # ffmpeg нужен настоящий файл: mp4 из трубы читается не всегда
+    with open(path, "wb") as f:
+        offset = 0
+        while chunk := media.read_at(offset, 1024 * 1024):
+            f.write(chunk)
+            offset += len(chunk)
+
+
+async def _shrink_video(media: RelayedFile, max_bytes: int, duration: int, workdir: str) -> Optional[str]:
+    src, dst = os.path.join(workdir, "in"), os.path.join(workdir, "out.mp4")
+    await asyncio.get_running_loop().run_in_executor(_pool, _save, media, src)
+    audio_bps = 64_000
+    # 5% запаса на контейнер; ниже 100 кбит/с смотреть уже нечего
+    video_bps = int(max_bytes * 8 * 0.95 / duration) - audio_bps
+    if video_bps < 100_000:
+        return None
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG, "-y", "-loglevel", "error", "-i", src,
+        "-c:v", "libx264", "-preset", "veryfast", "-b:v", str(video_bps),
+        "-maxrate", str(video_bps), "-bufsize", str(video_bps * 2),
+        "-vf", "scale='min(1280,iw)':-2", "-c:a", "aac", "-b:a", str(audio_bps),
+        "-movflags", "+faststart", dst,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, err = await asyncio.wait_for(proc.communicate(), MEDIA_TRANSCODE_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        log.warning("ffmpeg не уложился в %s с", MEDIA_TRANSCODE_TIMEOUT)
+        return None
+    if proc.returncode != 0:
+        log.warning("ffmpeg: %s", err.decode(errors="replace")[-300:])
+        return None
+    return dst if os.path.getsize(dst) <= max_bytes else None
+
+
+async def _shrink(media: RelayedFile, opts: dict, stack: AsyncExitStack) -> Optional[RelayedFile]:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MEDIA_WORKERS)
+    async with _slots:
+        if opts["kind"] in ("video", "animation", "video_note"):
+            workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="bridge_media_"))
+            path = await _shrink_video(media, opts["max_bytes"], opts["duration"], workdir)
+            if path is None:
+                return None
+            return RelayedFile(stack.enter_context(open(path, "rb")), os.path.getsize(path))
+        shrunk = await asyncio.get_running_loop().run_in_executor(_pool, _shrink_image, media, opts["max_bytes"])
+        if shrunk is None:
+            return None
+        return RelayedFile(io.BytesIO(shrunk), len(shrunk))
+
+
+@asynccontextmanager
+async def fit_media(files: List[FileRef], media: List[Optional[RelayedFile]]) -> AsyncIterator[Tuple[list, List[str]]]:
+    """
+    Вложения для discord_webhooks.send: файлы больше своей доли лимита ужимаются параллельно.
+    Второй элемент — ссылки на то, что не влезло (None — у поста нет ссылки).
+    media[i] is None — файл не скачался. Временные файлы удаляются на выходе.
+    """
+    async with AsyncExitStack() as stack:
+        async def one(ref: FileRef, m: Optional[RelayedFile]) -> Tuple[Optional[RelayedFile], str, str]:
+            _, name, _, content_type, opts = ref
+            if m is None:
+                return None, name, content_type
+            if m.size <= opts["max_bytes"]:
+                return m, name, content_type
+            if not opts["shrink"]:
+                log.info("%s: %s байт не влезает в %s, ужать нечем", name, m.size, opts["max_bytes"])
+                return None, name, content_type
+            try:
+                shrunk = await _shrink(m, opts, stack)
+            except Exception as e:
+                log.warning("Не удалось ужать %s: %s", name, e)
+                shrunk = None
+            # после ужатия картинка — всегда JPEG, видео — MP4
+            new_type = "video/mp4" if opts["kind"] in ("video", "animation", "video_note") else "image/jpeg"
+            new_name = os.path.splitext(name)[0] + (".mp4" if new_type == "video/mp4" else ".jpg")
+            return shrunk, new_name, new_type
+
+        fitted = await asyncio.gather(*(one(ref, m) for ref, m in zip(files, media)))
+        attachments, links = [], []
+        for ref, (m, name, content_type) in zip(files, fitted):
+            if m is None:
+                links.append(ref[4]["link"])
+                continue
+            attachments.append((ref[0], name, m, content_type))
+        yield attachments, links
@@ -0,0 +1,149 @@
+# media_relay.py
+"""
+Пересылка файлов из Telegram в Discord без лишних копий в памяти.
+
+• файл качается кусками прямо с серверов Telegram (общая aiohttp-сессия)
+  во временный буфер: до MEDIA_SPOOL_MEMORY_BYTES — в памяти, больше — на диске;
+• в multipart-запрос Discord буфер тоже уходит кусками — целиком файл в памяти
+  не собирается ни разу; при повторе после 429 он просто читается заново;
+• запись в буфер и чтение из него идут в потоке: после переполнения это диск,
+  и event loop его не ждёт;
+• MEDIA_INFLIGHT_BYTES — общий лимит байт медиа «в пути»: когда он выбран,
+  следующие загрузки ждут, пока закончатся текущие.
+
+Использование:
+    async with relay_file(bot, file_id) as media:
+        await discord_webhooks.send(url, payload, files=[("file", "a.mp4", media, "video/mp4")])
+"""
+import asyncio
+import logging
+import shutil
+import threading
+from contextlib import ExitStack, asynccontextmanager
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, List, Optional
+
+import aiohttp
+from aiohttp.payload import Payload
+from telegram import Bot
+from telegram.error import BadRequest
+
+from config_service import get_config
+from transport import http_session
+
+log = logging.getLogger("media_relay")
+
+_cfg = get_config()
+MEDIA_SPOOL_MEMORY_BYTES = int(_cfg.get("MEDIA_SPOOL_MEMORY_BYTES", 1024 * 1024))
+MEDIA_INFLIGHT_BYTES = int(_cfg.get("MEDIA_INFLIGHT_BYTES", 64 * 1024 * 1024))
+CHUNK_SIZE = 64 * 1024
+
+_DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+
+
+class ByteBudget:
+    """Сколько байт медиа одновременно может быть в обработке."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        size = max(0, min(size, self.limit))  # файл больше лимита пройдёт один
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight + size <= self.limit)
+            self.in_flight += size
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self.in_flight -= size
+                self._cond.notify_all()
+
+
+media_budget = ByteBudget(MEDIA_INFLIGHT_BYTES)
+
+
+class RelayedFile:
+    """Скачанный файл во временном буфере; as_payload() — новое тело на каждую попытку отправки."""
+
+    def __init__(self, spool: SpooledTemporaryFile, size: int):
+        self._spool = spool
+        self.size = size
+        self._lock = threading.Lock()  # seek+read из разных потоков не должны перемешаться
+
+    def read_at(self, offset: int, n: int) -> bytes:
+        with self._lock:
+            self._spool.seek(offset)
+            return self._spool.read(n)
+
+    def as_payload(self, content_type: Optional[str] = None) -> Payload:
+        return _SpoolPayload(self, content_type=content_type)
+
+
+class _SpoolPayload(Payload):
+    # свой Payload, потому что стандартный для файлов закрывает его после отправки
+    def __init__(self, media: RelayedFile, **kwargs):
+        super().__init__(media, **kwargs)
+        self._size = media.size
+
+    async def write(self, writer) -> None:
+        offset = 0
+        while True:
+            chunk = await asyncio.to_thread(self._value.read_at, offset, CHUNK_SIZE)
+            if not chunk:
+                return
+            offset += len(chunk)
+            await writer.write(chunk)
+
+
+async def _download(file_path: str, spool: SpooledTemporaryFile) -> int:
+    if not file_path.startswith(("http://", "https://")):
+        # локальный Bot API сервер отдаёт путь к файлу на диске
+        with open(file_path, "rb") as src:
+            await asyncio.to_thread(shutil.copyfileobj, src, spool, CHUNK_SIZE)
+        return spool.tell()
+
+    size = 0
+    async with http_session().get(file_path, timeout=_DOWNLOAD_TIMEOUT) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+            await asyncio.to_thread(spool.write, chunk)
+            size += len(chunk)
+    return size
+
+
+async def _get_file(bot: Bot, file_id: str):
+    try:
+        return await bot.get_file(file_id)
+    except BadRequest as e:
+        # «file is too big» (больше 20 МБ Bot API не отдаёт) или битый file_id — повтор не поможет
+        log.warning("Файл %s из Telegram не получить: %s", file_id, e)
+        return None
+
+
+@asynccontextmanager
+async def relay_files(bot: Bot, file_ids: List[str]) -> AsyncIterator[List[Optional[RelayedFile]]]:
+    """
+    Скачивает файлы Telegram параллельно, каждый в свой буфер; буферы удаляются на выходе.
+    Лимит резервируется сразу на все файлы, чтобы альбом не застрял, выбрав его наполовину.
+    Файл, который Telegram отдать отказался, — None на его месте.
+    """
+    tg_files = await asyncio.gather(*(_get_file(bot, file_id) for file_id in file_ids))
+    found = [f for f in tg_files if f is not None]
+    expected = sum(f.file_size or MEDIA_SPOOL_MEMORY_BYTES for f in found)
+    async with media_budget.reserve(expected):
+        with ExitStack() as stack:
+            spools = [stack.enter_context(SpooledTemporaryFile(max_size=MEDIA_SPOOL_MEMORY_BYTES)) for _ in found]
+            sizes = await asyncio.gather(*(_download(f.file_path, spool) for f, spool in zip(found, spools)))
+            log.debug("Скачано файлов: %s, %s байт", len(sizes), sum(sizes))
+            downloaded = iter([RelayedFile(spool, size) for spool, size in zip(spools, sizes)])
+            yield [None if f is None else next(downloaded) for f in tg_files]
+
+
+@asynccontextmanager
+async def relay_file(bot: Bot, file_id: str) -> AsyncIterator[Optional[RelayedFile]]:
+    async with relay_files(bot, [file_id]) as files:
+        yield files[0]
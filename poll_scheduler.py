@@ -0,0 +1,170 @@
+# poll_scheduler.py
+"""
+Адаптивный интервал опроса Twitch.
+
+Запоминает, когда стримеры выходили в эфир, и (опционально) берёт расписание
+канала из Twitch. В «вероятных окнах старта» опрашивает часто, вне их — редко.
+Джиттер не даёт нескольким инстансам синхронизироваться.
+
+Каждая смена режима пишется в лог с причиной, текущее состояние отдаёт status()
+(его показывает /stats poll в группе).
+"""
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional
+
+log = logging.getLogger("poll_scheduler")
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def _minute_of_week(dt: datetime) -> int:
+    dt = dt.astimezone(timezone.utc)
+    return dt.weekday() * MINUTES_PER_DAY + dt.hour * 60 + dt.minute
+
+
+def _circular_distance(a: int, b: int, period: int) -> int:
+    d = abs(a - b) % period
+    return min(d, period - d)
+
+
+class PollScheduler:
+    def __init__(
+        self,
+        *,
+        path: Optional[str] = None,
+        fast_seconds: float = 10,
+        slow_seconds: float = 300,
+        live_seconds: float = 60,
+        lead_minutes: int = 15,
+        window_minutes: int = 30,
+        daily_min_samples: int = 3,
+        jitter: float = 0.1,
+        history_limit: int = 200,
+    ):
+        self.path = path
+        self.fast_seconds = fast_seconds
+        self.slow_seconds = slow_seconds
+        self.live_seconds = live_seconds
+        self.lead_minutes = lead_minutes
+        self.window_minutes = window_minutes
+        self.daily_min_samples = daily_min_samples
+        self.jitter = jitter
+        self.history_limit = history_limit
+
+        self.starts: List[datetime] = []       # прошлые выходы в эфир (UTC)
+        self.scheduled: List[datetime] = []    # ближайшие старты из расписания Twitch
+        self.effective_interval: float = slow_seconds
+        self.mode: str = "slow"
+        self.reason: str = "ещё не опрашивали"
+        self.stats = {"polls": 0, "fast": 0, "slow": 0, "live": 0, "eventsub": 0}
+        self._load()
+
+    # ---------- история ----------
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.starts = [datetime.fromisoformat(x) for x in data.get("starts", [])]
+        except Exception as e:
+            log.warning("Не удалось прочитать историю стартов %s: %s", self.path, e)
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"starts": [x.isoformat() for x in self.starts]}, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log.warning("Не удалось сохранить историю стартов %s: %s", self.path, e)
+
+    def record_go_live(self, started_at: datetime) -> None:
+        if started_at.tzinfo is None:
+            started_at = started_at.replace(tzinfo=timezone.utc)
+        # один и тот же эфир (рестарт бота, несколько инстансов) не дублируем
+        if any(abs((started_at - x).total_seconds()) < 60 for x in self.starts):
+            return
+        self.starts.append(started_at)
+        self.starts = self.starts[-self.history_limit:]
+        self._save()
+
+    def set_scheduled_starts(self, starts: Iterable[datetime]) -> None:
+        self.scheduled = sorted(s if s.tzinfo else s.replace(tzinfo=timezone.utc) for s in starts)
+
+    # ---------- окна ----------
+    def in_start_window(self, now: Optional[datetime] = None) -> bool:
+        return self._start_window(now) is not None
+
+    def _start_window(self, now: Optional[datetime] = None) -> Optional[str]:
+        """Почему сейчас окно старта (None — не окно)."""
+        now = now or datetime.now(timezone.utc)
+
+        # явное расписание Twitch
+        for start in self.scheduled:
+            if start - timedelta(minutes=self.lead_minutes) <= now <= start + timedelta(minutes=self.window_minutes):
+                return f"старт по расписанию Twitch в {start:%H:%M} UTC"
+
+        # окно асимметричное: чуть до привычного старта и подольше после (опоздания)
+        half = (self.lead_minutes + self.window_minutes) // 2
+        shift = (self.window_minutes - self.lead_minutes) // 2
+        now_mow = _minute_of_week(now)
+        target = (now_mow - shift) % MINUTES_PER_WEEK
+
+        # тот же день недели и время, что у прошлых эфиров
+        if any(_circular_distance(target, _minute_of_week(s), MINUTES_PER_WEEK) <= half for s in self.starts):
+            return "в этот день недели и час уже выходили в эфир"
+
+        # привычное время суток вне зависимости от дня — если набралось достаточно примеров
+        target_day = target % MINUTES_PER_DAY
+        near = sum(
+            1 for s in self.starts
+            if _circular_distance(target_day, _minute_of_week(s) % MINUTES_PER_DAY, MINUTES_PER_DAY) <= half
+        )
+        if near >= self.daily_min_samples:
+            return f"в это время суток выходили в эфир {near} раз"
+        return None
+
+    def next_interval(
+        self, any_live: bool, now: Optional[datetime] = None, reconcile_seconds: Optional[float] = None
+    ) -> float:
+        """
+        Интервал до следующего опроса. reconcile_seconds — режим EventSub: о старте сообщит
+        Twitch, а опрос вне эфира нужен только как редкая сверка.
+        """
+        if any_live:
+            mode, base, reason = "live", self.live_seconds, "идёт эфир"
+        elif reconcile_seconds is not None:
+            mode, base, reason = "eventsub", reconcile_seconds, "о старте сообщит EventSub, опрос — только сверка"
+        else:
+            reason = self._start_window(now)
+            if reason is not None:
+                mode, base = "fast", self.fast_seconds
+            else:
+                mode, base, reason = "slow", self.slow_seconds, "вне привычных окон старта"
+
+        interval = base * (1 + random.uniform(-self.jitter, self.jitter))
+        if mode != self.mode or reason != self.reason:
+            log.info("Интервал опроса: %s → %s (~%.0f с): %s", self.mode, mode, base, reason)
+        self.mode = mode
+        self.reason = reason
+        self.effective_interval = interval
+        self.stats["polls"] += 1
+        self.stats[mode] += 1
+        return interval
+
+    def status(self) -> dict:
+        """Текущий режим, причина и интервал — для /stats poll и часового лога."""
+        return {
+            "mode": self.mode,
+            "reason": self.reason,
+            "interval": round(self.effective_interval),
+            **self.stats,
+        }
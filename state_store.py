@@ -0,0 +1,384 @@
+# state_store.py
+"""
+Небольшое durable-хранилище ключ-значение на SQLite (WAL) с отложенной записью.
+
+• set()/delete() только помечают ключ «грязным» — запись идёт пачкой в одной транзакции
+  фоновым флашером (раз в flush_interval) или по явному flush();
+• get() сначала смотрит в ещё не записанные изменения, потом в базу — читатели
+  всегда видят последнее значение;
+• значения — JSON; ключи разложены по пространствам имён (ns);
+• PersistentDict / PersistentSet — словарь и множество поверх одного ns для bot_data:
+  значения читаются из базы по ключу при первом обращении (старт не зависит от
+  числа записей), изменения пишутся только по изменённым ключам; в памяти держится
+  не больше cache_size последних ключей; обработчики перед обращением вызывают
+  await preload(d, key) — чтение из базы уходит в поток и не держит event loop;
+• expire(ns, max_age) — ключи ns, не менявшиеся дольше max_age секунд, раз в
+  prune_interval удаляются из базы (например, старые сообщения с кнопками);
+  PersistentDict с max_age не отдаёт такие ключи и до чистки, в том числе из кэша.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping, MutableSet
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+log = logging.getLogger("state_store")
+
+_DELETED = object()
+
+
+def open_db(path: str) -> sqlite3.Connection:
+    """Соединение SQLite с настройками для долгоживущего процесса (WAL, автокоммит)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class StateStore:
+    def __init__(self, path: str, flush_interval: float = 2.0, prune_interval: float = 3600.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.prune_interval = prune_interval
+        self._conn = open_db(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        self._db_lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], Any] = {}   # (ns, key) -> json | _DELETED
+        self._inflight: Dict[Tuple[str, str], Any] = {}  # то, что прямо сейчас пишется в базу
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._closed = False
+        self._ttl: Dict[str, float] = {}  # ns -> сколько секунд хранить ключ без изменений
+        self._pruned_at = 0.0
+
+    # ---------- чтение ----------
+    def _unsaved(self, k: Tuple[str, str]):
+        """Ещё не записанное значение ключа: (json | _DELETED, время изменения) или None."""
+        if k in self._pending:
+            return self._pending[k], time.time()
+        if k in self._inflight:
+            return self._inflight[k], time.time()
+        return None
+
+    def _read(self, k: Tuple[str, str]) -> Tuple[Any, float]:
+        with self._db_lock:
+            row = self._conn.execute("SELECT value, updated_at FROM kv WHERE ns = ? AND key = ?", k).fetchone()
+        return (row[0], row[1]) if row else (_DELETED, 0.0)
+
+    def _lookup(self, ns: str, key: str) -> Tuple[Any, float]:
+        k = (ns, key)
+        return self._unsaved(k) or self._read(k)
+
+    async def _alookup(self, ns: str, key: str) -> Tuple[Any, float]:
+        k = (ns, key)
+        found = self._unsaved(k) or await asyncio.to_thread(self._read, k)
+        # пока читали в потоке, ключ могли изменить — свежее значение важнее
+        return self._unsaved(k) or found
+
+    @staticmethod
+    def _decode(found: Tuple[Any, float], default: Any) -> Tuple[Any, float]:
+        raw, updated_at = found
+        return (default if raw is _DELETED else json.loads(raw)), updated_at
+
+    def get(self, ns: str, key: str, default: Any = None) -> Any:
+        return self._decode(self._lookup(ns, str(key)), default)[0]
+
+    def contains(self, ns: str, key: str) -> bool:
+        return self._lookup(ns, str(key))[0] is not _DELETED
+
+    async def acontains(self, ns: str, key: str) -> bool:
+        return (await self._alookup(ns, str(key)))[0] is not _DELETED
+
+    def entry(self, ns: str, key: str, default: Any = None) -> Tuple[Any, float]:
+        """Значение ключа и время его последнего изменения (time.time())."""
+        return self._decode(self._lookup(ns, str(key)), default)
+
+    async def aentry(self, ns: str, key: str, default: Any = None) -> Tuple[Any, float]:
+        """Как entry(), но база читается в потоке — для обработчиков на event loop."""
+        return self._decode(await self._alookup(ns, str(key)), default)
+
+    def keys(self, ns: str) -> Iterator[str]:
+        with self._db_lock:
+            stored = [r[0] for r in self._conn.execute("SELECT key FROM kv WHERE ns = ?", (ns,))]
+        overlay = {**self._inflight, **self._pending}
+        seen = set()
+        for key in stored:
+            seen.add(key)
+            if overlay.get((ns, key), None) is not _DELETED:
+                yield key
+        for (n, key), raw in overlay.items():
+            if n == ns and key not in seen and raw is not _DELETED:
+                yield key
+
+    def count(self, ns: str) -> int:
+        return sum(1 for _ in self.keys(ns))
+
+    # ---------- запись ----------
+    def set(self, ns: str, key: str, value: Any) -> None:
+        if self._closed:
+            log.warning("Хранилище уже закрыто, %s/%s не сохранено", ns, key)
+            return
+        self._pending[(ns, str(key))] = json.dumps(value, ensure_ascii=False)
+        self._kick()
+
+    def delete(self, ns: str, key: str) -> None:
+        if self._closed:
+            log.warning("Хранилище уже закрыто, удаление %s/%s не сохранено", ns, key)
+            return
+        self._pending[(ns, str(key))] = _DELETED
+        self._kick()
+
+    def _kick(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _write_batch(self, batch: Dict[Tuple[str, str], Any]) -> None:
+        now = time.time()
+        upserts = [(ns, key, raw, now) for (ns, key), raw in batch.items() if raw is not _DELETED]
+        deletes = [(ns, key) for (ns, key), raw in batch.items() if raw is _DELETED]
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                if upserts:
+                    self._conn.executemany(
+                        "INSERT INTO kv (ns, key, value, updated_at) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at",
+                        upserts,
+                    )
+                if deletes:
+                    self._conn.executemany("DELETE FROM kv WHERE ns = ? AND key = ?", deletes)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def flush(self) -> None:
+        """Записывает все накопленные изменения одной транзакцией."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception as e:
+                log.error("Не удалось записать состояние (%s ключей): %s", len(batch), e)
+                # вернём несохранённое обратно, не затирая более свежие изменения
+                for k, raw in batch.items():
+                    self._pending.setdefault(k, raw)
+                self._kick()
+            finally:
+                self._inflight = {}
+
+    # ---------- устаревшие ключи ----------
+    def expire(self, ns: str, max_age: float) -> None:
+        """Ключи ns, не менявшиеся дольше max_age секунд, будут удаляться фоновой чисткой."""
+        self._ttl[ns] = max_age
+        self._kick()
+
+    def _delete_expired(self) -> int:
+        now = time.time()
+        removed = 0
+        with self._db_lock:
+            for ns, max_age in self._ttl.items():
+                cur = self._conn.execute("DELETE FROM kv WHERE ns = ? AND updated_at < ?", (ns, now - max_age))
+                removed += cur.rowcount
+        return removed
+
+    async def prune(self) -> None:
+        """Удаляет из базы устаревшие ключи (см. expire)."""
+        try:
+            removed = await asyncio.to_thread(self._delete_expired)
+        except Exception as e:
+            log.error("Не удалось удалить устаревшее состояние: %s", e)
+            return
+        if removed:
+            log.info("Удалено устаревших записей состояния: %s", removed)
+
+    # ---------- жизненный цикл ----------
+    def start(self) -> None:
+        """Запускает фоновый флашер (нужен работающий event loop)."""
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            if self._pending:
+                self._wakeup.set()
+            self._flusher = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            # без изменений флашер просыпается только ради чистки устаревших ключей
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.prune_interval if self._ttl else None)
+            except asyncio.TimeoutError:
+                pass
+            if self._wakeup.is_set():
+                # небольшая пауза собирает соседние изменения в одну транзакцию
+                await asyncio.sleep(self.flush_interval)
+                self._wakeup.clear()
+                await self.flush()
+            if self._ttl and time.monotonic() - self._pruned_at >= self.prune_interval:
+                self._pruned_at = time.monotonic()
+                await self.prune()
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+class _LRUCache(OrderedDict):
+    """Кэш последних ключей: переполнившись, забывает самый давно тронутый (в базе он остаётся)."""
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.limit:
+            self.popitem(last=False)
+
+
+class PersistentDict(MutableMapping):
+    """
+    dict поверх StateStore. Прочитанные значения кэшируются (не больше cache_size ключей);
+    вложенное значение, изменённое на месте (info["x"] = 1), нужно присвоить заново —
+    d[key] = info, иначе изменение не попадёт в базу.
+    max_age — ключи, не менявшиеся дольше max_age секунд, удаляются из базы
+    и сразу перестают читаться (в том числе из кэша).
+    """
+
+    def __init__(self, store: StateStore, ns: str, key_type: Callable[[str], Any] = str,
+                 *, max_age: Optional[float] = None, cache_size: int = 1024):
+        self._store = store
+        self._ns = ns
+        self._key_type = key_type
+        self._max_age = max_age
+        self._cache = _LRUCache(cache_size)  # key -> (значение | _DELETED, время изменения)
+        if max_age is not None:
+            store.expire(ns, max_age)
+
+    async def load(self, *keys) -> None:
+        """Читает ключи в кэш в потоке: следующее обращение к ним не пойдёт в базу."""
+        for key in keys:
+            if key not in self._cache:
+                found = await self._store.aentry(self._ns, key, _DELETED)
+                if key not in self._cache:  # пока читали, ключ могли записать
+                    self._cache[key] = found
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            value, updated_at = self._cache[key]
+        else:
+            value, updated_at = self._cache[key] = self._store.entry(self._ns, key, _DELETED)
+        if value is _DELETED or (self._max_age is not None and time.time() - updated_at > self._max_age):
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self._cache[key] = (value, time.time())
+        self._store.set(self._ns, key, value)
+
+    def __delitem__(self, key) -> None:
+        self[key]  # KeyError, если ключа нет
+        self._cache[key] = (_DELETED, time.time())
+        self._store.delete(self._ns, key)
+
+    def __iter__(self) -> Iterator:
+        return (self._key_type(k) for k in list(self._store.keys(self._ns)))
+
+    def __len__(self) -> int:
+        return self._store.count(self._ns)
+
+
+class PersistentSet(MutableSet):
+    """set поверх StateStore: проверка принадлежности — один ключ в базе, без загрузки всего множества."""
+
+    def __init__(self, store: StateStore, ns: str, key_type: Callable[[str], Any] = str, *, cache_size: int = 1024):
+        self._store = store
+        self._ns = ns
+        self._key_type = key_type
+        self._cache = _LRUCache(cache_size)
+
+    async def load(self, *items) -> None:
+        """Читает принадлежность в кэш в потоке: следующая проверка не пойдёт в базу."""
+        for item in items:
+            if item not in self._cache:
+                found = await self._store.acontains(self._ns, item)
+                if item not in self._cache:  # пока читали, элемент могли добавить или убрать
+                    self._cache[item] = found
+
+    def __contains__(self, item) -> bool:
+        if item not in self._cache:
+            self._cache[item] = self._store.contains(self._ns, item)
+        return self._cache[item]
+
+    def add(self, item) -> None:
+        if item not in self:
+            self._cache[item] = True
+            self._store.set(self._ns, item, 1)
+
+    def discard(self, item) -> None:
+        if item in self:
+            self._cache[item] = False
+            self._store.delete(self._ns, item)
+
+    def __iter__(self) -> Iterator:
+        return (self._key_type(k) for k in list(self._store.keys(self._ns)))
+
+    def __len__(self) -> int:
+        return self._store.count(self._ns)
+
+
+async def preload(container, *keys: Hashable) -> None:
+    """Подгружает ключи PersistentDict / PersistentSet без блокировки loop; обычные dict и set пропускает."""
+    load = getattr(container, "load", None)
+    if load is not None:
+        await load(*keys)
+
+
+def state_db_path(cfg) -> str:
+    return cfg.get("STATE_DB_PATH") or os.path.join(cfg.get("DATA_DIR", "data"), "bot_state.db")
+
+
+_stores: Dict[str, StateStore] = {}
+
+
+def get_store(path: str) -> StateStore:
+    """Одно хранилище на файл базы — модули бота делят его между собой."""
+    key = os.path.abspath(path)
+    store = _stores.get(key)
+    if store is None:
+        store = _stores[key] = StateStore(path)
+    return store
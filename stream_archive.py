@@ -0,0 +1,259 @@
+# stream_archive.py
+"""
+Архив завершённых стримов (только дописывается).
+
+• sessions — одна строка на эфир: время начала/конца, последнее название, итог по зрителям
+  и сам ряд зрителей, сжатый дельта-кодированием (zigzag + varint: обычно 1–2 байта на точку);
+• segments — смены названия/категории внутри эфира (смещение от начала в секундах,
+  seq — порядковый номер смены: за одну секунду их может быть несколько);
+• categories — «индекс» по категориям: сколько секунд эфира ушло на игру, ключ — имя в casefold.
+
+Индексы: sessions(started_at), sessions(login, started_at), categories(category_key, started_at) —
+/laststream и /stats game читают только нужный диапазон, а не всю историю.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from state_store import open_db
+from viewer_stats import ViewerSeries
+
+log = logging.getLogger("stream_archive")
+
+MAX_CATEGORY_CANDIDATES = 5  # сколько вариантов предложить, если по префиксу подходит несколько игр
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS sessions (
+        id INTEGER PRIMARY KEY,
+        login TEXT NOT NULL,
+        started_at INTEGER NOT NULL,
+        ended_at INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        peak INTEGER, avg INTEGER, min INTEGER, samples INTEGER NOT NULL DEFAULT 0,
+        series_step INTEGER NOT NULL DEFAULT 1,
+        series BLOB
+    )""",
+    "CREATE INDEX IF NOT EXISTS sessions_by_date ON sessions (started_at)",
+    "CREATE INDEX IF NOT EXISTS sessions_by_login ON sessions (login, started_at)",
+    """CREATE TABLE IF NOT EXISTS segments (
+        session_id INTEGER NOT NULL,
+        offset_s INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        category TEXT NOT NULL,
+        PRIMARY KEY (session_id, offset_s, seq)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS categories (
+        category_key TEXT NOT NULL,
+        started_at INTEGER NOT NULL,
+        session_id INTEGER NOT NULL,
+        category TEXT NOT NULL,
+        seconds INTEGER NOT NULL,
+        PRIMARY KEY (category_key, started_at, session_id)
+    ) WITHOUT ROWID""",
+)
+
+
+def category_key(name: str) -> str:
+    return " ".join((name or "").split()).casefold()
+
+
+# ---------- дельта-кодирование ряда ----------
+def encode_series(points: Iterable[int]) -> bytes:
+    out = bytearray()
+    prev = 0
+    for value in points:
+        delta = int(value) - prev
+        prev = int(value)
+        z = (delta << 1) ^ (delta >> 63)  # zigzag: маленькие по модулю дельты -> маленькие числа
+        while True:
+            byte = z & 0x7F
+            z >>= 7
+            if z:
+                out.append(byte | 0x80)
+            else:
+                out.append(byte)
+                break
+    return bytes(out)
+
+
+def decode_series(data: Optional[bytes]) -> List[int]:
+    points = []
+    prev = z = shift = 0
+    for byte in data or b"":
+        z |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        prev += (z >> 1) ^ -(z & 1)
+        points.append(prev)
+        z = shift = 0
+    return points
+
+
+def _ts(value: datetime) -> int:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+class StreamArchive:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = open_db(path)
+        self._lock = threading.Lock()
+        with self._lock:
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ---------- запись ----------
+    def record_session(
+        self,
+        login: str,
+        started_at: datetime,
+        ended_at: datetime,
+        segments: List[list],
+        viewers: ViewerSeries,
+    ) -> int:
+        """
+        Сохраняет завершённый эфир. segments — [[unix-время, название, категория], ...]
+        в порядке смены; первая запись — состояние на старте.
+        """
+        start, end = _ts(started_at), max(_ts(ended_at), _ts(started_at))
+        summary = viewers.summary() or {}
+        title = segments[-1][1] if segments else ""
+
+        # сколько секунд эфира пришлось на каждую категорию
+        per_category: Dict[str, list] = {}
+        for i, (at, _title, category) in enumerate(segments):
+            seg_end = segments[i + 1][0] if i + 1 < len(segments) else end
+            seconds = max(0, int(seg_end) - max(int(at), start))
+            entry = per_category.setdefault(category_key(category), [category, 0])
+            entry[1] += seconds
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                cur = self._conn.execute(
+                    "INSERT INTO sessions (login, started_at, ended_at, title, peak, avg, min, samples,"
+                    " series_step, series) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        login, start, end, title,
+                        summary.get("peak"), summary.get("avg"), summary.get("min"), summary.get("samples", 0),
+                        viewers.step, encode_series(viewers.points),
+                    ),
+                )
+                session_id = cur.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO segments (session_id, offset_s, seq, title, category) VALUES (?, ?, ?, ?, ?)",
+                    [(session_id, max(0, int(at) - start), seq, t, c) for seq, (at, t, c) in enumerate(segments)],
+                )
+                self._conn.executemany(
+                    "INSERT INTO categories (category_key, started_at, session_id, category, seconds)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    [(key, start, session_id, name, seconds) for key, (name, seconds) in per_category.items()],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        log.info("Эфир %s сохранён в архив (id %s)", login, session_id)
+        return session_id
+
+    # ---------- чтение ----------
+    def _session(self, row) -> dict:
+        (session_id, login, started_at, ended_at, title, peak, avg, low, samples, step, series) = row
+        segments = self._conn.execute(
+            "SELECT offset_s, title, category FROM segments WHERE session_id = ? ORDER BY offset_s, seq",
+            (session_id,),
+        ).fetchall()
+        return {
+            "id": session_id,
+            "login": login,
+            "started_at": started_at,
+            "ended_at": ended_at,
+            "title": title,
+            "peak": peak,
+            "avg": avg,
+            "min": low,
+            "samples": samples,
+            "series_step": step,
+            "series": decode_series(series),
+            "segments": segments,
+        }
+
+    def last_session(self, login: Optional[str] = None) -> Optional[dict]:
+        query = "SELECT * FROM sessions"
+        params: tuple = ()
+        if login:
+            query += " WHERE login = ?"
+            params = (login.lower(),)
+        query += " ORDER BY started_at DESC LIMIT 1"
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+            return self._session(row) if row else None
+
+    def category_stats(self, name: str) -> Optional[dict]:
+        """
+        Итог по категории: точное совпадение, иначе — единственная категория с таким
+        префиксом (оба поиска идут по индексу). Если по префиксу подходит несколько
+        игр, они не складываются: вернётся {"candidates": [названия]}.
+        """
+        key = category_key(name)
+        if not key:
+            return None
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT 1 FROM categories WHERE category_key = ? LIMIT 1", (key,)
+            ).fetchone()
+            if not found:
+                keys = self._conn.execute(
+                    "SELECT category_key, MAX(category) FROM categories"
+                    " WHERE category_key >= ? AND category_key < ?"
+                    " GROUP BY category_key ORDER BY COUNT(*) DESC LIMIT ?",
+                    (key, key + "\uffff", MAX_CATEGORY_CANDIDATES + 1),
+                ).fetchall()
+                if not keys:
+                    return None
+                if len(keys) > 1:
+                    return {"candidates": [category for _, category in keys[:MAX_CATEGORY_CANDIDATES]]}
+                key = keys[0][0]
+
+            count, seconds, peak, avg, first, last, category = self._conn.execute(
+                "SELECT COUNT(*), SUM(c.seconds), MAX(s.peak), AVG(s.avg), MIN(c.started_at),"
+                " MAX(c.started_at), MAX(c.category)"
+                " FROM categories c JOIN sessions s ON s.id = c.session_id"
+                " WHERE c.category_key = ?",
+                (key,),
+            ).fetchone()
+        return {
+            "category": category,
+            "sessions": count,
+            "seconds": seconds or 0,
+            "peak": peak,
+            "avg": round(avg) if avg is not None else None,
+            "first_started_at": first,
+            "last_started_at": last,
+        }
+
+
+def archive_path(cfg: dict) -> str:
+    return cfg.get("STREAM_ARCHIVE_PATH") or os.path.join(cfg.get("DATA_DIR", "data"), "stream_archive.db")
+
+
+_archives: Dict[str, StreamArchive] = {}
+
+
+def get_archive(path: str) -> StreamArchive:
+    """Один архив на файл: пишет анонсер, читают команды группы."""
+    key = os.path.abspath(path)
+    archive = _archives.get(key)
+    if archive is None:
+        archive = _archives[key] = StreamArchive(path)
+    return archive
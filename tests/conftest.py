@@ -0,0 +1,19 @@
+# tests/conftest.py
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# модули читают config.json из текущего каталога прямо при импорте и пишут рядом
+# свои файлы (лог, базы) — тесты работают во временном каталоге
+_workdir = tempfile.mkdtemp(prefix="twitch_bot_tests_")
+with open(os.path.join(_workdir, "config.json"), "w", encoding="utf-8") as f:
+    json.dump({
+        "TELEGRAM_TOKEN": "123:test", "DATA_DIR": os.path.join(_workdir, "data"),
+        "TWITCH_CLIENT_ID": "test-client", "TWITCH_CLIENT_SECRET": "test-secret",
+        "CHANNEL_ID": -1001, "STREAMERS": ["streamer"],
+    }, f)
+os.chdir(_workdir)
@@ -0,0 +1,47 @@
+# tests/test_bridge_filters.py
+from bridge_filters import AhoCorasick, BridgeFilter, has_letters_or_digits, strip_emoji
+
+
+def test_aho_corasick_finds_any_word_case_insensitively():
+    ac = AhoCorasick(["стрим", "Розыгрыш", "he", "she", "hers"])
+    assert ac.search("Сегодня СТРИМ в 20:00") == "стрим"
+    assert ac.search("большой РОЗЫГРЫШ") == "Розыгрыш"
+    assert ac.search("ushers") in ("she", "he", "hers")
+    assert ac.search("ничего интересного") is None
+
+
+def test_aho_corasick_overlapping_and_suffix_matches():
+    ac = AhoCorasick(["abcd", "bc"])
+    assert ac.search("xabcx") == "bc"  # совпадение внутри несостоявшегося более длинного слова
+    assert AhoCorasick(["a"]).search("bbba") == "a"
+
+
+def test_empty_automaton():
+    ac = AhoCorasick([])
+    assert not ac
+    assert ac.search("что угодно") is None
+
+
+def test_block_allow_and_regex():
+    f = BridgeFilter({
+        "TG_FILTER_BLOCK": ["стрим"],
+        "TG_FILTER_ALLOW": ["анонс"],
+        "TG_FILTER_REGEX": [r"https?://\S+\.ru"],
+    })
+    assert f.blocked_by("Сегодня стрим!") == "стрим"
+    assert f.blocked_by("Анонс: сегодня стрим!") is None  # разрешающее слово сильнее стоп-слова
+    assert f.blocked_by("заходи на http://spam.ru") == r"https?://\S+\.ru"
+    assert f.blocked_by("Анонс на http://spam.ru") is not None  # регулярку разрешающее не отменяет
+    assert f.blocked_by("обычная новость") is None
+    assert f.blocked_by("") is None
+
+
+def test_invalid_regex_is_skipped():
+    f = BridgeFilter({"TG_FILTER_REGEX": ["(", "ok"]})
+    assert [r.pattern for r in f.rules] == ["ok"]
+
+
+def test_emoji_helpers():
+    assert strip_emoji("Привет 🎉🔥").strip() == "Привет"
+    assert not has_letters_or_digits("🎉🔥 !!!")
+    assert has_letters_or_digits("🎉 1")
@@ -0,0 +1,27 @@
+# tests/test_caption_policy.py
+from caption_policy import CaptionEditPolicy
+
+
+def _policy():
+    return CaptionEditPolicy(min_interval=120, max_interval=600, viewer_delta_rel=0.1, viewer_delta_abs=5)
+
+
+def test_should_edit_does_not_remember_the_edit():
+    policy = _policy()
+    policy.mark_sent("s", title="t", game="g", viewers=100, now=0)
+    assert policy.should_edit("s", title="t", game="g", viewers=200, now=200)
+    # правка не дошла (mark_sent не вызван) — следующее значимое изменение не придерживается
+    assert policy.should_edit("s", title="t", game="g", viewers=210, now=230)
+
+
+def test_interval_counts_from_mark_sent():
+    policy = _policy()
+    policy.mark_sent("s", title="t", game="g", viewers=100, now=0)
+    assert not policy.should_edit("s", title="t", game="g", viewers=200, now=60)
+    assert policy.should_edit("s", title="t", game="g", viewers=200, now=130)
+    policy.mark_sent("s", title="t", game="g", viewers=200, now=130)
+    assert not policy.should_edit("s", title="t", game="g", viewers=300, now=200)
+    assert not policy.should_edit("s", title="t", game="g", viewers=201, now=300)
+    assert policy.should_edit("s", title="t", game="g", viewers=201, now=730)
+    assert policy.should_edit("s", title="новое", game="g", viewers=201, now=140)
+    assert policy.stats["suppressed"] == 3
@@ -0,0 +1,97 @@
+# tests/test_config_service.py
+import json
+import os
+
+import pytest
+
+from config_service import ConfigError, ConfigService, freeze, parse_color, validate
+
+ROUTE = {"name": "news", "source": "@news", "webhooks": "https://discord.com/api/webhooks/1/a"}
+
+
+def test_valid_config_passes():
+    validate({
+        "SOCIAL_LINKS": {"Boosty": "https://boosty.to/x"},
+        "ROLL_LUCKY_USERS": [1, "2"],
+        "DISCORD_EMBED_COLOR": "#9146FF",
+        "TG_FILTER_REGEX": [r"стрим\s+через"],
+        "BRIDGE_ROUTES": [ROUTE, {**ROUTE, "source": [-100123, "@b"], "webhooks": ["https://x/1", "https://x/2"],
+                                  "color": "00ff00", "footer": "Подвал", "block": ["реклама"]}],
+        "LOVE_SPECIAL_PAIRS": [[1, 2]],
+        "VIEWER_SERIES_CAPACITY": 720,
+    })
+
+
+@pytest.mark.parametrize("raw", [
+    [],
+    {"SOCIAL_LINKS": ["https://x"]},
+    {"TG_FILTER_BLOCK": "реклама"},
+    {"TG_FILTER_BLOCK": ["ok", 5]},
+    {"TG_FILTER_REGEX": ["(unclosed"]},
+    {"ROLL_LUCKY_USERS": ["abc"]},
+    {"LOVE_SPECIAL_PAIRS": [[1, 2, 3]]},
+    {"DISCORD_EMBED_COLOR": "purple"},
+    {"DISCORD_EMBED_COLOR": "1000000"},
+    {"DISCORD_FOOTER_TEXT": 5},
+    {"VIEWER_SERIES_CAPACITY": 0},
+    {"VIEWER_SERIES_CAPACITY": 721},
+    {"VIEWER_SERIES_CAPACITY": "много"},
+    {"BRIDGE_ROUTES": [{"source": "@news"}]},
+    {"BRIDGE_ROUTES": [{**ROUTE, "color": "zzz"}]},
+    {"BRIDGE_ROUTES": [{**ROUTE, "webhooks": "not-a-url"}]},
+    {"BRIDGE_ROUTES": [{**ROUTE, "source": [True]}]},
+    {"BRIDGE_ROUTES": [{**ROUTE, "footer": ["a"]}]},
+    {"BRIDGE_ROUTES": [{**ROUTE, "block": "реклама"}]},
+    {"BRIDGE_ROUTES": [{**ROUTE, "regex": ["[a-"]}]},
+])
+def test_invalid_config_is_rejected(raw):
+    with pytest.raises(ConfigError):
+        validate(raw)
+
+
+def test_parse_color():
+    assert parse_color("#9146FF") == 0x9146FF
+    assert parse_color("00bfff") == 0x00BFFF
+    with pytest.raises(ValueError):
+        parse_color("#12345678")
+
+
+def test_snapshot_is_read_only():
+    snapshot = freeze({"SOCIAL_LINKS": {"a": "b"}, "ANNOUNCE_TARGETS": [1]})
+    with pytest.raises(TypeError):
+        snapshot["SOCIAL_LINKS"]["c"] = "d"
+    assert snapshot["ANNOUNCE_TARGETS"] == (1,)
+
+
+def _write(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1_000_000))
+
+
+def test_bad_reload_keeps_previous_snapshot(tmp_path):
+    path = str(tmp_path / "config.json")
+    _write(path, {"DISCORD_EMBED_COLOR": "9146FF"})
+    service = ConfigService(path)
+    seen = []
+    service.subscribe(seen.append)
+    assert service.get()["DISCORD_EMBED_COLOR"] == "9146FF"
+
+    _write(path, {"DISCORD_EMBED_COLOR": "not a colour"})
+    assert service.reload_if_changed() is False
+    assert service.get()["DISCORD_EMBED_COLOR"] == "9146FF"
+
+    _write(path, {"DISCORD_EMBED_COLOR": "00FF00"})
+    assert service.reload_if_changed() is True
+    assert service.get()["DISCORD_EMBED_COLOR"] == "00FF00"
+    assert [cfg["DISCORD_EMBED_COLOR"] for cfg in seen] == ["00FF00"]
+
+
+def test_list_rules_survive_snapshot(tmp_path):
+    from tg_group_dlc import StaticReplies, _normalize_lines
+
+    path = str(tmp_path / "config.json")
+    _write(path, {"DLC_RULES": ["Правило 1", "Правило 2"]})
+    cfg = ConfigService(path).get()
+    assert _normalize_lines(cfg["DLC_RULES"]) == "Правило 1\nПравило 2"
+    assert StaticReplies(cfg, "test_bot").rules_text == "Правило 1\nПравило 2"
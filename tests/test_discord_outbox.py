@@ -0,0 +1,178 @@
+# tests/test_discord_outbox.py
+import asyncio
+
+import pytest
+
+import discord_outbox
+from discord_outbox import DiscordOutbox, _replace_with_links, chat_icon_ref
+from discord_webhook import DiscordWebhookError
+
+URL = "https://discord.com/api/webhooks/1/token"
+
+
+class FakeWebhooks:
+    """Вебхуки, которые падают заданными ошибками, а затем принимают сообщения."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+        self.sent = []
+
+    async def send(self, url, payload, files=None):
+        self.calls.append(payload)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(payload)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(discord_outbox, "OUTBOX_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(discord_outbox, "OUTBOX_MAX_ATTEMPTS", 4)
+
+
+def _use(monkeypatch, webhooks: FakeWebhooks) -> FakeWebhooks:
+    monkeypatch.setattr(discord_outbox, "discord_webhooks", webhooks)
+    return webhooks
+
+
+async def _wait_idle(outbox: DiscordOutbox, timeout: float = 3.0) -> None:
+    # ждём, пока в очереди не останется pending-записей
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        rows, _ = outbox._db("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")
+        if not rows[0][0] and not outbox._claimed:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("очередь не опустела")
+
+
+def _status(outbox: DiscordOutbox, key: str):
+    rows, _ = outbox._db("SELECT status, attempts FROM outbox WHERE dedupe_key = ?", (key,))
+    return rows[0]
+
+
+def test_duplicates_are_not_queued_twice(tmp_path, monkeypatch, fast_retries):
+    webhooks = _use(monkeypatch, FakeWebhooks())
+
+    async def main():
+        outbox = DiscordOutbox(str(tmp_path / "outbox.db"), workers=2)
+        outbox.start(bot=None)
+        first = await outbox.enqueue("1:10:a", URL, {"content": "пост"}, [])
+        again = await outbox.enqueue("1:10:a", URL, {"content": "пост"}, [])
+        await _wait_idle(outbox)
+        after_send = await outbox.enqueue("1:10:a", URL, {"content": "пост"}, [])
+        status = _status(outbox, "1:10:a")
+        await outbox.close()
+        return first, again, after_send, status
+
+    first, again, after_send, status = asyncio.run(main())
+    assert (first, again, after_send) == (True, False, False)
+    assert status == ("sent", 1)
+    assert webhooks.sent == [{"content": "пост"}]
+
+
+def test_transient_errors_are_retried(tmp_path, monkeypatch, fast_retries):
+    webhooks = _use(monkeypatch, FakeWebhooks(
+        ConnectionError("reset"), DiscordWebhookError(502, "bad gateway"), DiscordWebhookError(429, "rate limited"),
+    ))
+
+    async def main():
+        outbox = DiscordOutbox(str(tmp_path / "outbox.db"), workers=1)
+        outbox.start(bot=None)
+        await outbox.enqueue("1:11:a", URL, {"content": "пост"}, [])
+        await _wait_idle(outbox)
+        status = _status(outbox, "1:11:a")
+        await outbox.close()
+        return status, dict(outbox.stats)
+
+    status, stats = asyncio.run(main())
+    assert status == ("sent", 4)
+    assert len(webhooks.calls) == 4
+    assert stats["retried"] == 3
+
+
+def test_client_error_and_exhausted_retries_mark_dead(tmp_path, monkeypatch, fast_retries):
+    webhooks = _use(monkeypatch, FakeWebhooks(
+        DiscordWebhookError(400, "invalid form body"),
+        *[ConnectionError("down")] * 4,
+    ))
+
+    async def main():
+        outbox = DiscordOutbox(str(tmp_path / "outbox.db"), workers=1)
+        outbox.start(bot=None)
+        await outbox.enqueue("1:12:a", URL, {"content": "битый"}, [])
+        await _wait_idle(outbox)
+        await outbox.enqueue("1:13:a", URL, {"content": "не везёт"}, [])
+        await _wait_idle(outbox)
+        statuses = _status(outbox, "1:12:a"), _status(outbox, "1:13:a")
+        await outbox.close()
+        return statuses
+
+    rejected, exhausted = asyncio.run(main())
+    assert rejected == ("dead", 1)
+    assert exhausted == ("dead", 4)
+    assert webhooks.sent == []
+
+
+def test_pending_posts_survive_restart(tmp_path, monkeypatch, fast_retries):
+    path = str(tmp_path / "outbox.db")
+
+    async def before_restart():
+        outbox = DiscordOutbox(path, workers=1)  # воркеры не запущены — «упали» до отправки
+        await outbox.enqueue("1:14:a", URL, {"content": "пост"}, [])
+        await outbox.close()
+
+    async def after_restart():
+        outbox = DiscordOutbox(path, workers=1)
+        outbox.start(bot=None)
+        await _wait_idle(outbox)
+        status = _status(outbox, "1:14:a")
+        await outbox.close()
+        return status
+
+    asyncio.run(before_restart())
+    webhooks = _use(monkeypatch, FakeWebhooks())
+    assert asyncio.run(after_restart()) == ("sent", 1)
+    assert webhooks.sent == [{"content": "пост"}]
+
+
+def test_failed_files_become_notes():
+    payload = {"embeds": [{"description": "текст", "image": {"url": "attachment://a.jpg"}}]}
+    _replace_with_links(payload, ["b.jpg"], ["https://t.me/news/1", None])
+    embed = payload["embeds"][0]
+    assert "image" not in embed
+    assert embed["description"].startswith("текст\n\n")
+    assert "https://t.me/news/1" in embed["description"]
+    assert embed["description"].count("📎") == 2
+
+    payload = {"content": ""}
+    _replace_with_links(payload, [], [None])
+    assert payload["content"] == "📎 Вложение слишком большое для Discord"
+
+
+def test_chat_icon_is_resolved_only_on_send(tmp_path, monkeypatch, fast_retries):
+    webhooks = _use(monkeypatch, FakeWebhooks())
+    icon = "https://api.telegram.org/file/bot123:test/photos/file_1.jpg"
+
+    async def resolve_icon(bot, chat_id):
+        return icon if chat_id == -100 else None
+
+    def footer(chat_id):
+        return {"embeds": [{"footer": {"text": "канал", "icon_url": chat_icon_ref(chat_id)}}]}
+
+    async def main():
+        outbox = DiscordOutbox(str(tmp_path / "outbox.db"), workers=1)
+        await outbox.enqueue("-100:1:a", URL, footer(-100), [])
+        await outbox.enqueue("-200:1:a", URL, footer(-200), [])
+        stored, _ = outbox._db("SELECT payload FROM outbox")
+        outbox.start(bot=None, resolve_icon=resolve_icon)
+        await _wait_idle(outbox)
+        await outbox.close()
+        return stored
+
+    stored = asyncio.run(main())
+    assert not any("api.telegram.org" in row[0] for row in stored)  # токен бота в базу не попадает
+    footers = sorted((p["embeds"][0]["footer"] for p in webhooks.sent), key=len)
+    assert footers == [{"text": "канал"}, {"text": "канал", "icon_url": icon}]
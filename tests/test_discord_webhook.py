@@ -0,0 +1,73 @@
+# tests/test_discord_webhook.py
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import transport
+from discord_webhook import DiscordWebhookClient, DiscordWebhookError
+
+
+async def _serve(responses):
+    """Локальный «Discord»: отдаёт ответы по очереди и считает запросы."""
+    calls = []
+
+    async def handler(request):
+        calls.append(await request.json())
+        status, body, headers = responses.pop(0)
+        return web.json_response(body, status=status, headers=headers)
+
+    app = web.Application()
+    app.router.add_post("/hook", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/hook", calls
+
+
+def _run(responses, check):
+    async def main():
+        runner, url, calls = await _serve(responses)
+        try:
+            return await check(DiscordWebhookClient(max_retries=2), url, calls)
+        finally:
+            await transport.close()
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+
+def test_rate_limit_is_waited_out_inside_the_client():
+    async def check(client, url, calls):
+        await client.send(url, {"content": "пост"})
+        return calls, client.stats
+
+    calls, stats = _run([(429, {"retry_after": 0.05}, {}), (204, None, {})], check)
+    assert len(calls) == 2
+    assert stats["rate_limited"] == 1 and stats["sent"] == 1
+
+
+def test_server_errors_are_not_retried_by_the_client():
+    async def check(client, url, calls):
+        with pytest.raises(DiscordWebhookError) as e:
+            await client.send(url, {"content": "пост"})
+        return e.value.status, calls
+
+    status, calls = _run([(502, {"message": "bad gateway"}, {}), (204, None, {})], check)
+    assert status == 502
+    assert len(calls) == 1  # повтор с паузой — дело очереди discord_outbox
+
+
+def test_network_errors_are_raised_as_is():
+    async def main():
+        client = DiscordWebhookClient()
+        try:
+            with pytest.raises(aiohttp.ClientError):
+                await client.send("http://127.0.0.1:9/hook", {"content": "пост"})
+        finally:
+            await transport.close()
+
+    asyncio.run(main())
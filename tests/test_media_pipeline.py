@@ -0,0 +1,96 @@
+# tests/test_media_pipeline.py
+import asyncio
+import io
+import random
+
+import pytest
+
+import media_pipeline
+from media_pipeline import MediaItem, fit_media, plan_media
+
+MB = 1024 * 1024
+LINK = "https://t.me/news/1"
+
+
+class FakeMedia:
+    """Скачанный файл: размер и чтение по смещению, как у RelayedFile."""
+
+    def __init__(self, data: bytes = b"", size: int = None):
+        self._data = data
+        self.size = len(data) if size is None else size
+
+    def read_at(self, offset: int, n: int) -> bytes:
+        return self._data[offset:offset + n]
+
+
+@pytest.fixture
+def shrinkers(monkeypatch):
+    # ужать можно картинки, видео — нет (как без ffmpeg)
+    monkeypatch.setattr(media_pipeline, "Image", object())
+    monkeypatch.setattr(media_pipeline, "FFMPEG", None)
+
+
+def _photo(size, file_id="p"):
+    return MediaItem("photo", file_id, size, "telegram_photo.jpg", "image/jpeg")
+
+
+def _video(size, file_id="v"):
+    return MediaItem("video", file_id, size, "clip.mp4", "video/mp4", duration=30)
+
+
+def test_album_splits_the_upload_limit(shrinkers):
+    planned, skipped = plan_media([_photo(1 * MB, "a"), _photo(2 * MB, "b")], LINK)
+    assert skipped == []
+    assert [ref[1] for _, ref in planned] == ["telegram_photo_1.jpg", "telegram_photo_2.jpg"]
+    assert [ref[4]["max_bytes"] for _, ref in planned] == [media_pipeline.DISCORD_UPLOAD_LIMIT_BYTES // 2] * 2
+    assert all(ref[4]["link"] == LINK and ref[4]["shrink"] for _, ref in planned)
+
+
+def test_files_over_telegram_limit_and_unshrinkable_are_skipped(shrinkers):
+    big_photo, big_video, small_video = _photo(25 * MB, "a"), _video(15 * MB, "b"), _video(1 * MB, "c")
+    planned, skipped = plan_media([big_photo, big_video, small_video], LINK)
+    assert skipped == [big_photo, big_video]  # Bot API не отдаст / видео ужать нечем
+    assert [item for item, _ in planned] == [small_video]
+
+
+def test_unshrinkable_oversize_file_becomes_a_link(shrinkers):
+    # Telegram не сообщил размер — выяснилось только после скачивания
+    planned, _ = plan_media([_video(None)], LINK)
+    refs = [ref for _, ref in planned]
+
+    async def main():
+        async with fit_media(refs, [FakeMedia(size=20 * MB)]) as result:
+            return result
+
+    attachments, links = asyncio.run(main())
+    assert attachments == []
+    assert links == [LINK]
+
+
+def test_missing_download_becomes_a_link(shrinkers):
+    planned, _ = plan_media([_photo(1 * MB)], LINK)
+
+    async def main():
+        async with fit_media([ref for _, ref in planned], [None]) as result:
+            return result
+
+    assert asyncio.run(main()) == ([], [LINK])
+
+
+def test_shrunk_image_is_renamed_to_jpeg(monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+    monkeypatch.setattr(media_pipeline, "DISCORD_UPLOAD_LIMIT_BYTES", 50_000)
+    png = io.BytesIO()
+    Image.frombytes("RGB", (400, 400), random.Random(0).randbytes(400 * 400 * 3)).save(png, "PNG")  # шум не сжимается
+    item = MediaItem("document", "d", png.tell(), "scan.png", "image/png")
+    planned, skipped = plan_media([item], LINK)
+    assert skipped == []
+
+    async def main():
+        async with fit_media([ref for _, ref in planned], [FakeMedia(png.getvalue())]) as (attachments, links):
+            (field, name, media, content_type), = attachments
+            return field, name, media.size, content_type, links
+
+    field, name, size, content_type, links = asyncio.run(main())
+    assert (field, name, content_type, links) == ("files[0]", "scan.jpg", "image/jpeg", [])
+    assert size <= 50_000
@@ -0,0 +1,56 @@
+# tests/test_member_batcher.py
+import asyncio
+
+from tg_group_dlc import MemberEventBatcher
+
+
+def _batcher(window: float):
+    flushed = []
+
+    async def flush(chat_id, title, joined, left):
+        flushed.append((chat_id, title, joined, left))
+
+    return MemberEventBatcher(window, flush), flushed
+
+
+def test_burst_is_sent_once_per_chat_after_the_window():
+    async def main():
+        batcher, flushed = _batcher(0.05)
+        for user_id in range(3):
+            batcher.add(-1, "чат", user_id, f"u{user_id}", joined=True)
+        batcher.add(-2, "другой", 9, "u9", joined=False)
+        await asyncio.sleep(0.01)
+        early = list(flushed)
+        await asyncio.sleep(0.1)
+        return early, flushed
+
+    early, flushed = asyncio.run(main())
+    assert early == []
+    assert sorted(flushed) == [(-2, "другой", [], ["u9"]), (-1, "чат", ["u0", "u1", "u2"], [])]
+
+
+def test_join_and_leave_within_the_window_are_not_mentioned():
+    async def main():
+        batcher, flushed = _batcher(0.02)
+        batcher.add(-1, "чат", 1, "зашёл-вышел", joined=True)
+        batcher.add(-1, "чат", 1, "зашёл-вышел", joined=False)
+        batcher.add(-1, "чат", 2, "вышел-вернулся", joined=False)
+        batcher.add(-1, "чат", 2, "вышел-вернулся", joined=True)
+        batcher.add(-1, "чат", 3, "новенький", joined=True)
+        await asyncio.sleep(0.06)
+        return flushed
+
+    assert asyncio.run(main()) == [(-1, "чат", ["новенький"], [])]
+
+
+def test_drain_sends_pending_batches_without_waiting():
+    async def main():
+        batcher, flushed = _batcher(60)
+        batcher.add(-1, "чат", 1, "u1", joined=True)
+        batcher.add(-1, "чат", 2, "u2", joined=False)
+        await asyncio.wait_for(batcher.drain(), 1)
+        return flushed, batcher._tasks
+
+    flushed, tasks = asyncio.run(main())
+    assert flushed == [(-1, "чат", ["u1"], ["u2"])]
+    assert not tasks
@@ -0,0 +1,39 @@
+# tests/test_poll_scheduler.py
+import logging
+from datetime import datetime, timedelta, timezone
+
+from poll_scheduler import PollScheduler
+
+NOW = datetime(2026, 10, 16, 18, 0, tzinfo=timezone.utc)
+
+
+def _scheduler():
+    return PollScheduler(fast_seconds=10, slow_seconds=120, live_seconds=60, jitter=0)
+
+
+def test_mode_changes_are_logged_with_reason(caplog):
+    scheduler = _scheduler()
+    scheduler.set_scheduled_starts([NOW + timedelta(minutes=5)])
+    caplog.set_level(logging.INFO, logger="poll_scheduler")
+
+    assert scheduler.next_interval(False, now=NOW - timedelta(hours=3)) == 120
+    assert scheduler.next_interval(False, now=NOW - timedelta(hours=2)) == 120
+    assert scheduler.next_interval(False, now=NOW) == 10
+    assert scheduler.next_interval(True, now=NOW) == 60
+    assert scheduler.next_interval(False, now=NOW, reconcile_seconds=900) == 900
+
+    changes = [r.getMessage() for r in caplog.records]
+    assert len(changes) == 4  # повтор того же режима не логируется
+    assert "вне привычных окон старта" in changes[0]
+    assert "расписанию Twitch" in changes[1]
+    assert "slow → fast" in changes[1]
+    assert "fast → live" in changes[2]
+    assert "EventSub" in changes[3]
+
+
+def test_status_reports_current_interval():
+    scheduler = _scheduler()
+    scheduler.next_interval(True, now=NOW)
+    status = scheduler.status()
+    assert (status["mode"], status["interval"], status["reason"]) == ("live", 60, "идёт эфир")
+    assert status["polls"] == status["live"] == 1
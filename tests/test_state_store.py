@@ -0,0 +1,44 @@
+# tests/test_state_store.py
+import asyncio
+import threading
+
+import state_store
+from state_store import PersistentDict, PersistentSet, StateStore, preload
+
+
+def test_preload_reads_off_the_loop(tmp_path, monkeypatch):
+    store = StateStore(str(tmp_path / "state.db"))
+    store._write_batch({("welcomed", "7"): "1", ("bags", "chat:1"): '["a"]'})
+    readers = []
+    read = store._read
+
+    def tracked(k):
+        readers.append(threading.current_thread() is threading.main_thread())
+        return read(k)
+
+    monkeypatch.setattr(store, "_read", tracked)
+    welcomed = PersistentSet(store, "welcomed", int)
+    bags = PersistentDict(store, "bags")
+
+    async def main():
+        await preload(welcomed, 7, 8)
+        await preload(bags, "chat:1")
+        await preload({}, "ignored")  # обычный dict — без базы
+        return 7 in welcomed, 8 in welcomed, bags["chat:1"]
+
+    assert asyncio.run(main()) == (True, False, ["a"])
+    assert readers == [False, False, False]  # все чтения — в потоке, синхронные обращения попали в кэш
+
+
+def test_cached_keys_expire_by_max_age(tmp_path, monkeypatch):
+    store = StateStore(str(tmp_path / "state.db"))
+    hugs = PersistentDict(store, "hug_msg", int, max_age=60)
+    now = [1000.0]
+    monkeypatch.setattr(state_store.time, "time", lambda: now[0])
+
+    hugs[1] = {"author_id": 1}
+    assert hugs.get(1) == {"author_id": 1}
+    now[0] += 61
+    assert hugs.get(1) is None  # в кэше ещё лежит, но уже устарело
+    hugs[1] = {"author_id": 2}
+    assert hugs[1] == {"author_id": 2}
@@ -0,0 +1,76 @@
+# tests/test_stream_archive.py
+from datetime import datetime, timezone
+
+import pytest
+
+from stream_archive import StreamArchive, decode_series, encode_series
+from viewer_stats import ViewerSeries
+
+
+def _at(hour: int) -> datetime:
+    return datetime(2025, 1, 1, hour, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = StreamArchive(str(tmp_path / "archive.db"))
+    viewers = ViewerSeries()
+    for v in (10, 30, 20):
+        viewers.add(v)
+    archive.record_session("streamer", _at(10), _at(13), [
+        [_at(10).timestamp(), "Начало", "Dark Souls"],
+        [_at(11).timestamp(), "Дальше", "Dark Souls III"],
+    ], viewers)
+    archive.record_session("streamer", _at(14), _at(16), [
+        [_at(14).timestamp(), "Снова", "Dark Souls III"],
+    ], viewers)
+    yield archive
+    archive.close()
+
+
+@pytest.mark.parametrize("points", [[], [0], [5, 5, 5], [100, 3, 70000, 0, 1], list(range(1000, 0, -7))])
+def test_series_codec_round_trip(points):
+    assert decode_series(encode_series(points)) == points
+
+
+def test_series_codec_is_compact_for_smooth_series():
+    points = [1000 + (i % 5) for i in range(720)]
+    assert len(encode_series(points)) < len(points) * 2
+
+
+def test_exact_category_is_not_mixed_with_prefix_matches(archive):
+    stats = archive.category_stats("dark souls")
+    assert stats["category"] == "Dark Souls"
+    assert stats["sessions"] == 1
+    assert stats["seconds"] == 3600
+
+
+def test_unique_prefix_picks_that_category(archive):
+    stats = archive.category_stats("Dark Souls I")
+    assert stats["category"] == "Dark Souls III"
+    assert stats["sessions"] == 2
+    assert stats["seconds"] == 2 * 3600 + 2 * 3600
+
+
+def test_ambiguous_prefix_returns_candidates(archive):
+    stats = archive.category_stats("dark")
+    assert sorted(stats["candidates"]) == ["Dark Souls", "Dark Souls III"]
+    assert "sessions" not in stats
+
+
+def test_unknown_category(archive):
+    assert archive.category_stats("Minecraft") is None
+    assert archive.category_stats("   ") is None
+
+
+def test_same_second_changes_keep_every_segment(tmp_path):
+    archive = StreamArchive(str(tmp_path / "archive.db"))
+    at = _at(10).timestamp()
+    archive.record_session("streamer", _at(10), _at(12), [
+        [at, "Стрим", "Just Chatting"],
+        [at, "Стрим", "Elden Ring"],  # категорию сменили сразу после старта, название то же
+        [_at(11).timestamp(), "Стрим", "Just Chatting"],
+    ], ViewerSeries())
+    session = archive.last_session("streamer")
+    archive.close()
+    assert [category for _, _, category in session["segments"]] == ["Just Chatting", "Elden Ring", "Just Chatting"]
@@ -0,0 +1,61 @@
+# tests/test_stream_polling.py
+import asyncio
+from types import SimpleNamespace
+
+import twitch_stream_bot
+
+
+def _helix_stream(login: str) -> dict:
+    return {
+        "id": f"s-{login}", "user_id": f"u-{login}", "user_login": login, "user_name": login.upper(),
+        "game_id": "509658", "game_name": "Just Chatting", "type": "live", "title": f"стрим {login}",
+        "viewer_count": 5, "started_at": "2025-01-01T10:00:00Z", "language": "ru",
+        "thumbnail_url": "https://static-cdn.jtvnw.net/previews-ttv/live_user_" + login + "-{width}x{height}.jpg",
+        "tags": [], "is_mature": False,
+    }
+
+
+class FakeHelix:
+    """Get Streams: отвечает только про тех, кто в эфире, и запоминает каждый запрос."""
+
+    def __init__(self, live):
+        self.live = set(live)
+        self.requests = []
+
+    def get(self, url, params, headers):
+        self.requests.append((url, params))
+        logins = [value for key, value in params if key == "user_login"]
+        data = [_helix_stream(login) for login in logins if login in self.live]
+        return FakeResponse({"data": data, "pagination": {}})
+
+
+class FakeResponse:
+    status = 200
+
+    def __init__(self, body):
+        self._body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self._body
+
+
+def test_logins_are_fetched_in_chunks_of_100(monkeypatch):
+    logins = [f"streamer{i}" for i in range(150)]
+    helix = FakeHelix(live=["streamer0", "streamer99", "streamer100", "streamer149"])
+    monkeypatch.setattr(twitch_stream_bot, "http_session", lambda: helix)
+    twitch = SimpleNamespace(get_app_token=lambda: "token")
+
+    result = asyncio.run(twitch_stream_bot.get_streams_info(twitch, logins))
+
+    assert len(helix.requests) == 2
+    chunks = [[v for k, v in params if k == "user_login"] for _, params in helix.requests]
+    assert chunks == [logins[:100], logins[100:]]
+    assert sorted(result) == ["streamer0", "streamer100", "streamer149", "streamer99"]
+    assert result["streamer100"]["user_name"] == "STREAMER100"
+    assert result["streamer100"]["title"] == "стрим streamer100"
@@ -0,0 +1,171 @@
+# tests/test_tg_send_queue.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import TimedOut
+
+import tg_fun_dlc
+import tg_send_queue
+from tg_send_queue import PRIORITY_ANNOUNCE, PRIORITY_FUN, TelegramSendQueue
+
+
+def _fast_queue() -> TelegramSendQueue:
+    return TelegramSendQueue(global_rate=1000, private_rate=1000, private_burst=1000,
+                             group_rate=1000, group_burst=1000)
+
+
+class FakeMessage:
+    """Сообщение, правки которого пишутся в общий журнал; отправка занимает delay секунд."""
+
+    def __init__(self, log: list, chat_id: int = -100, message_id: int = 1, delay: float = 0.01):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self._log = log
+        self._delay = delay
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(self._delay)
+        self._log.append(text)
+        return text
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(self._delay)
+        self._log.append(text)
+        return self
+
+
+def test_requests_in_one_chat_are_sent_in_order():
+    async def main():
+        queue, sent = _fast_queue(), []
+
+        async def send(i):
+            sent.append(i)
+            return i
+
+        results = await asyncio.gather(*(
+            queue.submit(lambda i=i: send(i), chat_id=-100) for i in range(5)
+        ))
+        await queue.close()
+        return sent, results
+
+    sent, results = asyncio.run(main())
+    assert sent == [0, 1, 2, 3, 4]
+    assert results == [0, 1, 2, 3, 4]
+
+
+def test_priority_goes_first():
+    async def main():
+        queue, sent = _fast_queue(), []
+        gate = asyncio.Event()
+
+        async def send(name):
+            if name == "busy":
+                await gate.wait()
+            sent.append(name)
+
+        busy = queue.enqueue(lambda: send("busy"), chat_id=-100)
+        await asyncio.sleep(0.01)  # чат занят — остальное копится в очереди
+        fun = queue.enqueue(lambda: send("fun"), chat_id=-100, priority=PRIORITY_FUN)
+        announce = queue.enqueue(lambda: send("announce"), chat_id=-100, priority=PRIORITY_ANNOUNCE)
+        gate.set()
+        await asyncio.gather(busy, fun, announce)
+        await queue.close()
+        return sent
+
+    assert asyncio.run(main()) == ["busy", "announce", "fun"]
+
+
+def test_pending_edits_coalesce_to_the_last_one():
+    async def main():
+        queue, edits = _fast_queue(), []
+        msg = FakeMessage(edits, delay=0.05)
+        first = queue.enqueue(lambda: msg.edit_text("1"), chat_id=msg.chat_id, coalesce_key=(msg.chat_id, 1))
+        await asyncio.sleep(0.01)  # первая правка уже отправляется
+        rest = [
+            queue.enqueue(lambda t=t: msg.edit_text(t), chat_id=msg.chat_id, coalesce_key=(msg.chat_id, 1))
+            for t in ("2", "3", "4")
+        ]
+        results = await asyncio.gather(first, *rest)
+        stats = dict(queue.stats)
+        await queue.close()
+        return edits, results, stats
+
+    edits, results, stats = asyncio.run(main())
+    assert edits == ["1", "4"]
+    assert results == ["1", "4", "4", "4"]
+    assert stats["coalesced"] == 2
+
+
+def test_roll_result_is_always_the_last_edit(monkeypatch):
+    async def main():
+        queue, log = _fast_queue(), []
+        monkeypatch.setattr(tg_fun_dlc, "send_queue", queue)
+        monkeypatch.setattr(tg_send_queue, "send_queue", queue)
+        monkeypatch.setattr(tg_fun_dlc, "ROLL_ANIM_DELAY", 0)
+
+        update = SimpleNamespace(message=FakeMessage(log), effective_user=SimpleNamespace(id=42))
+        context = SimpleNamespace(args=["6"], application=SimpleNamespace(bot_data={}))
+        await tg_fun_dlc.cmd_roll(update, context)
+        await queue.close()
+        return log
+
+    for _ in range(20):
+        log = asyncio.run(main())
+        assert log[0] == "Бросаю кубик..."
+        assert "Выпало число" in log[-1]
+        assert all("Выпало число" not in text for text in log[:-1])
+
+
+def test_close_drains_inflight_and_cancels_pending():
+    async def main():
+        queue, log = _fast_queue(), []
+        msg = FakeMessage(log, delay=0.05)
+        sending = queue.enqueue(lambda: msg.edit_text("sending"), chat_id=msg.chat_id)
+        await asyncio.sleep(0.01)
+        waiting = queue.enqueue(lambda: msg.edit_text("waiting"), chat_id=msg.chat_id)
+        await queue.close()
+        return log, sending, waiting
+
+    log, sending, waiting = asyncio.run(main())
+    assert log == ["sending"]
+    assert sending.result() == "sending"
+    assert waiting.cancelled()
+
+
+def test_timeouts_retry_only_edits():
+    async def main():
+        queue, calls = _fast_queue(), []
+
+        async def flaky(name):
+            calls.append(name)
+            if calls.count(name) == 1:
+                raise TimedOut()
+            return name
+
+        edit = await queue.submit(lambda: flaky("edit"), chat_id=-100, coalesce_key=(-100, 1))
+        with pytest.raises(TimedOut):
+            await queue.submit(lambda: flaky("send"), chat_id=-100)  # могло дойти — не повторяем
+        await queue.close()
+        return edit, calls
+
+    edit, calls = asyncio.run(main())
+    assert edit == "edit"
+    assert calls == ["edit", "edit", "send"]
+
+
+def test_idle_chat_buckets_are_forgotten():
+    async def main():
+        queue = _fast_queue()
+
+        async def send():
+            return None
+
+        await asyncio.gather(*(queue.submit(send, chat_id=user_id) for user_id in range(1, 51)))
+        before = len(queue._chat_buckets)
+        queue._sweep_buckets(tg_send_queue.time.monotonic() + 60)
+        after = len(queue._chat_buckets)
+        await queue.close()
+        return before, after
+
+    assert asyncio.run(main()) == (50, 0)
@@ -0,0 +1,140 @@
+# tests/test_twitch_eventsub.py
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import twitch_eventsub
+from twitch_eventsub import (
+    HDR_ID, HDR_SIGNATURE, HDR_TIMESTAMP, HDR_TYPE, EventSubWebhookServer, _parse_timestamp, sign_message,
+)
+
+SECRET = "s3cret-s3cret"
+
+
+def _timestamp(age: timedelta = timedelta()) -> str:
+    # как у Twitch: RFC3339 с наносекундами
+    return (datetime.now(timezone.utc) - age).strftime("%Y-%m-%dT%H:%M:%S.%f") + "123Z"
+
+
+def _headers(message_id: str, body: bytes, *, kind: str = "notification", age: timedelta = timedelta(),
+             secret: str = SECRET) -> dict:
+    ts = _timestamp(age)
+    return {
+        HDR_ID: message_id,
+        HDR_TIMESTAMP: ts,
+        HDR_SIGNATURE: sign_message(secret, message_id, ts, body),
+        HDR_TYPE: kind,
+        "Content-Type": "application/json",
+    }
+
+
+def _notification(login: str = "streamer") -> bytes:
+    return json.dumps({
+        "subscription": {"type": "stream.online"},
+        "event": {"broadcaster_user_login": login},
+    }).encode()
+
+
+def _run(scenario):
+    async def main():
+        events = []
+
+        async def callback(sub_type, event):
+            events.append((sub_type, event))
+
+        server = EventSubWebhookServer(SECRET, callback)
+        app = web.Application()
+        app.router.add_post(server.path, server._handle)
+        async with TestClient(TestServer(app)) as client:
+            result = await scenario(client, server)
+            await asyncio.sleep(0)  # уведомления обрабатываются в фоне
+        return result, events
+
+    return asyncio.run(main())
+
+
+def test_parse_timestamp():
+    assert _parse_timestamp("2023-07-19T14:56:51.634234626Z") == datetime(
+        2023, 7, 19, 14, 56, 51, 634234, tzinfo=timezone.utc)
+    assert _parse_timestamp("2023-07-19T14:56:51Z") == datetime(2023, 7, 19, 14, 56, 51, tzinfo=timezone.utc)
+    assert _parse_timestamp("вчера") is None
+
+
+def test_valid_notification_is_dispatched():
+    async def scenario(client, server):
+        body = _notification()
+        resp = await client.post("/eventsub", data=body, headers=_headers("m1", body))
+        return resp.status
+
+    status, events = _run(scenario)
+    assert status == 204
+    assert events == [("stream.online", {"broadcaster_user_login": "streamer"})]
+
+
+def test_bad_signature_is_rejected():
+    async def scenario(client, server):
+        body = _notification()
+        wrong = await client.post("/eventsub", data=body, headers=_headers("m1", body, secret="other"))
+        headers = _headers("m2", body)
+        tampered = await client.post("/eventsub", data=_notification("someone_else"), headers=headers)
+        missing = await client.post("/eventsub", data=body, headers={HDR_ID: "m3"})
+        return wrong.status, tampered.status, missing.status
+
+    statuses, events = _run(scenario)
+    assert statuses == (403, 403, 400)
+    assert events == []
+
+
+def test_replayed_message_is_dispatched_once():
+    async def scenario(client, server):
+        body = _notification()
+        headers = _headers("same-id", body)
+        first = await client.post("/eventsub", data=body, headers=headers)
+        second = await client.post("/eventsub", data=body, headers=headers)
+        return first.status, second.status
+
+    statuses, events = _run(scenario)
+    assert statuses == (204, 204)
+    assert len(events) == 1
+
+
+def test_old_message_is_rejected():
+    async def scenario(client, server):
+        body = _notification()
+        resp = await client.post("/eventsub", data=body, headers=_headers("m1", body, age=timedelta(minutes=11)))
+        return resp.status
+
+    status, events = _run(scenario)
+    assert status == 403
+    assert events == []
+
+
+def test_challenge_and_revocation():
+    revoked = []
+
+    async def scenario(client, server):
+        server.on_revocation = revoked.append
+        body = json.dumps({"challenge": "pong", "subscription": {"type": "stream.online"}}).encode()
+        challenge = await client.post("/eventsub", data=body,
+                                      headers=_headers("c1", body, kind="webhook_callback_verification"))
+        body = json.dumps({"subscription": {"type": "stream.offline", "status": "authorization_revoked"}}).encode()
+        revocation = await client.post("/eventsub", data=body, headers=_headers("r1", body, kind="revocation"))
+        return challenge.status, await challenge.text(), revocation.status
+
+    (c_status, c_text, r_status), events = _run(scenario)
+    assert (c_status, c_text, r_status) == (200, "pong", 204)
+    assert revoked == [{"type": "stream.offline", "status": "authorization_revoked"}]
+    assert events == []
+
+
+def test_seen_ids_are_bounded(monkeypatch):
+    monkeypatch.setattr(twitch_eventsub, "SEEN_IDS_LIMIT", 3)
+    server = EventSubWebhookServer(SECRET, None)
+    for i in range(10):
+        assert server._remember(str(i))
+    assert len(server._seen) == 3
+    assert not server._remember("9")
+    assert server._remember("0")  # давно вытеснен
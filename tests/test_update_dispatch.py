@@ -0,0 +1,128 @@
+# tests/test_update_dispatch.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from update_dispatch import UpdateDispatcher, split_command
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("/roll", ("/roll", [])),
+    ("/Roll@MyBot 20", ("/roll", ["20"])),
+    ("!кубик 6", ("!кубик", ["6"])),
+    ("/roll@mybot", ("/roll", [])),
+    ("/roll@OtherBot 20", None),
+    ("roll", None),
+    ("", None),
+])
+def test_split_command(text, expected):
+    assert split_command(text, "MyBot") == expected
+
+
+def test_addressed_command_without_known_username():
+    assert split_command("/roll@MyBot", None) is None
+
+
+def _chat(chat_id=-100, username=None):
+    return SimpleNamespace(id=chat_id, username=username)
+
+
+def _message_update(text, chat=None, channel=False):
+    msg = SimpleNamespace(text=text, chat=chat or _chat())
+    return SimpleNamespace(
+        callback_query=None, chat_member=None,
+        message=None if channel else msg, channel_post=msg if channel else None,
+    )
+
+
+def _context():
+    return SimpleNamespace(bot=SimpleNamespace(username="MyBot"), args=None)
+
+
+def _recorder(calls, name):
+    async def fn(update, context):
+        calls.append((name, context.args))
+    fn.__qualname__ = name
+    return fn
+
+
+def _dispatch(dispatcher, update):
+    context = _context()
+    asyncio.run(dispatcher.dispatch(update, context))
+    return context
+
+
+def test_commands_and_observers():
+    calls = []
+    d = UpdateDispatcher()
+    d.command(_recorder(calls, "roll"), "/roll", "!кубик")
+    d.watch_chats("bridge", ["@News", -100], _recorder(calls, "bridge"))
+
+    _dispatch(d, _message_update("/roll@MyBot 20"))
+    _dispatch(d, _message_update("!КУБИК"))
+    _dispatch(d, _message_update("/unknown"))            # чужая /команда наблюдателям не достаётся
+    _dispatch(d, _message_update("/roll@OtherBot"))
+    _dispatch(d, _message_update("!не команда"))          # !-текст без команды — обычное сообщение
+    _dispatch(d, _message_update("пост", _chat(-200, "news"), channel=True))
+    _dispatch(d, _message_update("пост", _chat(-300, "other"), channel=True))
+
+    assert calls == [
+        ("roll", ["20"]),
+        ("roll", []),
+        ("bridge", None),
+        ("bridge", None),
+    ]
+
+
+def test_channel_posts_are_never_commands():
+    calls = []
+    d = UpdateDispatcher()
+    d.command(_recorder(calls, "roll"), "/roll")
+    d.watch_chats("bridge", [-100], _recorder(calls, "bridge"))
+    _dispatch(d, _message_update("/roll", channel=True))
+    assert calls == [("bridge", None)]
+
+
+def test_watch_chats_replaces_previous_subscription():
+    calls = []
+    d = UpdateDispatcher()
+    d.watch_chats("bridge", [-100], _recorder(calls, "bridge"))
+    d.watch_chats("bridge", [-200], _recorder(calls, "bridge"))
+    _dispatch(d, _message_update("a", _chat(-100)))
+    _dispatch(d, _message_update("b", _chat(-200)))
+    assert calls == [("bridge", None)]
+
+
+def test_handler_error_does_not_stop_other_observers():
+    calls = []
+
+    async def broken(update, context):
+        raise RuntimeError("boom")
+
+    d = UpdateDispatcher()
+    d.watch_chats("broken", [-100], broken)
+    d.watch_chats("ok", [-100], _recorder(calls, "ok"))
+    _dispatch(d, _message_update("text"))
+    assert calls == [("ok", None)]
+
+
+def test_callbacks_by_data_with_fallback():
+    calls = []
+    d = UpdateDispatcher()
+    d.callback(_recorder(calls, "hug"), "hug_reply")
+    d.callback(_recorder(calls, "fallback"))
+
+    for data in ("hug_reply", "rules_pm"):
+        update = SimpleNamespace(callback_query=SimpleNamespace(data=data), chat_member=None)
+        _dispatch(d, update)
+    assert [name for name, _ in calls] == ["hug", "fallback"]
+
+
+def test_second_callback_fallback_is_rejected():
+    d = UpdateDispatcher()
+    first = _recorder([], "first")
+    d.callback(first)
+    d.callback(first)  # повторная регистрация того же обработчика безвредна
+    with pytest.raises(ValueError):
+        d.callback(_recorder([], "second"))
@@ -0,0 +1,56 @@
+# tests/test_viewer_stats.py
+import pytest
+
+from viewer_stats import ViewerSeries
+
+
+def test_summary_uses_all_raw_values():
+    series = ViewerSeries(capacity=4)
+    values = [10, 50, 20, 0, 30, 40, 5, 45, 15]
+    for v in values:
+        series.add(v)
+    assert series.summary() == {
+        "peak": 50, "avg": round(sum(values) / len(values)), "min": 0, "samples": len(values),
+    }
+
+
+def test_none_and_negative_values():
+    series = ViewerSeries()
+    series.add(None)
+    assert series.summary() is None
+    series.add(-5)
+    assert series.summary()["min"] == 0
+
+
+def test_downsampling_keeps_memory_bounded():
+    series = ViewerSeries(capacity=4)
+    for v in range(1, 9):  # 8 значений в буфер на 4 точки
+        series.add(v)
+    # [1,2,3,4] -> [2,4] (шаг 2); затем (5,6) -> 6, (7,8) -> 8 -> [2,4,6,8] -> [3,7] (шаг 4)
+    assert series.step == 4
+    assert series.points.tolist() == [3, 7]
+    for _ in range(1000):
+        series.add(100)
+    assert len(series.points) < series.capacity
+
+
+def test_round_trip_through_dict_keeps_partial_point():
+    series = ViewerSeries(capacity=4)
+    for v in (1, 2, 3, 4, 5):  # после прореживания шаг 2, значение 5 — в незавершённой точке
+        series.add(v)
+    restored = ViewerSeries.from_dict(series.to_dict())
+    assert restored.to_dict() == series.to_dict()
+    restored.add(7)
+    series.add(7)
+    assert restored.points.tolist() == series.points.tolist()
+    assert restored.summary() == series.summary()
+
+
+def test_from_empty_dict():
+    assert ViewerSeries.from_dict(None).summary() is None
+
+
+@pytest.mark.parametrize("capacity", [0, 1, 3])
+def test_capacity_must_be_even(capacity):
+    with pytest.raises(ValueError):
+        ViewerSeries(capacity)
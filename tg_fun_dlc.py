@@ -1,49 +1,58 @@
 # tg_fun_dlc.py
-import json
 import logging
 import asyncio
 import random
 from html import escape
 from typing import Dict, Optional, List, Tuple, Callable
-from telegram.error import TimedOut, RetryAfter, NetworkError
 
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup, Message,
 )
 from telegram.constants import ParseMode, ChatType
-from telegram.ext import (
-    Application, ApplicationBuilder, CommandHandler, ContextTypes,
-    CallbackQueryHandler, MessageHandler, filters,
-)
+from telegram.ext import Application, ApplicationBuilder, ContextTypes
+
+from tg_send_queue import send_queue, reply, PRIORITY_FUN
+from transport import get_bot
+from config_service import get_config, subscribe as subscribe_config
+from update_dispatch import get_dispatcher
+from state_store import get_store, state_db_path, preload, PersistentDict
 
 log = logging.getLogger("tg_fun_dlc")
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram.request").setLevel(logging.WARNING)
 
 
+def queue_edit_text(
+    msg: Message,
+    text: str,
+    *,
+    parse_mode: ParseMode | None = None,
+    timeout: float = 20.0,
+) -> asyncio.Future:
+    # Повторы (RetryAfter, таймауты) делает общая очередь; правки одного сообщения,
+    # ещё не ушедшие в Telegram, схлопываются до последней поставленной
+    return send_queue.enqueue(
+        lambda: msg.edit_text(text, parse_mode=parse_mode, read_timeout=timeout),
+        chat_id=msg.chat_id,
+        priority=PRIORITY_FUN,
+        coalesce_key=(msg.chat_id, msg.message_id),
+    )
+
+
 async def safe_edit_text(
     msg: Message,
     text: str,
     *,
     parse_mode: ParseMode | None = None,
     timeout: float = 20.0,
-    max_retries: int = 3
 ) -> None:
-    for attempt in range(1, max_retries + 1):
-        try:
-            await msg.edit_text(text, parse_mode=parse_mode, timeout=timeout)
-            return
-        except RetryAfter as e:
-            # Flood control — подождать требуемое время
-            await asyncio.sleep(getattr(e, "retry_after", 1.0))
-        except TimedOut:
-            # сетевой таймаут — подождать чуть-чуть и повторить
-            await asyncio.sleep(0.5 * attempt)
-        except NetworkError:
-            await asyncio.sleep(0.5 * attempt)
-    # если так и не получилось — пробросим последнее исключение
-    await msg.edit_text(text, parse_mode=parse_mode, timeout=timeout)
-    
+    await queue_edit_text(msg, text, parse_mode=parse_mode, timeout=timeout)
+
+
+async def _reply(update: Update, text: str, *, html: bool = False, **kwargs) -> Message:
+    """Ответ на сообщение через общую очередь (fun-ответы — с низким приоритетом)."""
+    return await reply(update.message, text, html=html, priority=PRIORITY_FUN, **kwargs)
+
 # ----------------- утилиты -----------------
 def escape_md2(text: str) -> str:
     if not isinstance(text, str):
@@ -52,14 +61,10 @@ def escape_md2(text: str) -> str:
         text = text.replace(ch, f"\\{ch}")
     return text.strip()
 
-def _load_config() -> dict:
-    with open("config.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
 def _normalize_lines(v) -> str:
     if v is None:
         return ""
-    if isinstance(v, list):
+    if isinstance(v, (list, tuple)):  # списки в снимке конфига — кортежи
         text = "\n".join(map(str, v))
     else:
         text = str(v)
@@ -95,13 +100,16 @@ async def cmd_roll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         except Exception:
             pass
     if sides not in (4, 6, 10, 20, 100) or sides < 2:
-        await update.message.reply_text("Использование: !кубик [4|6|10|20|100]. По умолчанию 20.")
+        await _reply(update, "Использование: !кубик [4|6|10|20|100]. По умолчанию 20.")
         return
 
-    msg = await update.message.reply_text("Бросаю кубик...")
+    msg = await _reply(update, "Бросаю кубик...")
+    frames = []
     for frame in ROLL_ANIM_FRAMES:
         await asyncio.sleep(ROLL_ANIM_DELAY)
-        await msg.edit_text(frame)
+        # кадр встаёт в очередь сразу, но его отправку не ждём: если очередь занята,
+        # кадры схлопнутся с финальным результатом, который поставлен после них
+        frames.append(queue_edit_text(msg, frame))
 
     result = _get_roll_result(update.effective_user.id, sides, context)
     if result == sides:
@@ -110,7 +118,8 @@ async def cmd_roll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         final = f"💥 Критическая неудача! Выпало число: {result}"
     else:
         final = f"Выпало число: {result}"
-    await msg.edit_text(final)
+    await safe_edit_text(msg, final)
+    await asyncio.gather(*frames, return_exceptions=True)
 
 # ----------------- /roll_battle -----------------
 # def _duels(context: ContextTypes.DEFAULT_TYPE) -> Dict[int, dict]:
@@ -282,15 +291,19 @@ async def cmd_cancel_rp(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         target = update.message.reply_to_message.from_user
         # Блокируем отмену для защищённых пользователей
         if _is_cancel_protected(context, target.id):
-            await update.message.reply_html(
-                f"⛔ <b>Нельзя отменять действия в отношении</b> {target.mention_html()}."
+            await _reply(
+                update,
+                f"⛔ <b>Нельзя отменять действия в отношении</b> {target.mention_html()}.",
+                html=True
             )
             return
-        await update.message.reply_html(
-            f"❌ <b>{base}</b>\n(Отменено по отношению к {target.mention_html()})"
+        await _reply(
+            update,
+            f"❌ <b>{base}</b>\n(Отменено по отношению к {target.mention_html()})",
+            html=True
         )
     else:
-        await update.message.reply_html(f"❌ <b>{base}</b>")
+        await _reply(update, f"❌ <b>{base}</b>", html=True)
 
 
 
@@ -318,7 +331,7 @@ async def cmd_fight(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         target = me
 
     if target.id == update.effective_user.id:
-        await update.message.reply_text("Ты не можешь атаковать самого себя! 😅")
+        await _reply(update, "Ты не можешь атаковать самого себя! 😅")
         return
 
     templates = _fight_templates()
@@ -328,7 +341,7 @@ async def cmd_fight(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         target=target.mention_html()
     )
 
-    await update.message.reply_html(f"<b>Драка! 🔥</b>\n\n{text}")
+    await _reply(update, f"<b>Драка! 🔥</b>\n\n{text}", html=True)
 
 # ----------------- /hug -----------------
 def _hugs_store(context: ContextTypes.DEFAULT_TYPE) -> Dict[int, str]:
@@ -357,11 +370,12 @@ async def cmd_hug(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         target = me
 
     if target.id == update.effective_user.id:
-        await update.message.reply_text("Ты не можешь обнять самого себя! 😅 Обними бота или другого пользователя! 🤗")
+        await _reply(update, "Ты не можешь обнять самого себя! 😅 Обними бота или другого пользователя! 🤗")
         return
 
     templates = _hug_templates()
     last = _hugs_store(context)
+    await preload(last, update.effective_user.id)
     prev = last.get(update.effective_user.id)
     available = [t for t in templates if t != prev] or templates
     tpl = random.choice(available)
@@ -372,14 +386,16 @@ async def cmd_hug(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         target=target.mention_html()
     )
 
-    m = await update.message.reply_html(f"<b>Обнимашки! 🤗</b>\n\n{text}")
+    m = await _reply(update, f"<b>Обнимашки! 🤗</b>\n\n{text}", html=True)
     store = context.application.bot_data.setdefault("HUG_MSG", {})
     store[m.message_id] = {"author_id": update.effective_user.id, "target_id": target.id}
 
 async def cb_hug_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     q = update.callback_query
     await q.answer()
-    info = context.application.bot_data.setdefault("HUG_MSG", {}).get(q.message.message_id)
+    hug_msgs = context.application.bot_data.setdefault("HUG_MSG", {})
+    await preload(hug_msgs, q.message.message_id)
+    info = hug_msgs.get(q.message.message_id)
     if not info:
         return
     if q.from_user.id != info["target_id"]:
@@ -389,13 +405,18 @@ async def cb_hug_reply(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await q.answer("Ты уже ответил обнимашкой! 🤗", show_alert=True)
         return
     info["replied"] = True
+    hug_msgs[q.message.message_id] = info  # изменение на месте — присваиваем заново, чтобы сохранилось
 
     templates = _hug_templates()
     reply_text = random.choice(templates).format(
         author=(await context.bot.get_chat_member(q.message.chat_id, info["target_id"])).user.mention_html(),
         target=(await context.bot.get_chat_member(q.message.chat_id, info["author_id"])).user.mention_html(),
     )
-    await q.message.reply_html(f"<b>Ответные обнимашки! 💞</b>\n\n{reply_text}")
+    await send_queue.submit(
+        lambda: q.message.reply_html(f"<b>Ответные обнимашки! 💞</b>\n\n{reply_text}"),
+        chat_id=q.message.chat_id,
+        priority=PRIORITY_FUN,
+    )
 
 # ----------------- /love -----------------
 def _load_love_special_pairs(context: ContextTypes.DEFAULT_TYPE) -> set[Tuple[int,int]]:
@@ -412,10 +433,10 @@ async def cmd_love(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         target = update.message.reply_to_message.from_user
 
     if not target:
-        await update.message.reply_text("Использование: ответь на сообщение пользователя командой !лю, либо упомяни его.")
+        await _reply(update, "Использование: ответь на сообщение пользователя командой !лю, либо упомяни его.")
         return
     if target.id == update.effective_user.id:
-        await update.message.reply_text("Ты не можешь измерить любовь к самому себе! Но мы уверены, что ты замечательный человек ❤️")
+        await _reply(update, "Ты не можешь измерить любовь к самому себе! Но мы уверены, что ты замечательный человек ❤️")
         return
 
     pairs = _load_love_special_pairs(context)
@@ -428,9 +449,11 @@ async def cmd_love(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     filled = int((love / 100) * bar_len)
     bar = "💖" * filled + "🖤" * (bar_len - filled)
 
-    await update.message.reply_html(
+    await _reply(
+        update,
         f"💘 <b>Измеритель любви</b>\n"
-        f"{update.effective_user.mention_html()} любит {target.mention_html()} на <b>{love}%</b>\n{bar}"
+        f"{update.effective_user.mention_html()} любит {target.mention_html()} на <b>{love}%</b>\n{bar}",
+        html=True
     )
 
 # ----------------- алиасы (! и /кириллица) -----------------
@@ -452,34 +475,41 @@ FUN_ALIASES: Dict[str, Callable[[Update, ContextTypes.DEFAULT_TYPE], asyncio.Fut
     "/отмена": cmd_cancel_rp,  # если хочешь, чтобы работало и со слэшом по-русски
 }
 
-async def fun_alias_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not update.message or not update.message.text:
-        return
-    parts = update.message.text.strip().split()
-    cmd = parts[0].lower()
-    func = FUN_ALIASES.get(cmd)
-    if not func:
-        return
-    context.args = parts[1:]
-    await func(update, context)
-
 # ----------------- регистрация/запуск -----------------
 def _register_fun_handlers(app: Application) -> None:
-    # Латинские «официальные» команды (подсветка и автодополнение в Telegram)
-    app.add_handler(CommandHandler("roll",         cmd_roll))
-    # app.add_handler(CommandHandler("roll_battle",  cmd_roll_battle))
-    # app.add_handler(CallbackQueryHandler(cb_duel_accept, pattern="^duel_accept$"))
-
-    # app.add_handler(CommandHandler("chik",         cmd_chik))
-    app.add_handler(CommandHandler("hug",          cmd_hug))
-    app.add_handler(CallbackQueryHandler(cb_hug_reply, pattern="^hug_reply$"))
-    app.add_handler(CommandHandler("love",         cmd_love))
-    app.add_handler(CommandHandler("ataka", cmd_fight))
-    app.add_handler(CommandHandler("otmena", cmd_cancel_rp))
-
+    dispatch = get_dispatcher(app)
 
-    # Алиасы: «!команды» и кириллические «/команды»
-    app.add_handler(MessageHandler(filters.TEXT, fun_alias_router))
+    # Латинские «официальные» команды (подсветка и автодополнение в Telegram)
+    dispatch.command(cmd_roll,      "/roll")
+    # dispatch.command(cmd_roll_battle, "/roll_battle")
+    # dispatch.callback(cb_duel_accept, "duel_accept")
+
+    # dispatch.command(cmd_chik,      "/chik")
+    dispatch.command(cmd_hug,       "/hug")
+    dispatch.callback(cb_hug_reply, "hug_reply")
+    dispatch.command(cmd_love,      "/love")
+    dispatch.command(cmd_fight,     "/ataka")
+    dispatch.command(cmd_cancel_rp, "/otmena")
+
+    # Алиасы: «!команды» и кириллические «/команды» — в том же индексе
+    for alias, func in FUN_ALIASES.items():
+        dispatch.command(func, alias)
+
+def _apply_config(app: Application, cfg) -> None:
+    # списки id из конфига; при правке config.json подменяются целиком
+    app.bot_data["ROLL_LUCKY_USERS"] = set(map(int, cfg.get("ROLL_LUCKY_USERS", [])))
+    app.bot_data["ROLL_UNLUCKY_USERS"] = set(map(int, cfg.get("ROLL_UNLUCKY_USERS", [])))
+    app.bot_data["LOVE_SPECIAL_PAIRS"] = {tuple(map(int, p)) for p in cfg.get("LOVE_SPECIAL_PAIRS", [])}
+    app.bot_data["CANCEL_PROTECTED_USERS"] = set(map(int, cfg.get("CANCEL_PROTECTED_USERS", [])))
+
+def _attach_storage(app: Application, cfg) -> None:
+    # состояние обнимашек переживает рестарт; читается из базы по ключу, по мере надобности
+    store = get_store(state_db_path(cfg))
+    # нужно оно ненадолго (кнопка «обнять в ответ», защита от повтора шаблона) — старое удаляется
+    keep = float(cfg.get("HUG_STATE_KEEP_DAYS", 7)) * 86400
+    app.bot_data["HUG_LAST"] = PersistentDict(store, "hug_last", int, max_age=keep)
+    app.bot_data["HUG_MSG"] = PersistentDict(store, "hug_msg", int, max_age=keep)
+    store.start()
 
 async def start_fun_dlc(app: Optional[Application] = None) -> Application:
     """
@@ -487,20 +517,21 @@ async def start_fun_dlc(app: Optional[Application] = None) -> Application:
     просто зарегистрируем команды в нём и НИЧЕГО не запускаем.
     Если app не передан — создадим своё приложение и запустим polling.
     """
-    cfg = _load_config()
+    cfg = get_config()
     token = cfg["TELEGRAM_TOKEN"]
 
-    cancel_protected = set(map(int, cfg.get("CANCEL_PROTECTED_USERS", [])))
-    lucky_ids = set(map(int, cfg.get("ROLL_LUCKY_USERS", [])))
-    unlucky_ids = set(map(int, cfg.get("ROLL_UNLUCKY_USERS", [])))
-    love_pairs = {tuple(map(int, p)) for p in cfg.get("LOVE_SPECIAL_PAIRS", [])}
-
     if app is None:
-        app = ApplicationBuilder().token(token).build()
-        app.bot_data["ROLL_LUCKY_USERS"] = lucky_ids
-        app.bot_data["ROLL_UNLUCKY_USERS"] = unlucky_ids
-        app.bot_data["LOVE_SPECIAL_PAIRS"] = love_pairs
-        app.bot_data["CANCEL_PROTECTED_USERS"] = cancel_protected
+        app = (
+            ApplicationBuilder()
+            .bot(get_bot(token))  # общий клиент с анонсером
+            # обработчики ждут лимитов Telegram в общей очереди: апдейты обрабатываются
+            # параллельно, чтобы занятая группа не задерживала остальные чаты
+            .concurrent_updates(int(cfg.get("DLC_CONCURRENT_UPDATES", 32)))
+            .build()
+        )
+        _attach_storage(app, cfg)
+        _apply_config(app, cfg)
+        subscribe_config(lambda new_cfg: _apply_config(app, new_cfg))
 
         _register_fun_handlers(app)
 
@@ -515,10 +546,9 @@ async def start_fun_dlc(app: Optional[Application] = None) -> Application:
         log.info("FUN DLC запущен как отдельное приложение")
         return app
     else:
-        app.bot_data.setdefault("ROLL_LUCKY_USERS", set()).update(lucky_ids)
-        app.bot_data.setdefault("ROLL_UNLUCKY_USERS", set()).update(unlucky_ids)
-        app.bot_data.setdefault("LOVE_SPECIAL_PAIRS", set()).update(love_pairs)
-        app.bot_data.setdefault("CANCEL_PROTECTED_USERS", set()).update(cancel_protected)
+        _attach_storage(app, cfg)
+        _apply_config(app, cfg)
+        subscribe_config(lambda new_cfg: _apply_config(app, new_cfg))
 
         _register_fun_handlers(app)
         return app
@@ -1,9 +1,11 @@
-import json
+import asyncio
 import logging
 import random
+from datetime import datetime
+from html import escape
 logging.getLogger("httpx").setLevel(logging.WARNING)             # HTTP‑клиент PTB 21
 logging.getLogger("telegram.request").setLevel(logging.WARNING)  # слой запросов PTB
-from typing import List, Optional, Dict
+from typing import Awaitable, Callable, List, Optional, Dict
 
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup,
@@ -11,10 +13,14 @@ from telegram import (
 )
 from telegram.error import Forbidden
 from telegram.constants import ParseMode, ChatType
-from telegram.ext import (
-    Application, ApplicationBuilder, CommandHandler, ContextTypes,
-    MessageHandler, CallbackQueryHandler, filters, ChatMemberHandler
-)
+from telegram.ext import Application, ApplicationBuilder, ContextTypes
+
+from tg_send_queue import send_queue, reply
+from transport import get_bot
+from config_service import get_config, subscribe as subscribe_config
+from stream_archive import get_archive, archive_path
+from update_dispatch import get_dispatcher
+from state_store import get_store, state_db_path, preload, PersistentDict, PersistentSet
 
 log = logging.getLogger("tg_group_dlc")
 
@@ -26,10 +32,6 @@ def escape_md2(text: str) -> str:
         text = text.replace(ch, f"\\{ch}")
     return text.strip()
 
-def _load_config() -> dict:
-    with open("config.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
 def _resolve_group_id(cfg: dict) -> Optional[int]:
     # Приватная группа, где включено приветствие
     if "DLC_GROUP_ID" in cfg:
@@ -51,11 +53,33 @@ def _welcome_text(mention: str, chat_title: str) -> str:
         "_Загляни в правила и чувствуй себя как дома\\!_"
     ).format(m=mention, c=escape_md2(chat_title or "наш чат"))
 
+def _mention_list(mentions: List[str], limit: int) -> str:
+    # «@a, @b, @c и ещё 7» — в рейд не превращаем сообщение в простыню упоминаний
+    shown = ", ".join(mentions[:limit])
+    rest = len(mentions) - limit
+    return f"{shown} и ещё {rest}" if rest > 0 else shown
+
+def _welcome_batch_text(mentions: List[str], chat_title: str, limit: int) -> str:
+    if len(mentions) == 1:
+        return _welcome_text(mentions[0], chat_title)
+    return (
+        "*Привяу\\! Новенькие влетели в чат — {m}* ✨\n\n"
+        "Добро пожаловать в *{c}*\\.\n"
+        "_Загляните в правила и чувствуйте себя как дома\\!_"
+    ).format(m=_mention_list(mentions, limit), c=escape_md2(chat_title or "наш чат"))
+
+def _farewell_batch_text(mentions: List[str], chat_title: str, limit: int, *, bot_data: dict, scope: str) -> str:
+    if len(mentions) == 1:
+        return _farewell_text(mentions[0], chat_title, bot_data=bot_data, scope=scope)
+    return (
+        "Чат покинули: {m}\\. Начинаем операцию \"Скучаем, но делаем вид, что не очень\"\\."
+    ).format(m=_mention_list(mentions, limit))
+
 def _farewell_text(
     mention: str,
     chat_title: str,
     *,
-    context: ContextTypes.DEFAULT_TYPE,
+    bot_data: dict,
     scope: str = "global"
 ) -> str:
     """
@@ -68,7 +92,7 @@ def _farewell_text(
     """
 
     # Хранение состояний (мешков) в bot_data
-    bag_store = context.application.bot_data.setdefault("FAREWELL_BAGS", {})
+    bag_store = bot_data.setdefault("FAREWELL_BAGS", {})
     bag = bag_store.get(scope)
 
     # Если мешка нет — создаём новый и перемешиваем
@@ -94,10 +118,10 @@ def _farewell_text(
 
 
 def _normalize_lines(v) -> str:
-    """Принимает str или list[str], приводит к строке с нормальными переносами."""
+    """Принимает str или список строк (в снимке конфига — tuple), приводит к строке с нормальными переносами."""
     if v is None:
         return ""
-    if isinstance(v, list):
+    if isinstance(v, (list, tuple)):
         text = "\n".join(map(str, v))
     else:
         text = str(v)
@@ -165,6 +189,159 @@ def _build_links_command_kb(links: Dict[str, str]) -> InlineKeyboardMarkup:
     buttons = [[InlineKeyboardButton(name, url=url)] for name, url in links.items()]
     return InlineKeyboardMarkup(buttons)
 
+# ---------- готовые ответы ----------
+# Одна таблица команд на /help и первое /start — справки не разъедутся
+COMMANDS_HELP = (
+    ("/rules", "показать правила"),
+    ("/links", "полезные ссылки"),
+    ("/laststream", "последний эфир"),
+    ("/stats game &lt;игра&gt;", "сколько стримили игру"),
+    ("/stats poll", "как бот сейчас опрашивает Twitch"),
+    ("/help", "эта справка"),
+    ("!кубик", "бросок кубика"),
+    # ("!дуэль", "дуэль кубиками"),
+    ("!обнять", "обнимашка"),
+    # ("!чик", "прыжок в бассейн"),
+    ("!лю", "измеритель любви"),
+    ("!атака", "применить силу"),
+    ("!отмена", "отменить действие пользователя"),
+)
+
+HELP_TEXT = "<b>Команды</b>\n\n" + "".join(f"• {cmd} — {about}\n" for cmd, about in COMMANDS_HELP)
+
+
+class StaticReplies:
+    """
+    Всё, что не зависит от пользователя: клавиатуры, правила, ссылки.
+    Собирается один раз на снимок конфига (_apply_config), обработчики только отправляют.
+    Клавиатуры PTB неизменяемы, так что один объект безопасно отдавать во все сообщения.
+    """
+    __slots__ = ("group_welcome_kb", "pm_menu_kb", "pm_reply_kb", "rules_text", "links_text")
+
+    def __init__(self, cfg, bot_username: str):
+        social_links = cfg.get("SOCIAL_LINKS", {})
+        links_cmd = cfg.get("LINKS_COMMAND", {})  # отдельные ссылки для /links
+        streamer = cfg.get("STREAMER") or next(iter(cfg.get("STREAMERS", ())), None)
+
+        self.group_welcome_kb = _build_group_welcome_kb(bot_username, streamer, social_links)
+        self.pm_menu_kb = _build_pm_menu_inline(streamer, social_links)
+        self.pm_reply_kb = _build_pm_reply_kb()
+
+        norm = _normalize_lines(cfg.get("DLC_RULES"))
+        self.rules_text = escape_md2(norm) if norm else "Правила пока не заданы\\.\nДобавь `DLC_RULES` в config\\.json\\."
+
+        # None — ссылки не настроены; пустая строка после заголовка
+        self.links_text: Optional[str] = "\n".join(
+            ["ПОЛЕЗНЫЕ ССЫЛКИ:\n"] + [f"• [{escape_md2(name)}]({url})" for name, url in links_cmd.items()]
+        ) if links_cmd else None
+
+
+# ---------- склейка входов/выходов ----------
+class MemberEventBatcher:
+    """
+    Копит входы и выходы участников по чатам и раз в окно отдаёт их пачкой:
+    при рейде — одно приветствие на всех вместо сообщения на каждого.
+    Кто за окно успел зайти и выйти (или выйти и вернуться) — не упоминается вовсе.
+    """
+
+    def __init__(self, window: float, flush: Callable[[int, str, List[str], List[str]], Awaitable[None]]):
+        self.window = window
+        self._flush = flush
+        # chat_id -> {"title": ..., "users": {user_id: [был в чате, сейчас в чате, mention]}}
+        self._pending: Dict[int, dict] = {}
+        self._tasks: set = set()  # держим ссылки, пока пачка не отправлена
+        self._draining: Optional[asyncio.Event] = None
+
+    def add(self, chat_id: int, chat_title: str, user_id: int, mention: str, joined: bool) -> None:
+        if self._draining is None:
+            self._draining = asyncio.Event()
+        batch = self._pending.get(chat_id)
+        if batch is None:
+            # окно отсчитывается от первого события: поток входов не откладывает отправку бесконечно
+            batch = self._pending[chat_id] = {"title": chat_title, "users": {}}
+            task = asyncio.create_task(self._flush_later(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        entry = batch["users"].get(user_id)
+        if entry is None:
+            batch["users"][user_id] = [not joined, joined, mention]
+        else:
+            entry[1], entry[2] = joined, mention
+
+    async def _flush_later(self, chat_id: int) -> None:
+        try:
+            await asyncio.wait_for(self._draining.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        batch = self._pending.pop(chat_id)
+        users = batch["users"].values()
+        joined = [m for was, now, m in users if now and not was]
+        left = [m for was, now, m in users if was and not now]
+        flapped = len(users) - len(joined) - len(left)
+        if flapped:
+            log.info("Вход‑выход за окно, не упоминаем: chat=%s users=%s", chat_id, flapped)
+        try:
+            await self._flush(chat_id, batch["title"], joined, left)
+        except Exception as e:
+            log.exception("Error sending member batch: %s", e)
+
+    async def drain(self) -> None:
+        """При остановке: накопленные приветствия и прощания уходят сразу, не дожидаясь окна."""
+        if self._draining is None:
+            return
+        self._draining.set()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+async def _send_member_batch(app: Application, chat_id: int, chat_title: str,
+                             joined: List[str], left: List[str]) -> None:
+    bot_data = app.bot_data
+    limit = bot_data["member_batch_max_mentions"]
+    if joined:
+        text = _welcome_batch_text(joined, chat_title, limit)
+        kb = bot_data["replies"].group_welcome_kb
+        log.info("Приветствие: %s чел. chat=%s", len(joined), chat_id)
+        try:
+            await send_queue.submit(
+                lambda: app.bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode=ParseMode.MARKDOWN_V2,
+                    disable_web_page_preview=True,
+                    reply_markup=kb
+                ),
+                chat_id=chat_id,
+            )
+        except Forbidden:
+            log.warning("Cannot send welcome: Forbidden for chat=%s", chat_id)
+        except Exception as e:
+            log.exception("Error sending welcome message: %s", e)
+
+    if left:
+        scope = f"chat:{chat_id}"  # мешочек на каждый чат
+        await preload(bot_data.get("FAREWELL_BAGS"), scope)
+        text = _farewell_batch_text(
+            left, chat_title, limit,
+            bot_data=bot_data,
+            scope=scope
+        )
+        log.info("Прощание: %s чел. chat=%s", len(left), chat_id)
+        try:
+            await send_queue.submit(
+                lambda: app.bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode=ParseMode.MARKDOWN_V2,
+                    disable_web_page_preview=True
+                ),
+                chat_id=chat_id,
+            )
+        except Forbidden:
+            log.warning("Cannot send farewell: Forbidden for chat=%s", chat_id)
+        except Exception as e:
+            log.exception("Error sending farewell message: %s", e)
+
+
 # ---------- фолбэк‑приветствие через статус (если отключены join‑сервиски) ----------
 # Универсальный обработчик chat_member — заменяет отдельные welcome/farewell
 async def chat_member_status_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -204,51 +381,13 @@ async def chat_member_status_handler(update: Update, context: ContextTypes.DEFAU
         f"{(user.first_name or '').strip()} {(user.last_name or '').strip()}".strip() or "друг"
     )
 
-    # joined: left/kicked -> member/administrator
+    # joined: left/kicked -> member/administrator; left: наоборот
     joined = (old_status in ("left", "kicked")) and (new_status in ("member", "administrator"))
-    if joined:
-        text = _welcome_text(mention, chat.title or "наш чат")
-        kb = _build_group_welcome_kb(
-            context.bot_data["bot_username"],
-            context.bot_data.get("streamer"),
-            context.bot_data.get("social_links") or {}
-        )
-        log.info("Приветствие: user=%s chat=%s", user.id, chat.id)
-        try:
-            await context.bot.send_message(
-                chat_id=chat.id,
-                text=text,
-                parse_mode=ParseMode.MARKDOWN_V2,
-                disable_web_page_preview=True,
-                reply_markup=kb
-            )
-        except Forbidden:
-            log.warning("Cannot send welcome: Forbidden for user=%s chat=%s", user.id, chat.id)
-        except Exception as e:
-            log.exception("Error sending welcome message: %s", e)
-        return
-
-    # left: member/administrator -> left/kicked
     left = (old_status in ("member", "administrator")) and (new_status in ("left", "kicked"))
-    if left:
-        text = _farewell_text(
-            mention,
-            chat.title or "наш чат",
-            context=context,
-            scope=f"chat:{chat.id}"  # мешочек на каждый чат
-        )
-        log.info("Прощание: user=%s chat=%s old=%s new=%s", user.id, chat.id, old_status, new_status)
-        try:
-            await context.bot.send_message(
-                chat_id=chat.id,
-                text=text,
-                parse_mode=ParseMode.MARKDOWN_V2,
-                disable_web_page_preview=True
-            )
-        except Forbidden:
-            log.warning("Cannot send farewell: Forbidden for user=%s chat=%s", user.id, chat.id)
-        except Exception as e:
-            log.exception("Error sending farewell message: %s", e)
+    if joined or left:
+        # само сообщение уйдёт пачкой по окончании окна (см. MemberEventBatcher)
+        log.info("%s: user=%s chat=%s", "Вход" if joined else "Выход", user.id, chat.id)
+        context.bot_data["member_batcher"].add(chat.id, chat.title or "наш чат", user.id, mention, joined)
         return
 
     # остальные переходы — просто лог
@@ -258,39 +397,41 @@ async def chat_member_status_handler(update: Update, context: ContextTypes.DEFAU
 
 # ---------- отправка контента в ЛС ----------
 async def _send_rules_pm(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    rules = context.bot_data.get("rules_text")
-    norm = _normalize_lines(rules)
-    text = escape_md2(norm) if norm else "Правила пока не заданы\\.\nДобавь `DLC_RULES` в config\\.json\\."
-    await context.bot.send_message(
+    replies: StaticReplies = context.bot_data["replies"]
+    await send_queue.submit(
+        lambda: context.bot.send_message(
+            chat_id=user_id,
+            text=replies.rules_text,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True,
+            reply_markup=replies.pm_reply_kb
+        ),
         chat_id=user_id,
-        text=text,
-        parse_mode=ParseMode.MARKDOWN_V2,
-        disable_web_page_preview=True,
-        reply_markup=_build_pm_reply_kb()
     )
 
 async def _send_links_pm(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Используем отдельный набор ссылок для /links
-    links_cmd = context.bot_data.get("links_command") or {}
-    if not links_cmd:
-        await context.bot.send_message(
+    replies: StaticReplies = context.bot_data["replies"]
+    if replies.links_text is None:
+        await send_queue.submit(
+            lambda: context.bot.send_message(
+                chat_id=user_id,
+                text="Отдельные ссылки не настроены\\. Заполни *LINKS_COMMAND* в config\\.json\\.",
+                parse_mode=ParseMode.MARKDOWN_V2,
+                reply_markup=replies.pm_reply_kb
+            ),
             chat_id=user_id,
-            text="Отдельные ссылки не настроены\\. Заполни *LINKS_COMMAND* в config\\.json\\.",
-            parse_mode=ParseMode.MARKDOWN_V2,
-            reply_markup=_build_pm_reply_kb()
         )
         return
 
-    # добавляем пустую строку после заголовка
-    lines = ["ПОЛЕЗНЫЕ ССЫЛКИ:\n"]
-    for name, url in links_cmd.items():
-        lines.append(f"• [{escape_md2(name)}]({url})")
-
-    await context.bot.send_message(
+    await send_queue.submit(
+        lambda: context.bot.send_message(
+            chat_id=user_id,
+            text=replies.links_text,
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True
+        ),
         chat_id=user_id,
-        text="\n".join(lines),
-        parse_mode=ParseMode.MARKDOWN_V2,
-        disable_web_page_preview=True
     )
 
 
@@ -314,68 +455,122 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     app_data = context.application.bot_data
     welcomed = app_data.setdefault("welcomed_users", set())
+    await preload(welcomed, user_id)  # база читается в потоке, остальные апдейты не ждут диск
     first_time = user_id not in welcomed
     if first_time:
         welcomed.add(user_id)
 
-    kb_inline = _build_pm_menu_inline(context.bot_data.get("streamer"), context.bot_data.get("social_links") or {})
-    kb_reply  = _build_pm_reply_kb()
+    replies: StaticReplies = context.bot_data["replies"]
 
-    await update.message.reply_text(
+    await reply(
+        update.message,
         "Привяу\\! Это личка бота\\. Ниже — меню быстрых кнопок и команды в клавиатуре:",
         parse_mode=ParseMode.MARKDOWN_V2,
-        reply_markup=kb_inline,
+        reply_markup=replies.pm_menu_kb,
         disable_web_page_preview=True
     )
 
     if first_time:
-        text = (
-            "<b>Команды</b>\n"
-                "\n"
-            "• /rules — показать правила\n"
-            "• /links — полезные ссылки\n"
-            "• /help — эта справка\n"
-            "• !кубик — бросок кубика\n"
-            # "• !дуэль — дуэль кубиками (алиас)\n"
-            "• !обнять — обнимашка\n"
-            # "• !чик — прыжок в бассейн (алиас)\n"
-            "• !лю — измеритель любви\n"
-            "• !атака — применить силу\n"
-            "• !отмена — отменить действие пользователя\n"
-        )
         # reply_markup оставить как есть (клавиатура пригодится)
-        await update.message.reply_html(
-            text,
-            reply_markup=kb_reply,
+        await reply(
+            update.message,
+            HELP_TEXT,
+            html=True,
+            reply_markup=replies.pm_reply_kb,
             disable_web_page_preview=True
         )
 
 
 async def cmd_ping(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("pong 🏓")
+    await reply(update.message, "pong 🏓")
 
 async def cmd_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(
+    await reply(
+        update.message,
         f"chat_id: `{update.effective_chat.id}`\nuser_id: `{update.effective_user.id}`",
         parse_mode=ParseMode.MARKDOWN_V2
     )
 
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    text = (
-        "<b>Команды</b>\n"
-        "\n"
-        "• /rules — показать правила\n"
-        "• /links — полезные ссылки\n"
-        "• /help — эта справка\n"
-        "• !кубик — бросок кубика\n"
-        # "• !дуэль — дуэль кубиками\n"
-        "• !обнять — обнимашка\n"
-        # "• !чик — прыжок в бассейн\n"
-        "• !лю — измеритель любви\n"
-        "• !атака — применить силу\n"
-        "• !отмена — отменить действие пользователя\n"
-    )
-    await update.message.reply_html(text, disable_web_page_preview=True)
+    await reply(update.message, HELP_TEXT, html=True, disable_web_page_preview=True)
+
+def _fmt_duration(seconds: int) -> str:
+    hours, minutes = divmod(max(0, int(seconds)) // 60, 60)
+    return f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+
+def _fmt_date(ts: int) -> str:
+    return datetime.fromtimestamp(ts).strftime("%d.%m.%Y %H:%M")
+
+async def cmd_laststream(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /laststream [логин] — последний завершённый эфир из архива
+    login = context.args[0] if context.args else None
+    session = await asyncio.to_thread(context.bot_data["archive"].last_session, login)
+    if not session:
+        await reply(update.message, "В архиве пока нет ни одного эфира")
+        return
+
+    lines = [
+        f"<b>🎬 {escape(session['title'])}</b>",
+        "",
+        f"<b>Когда</b>: {_fmt_date(session['started_at'])}",
+        f"<b>Продолжительность</b>: {_fmt_duration(session['ended_at'] - session['started_at'])}",
+    ]
+    categories = list(dict.fromkeys(category for _, _, category in session["segments"]))
+    if categories:
+        lines.append(f"<b>Игры</b>: {escape(', '.join(categories))}")
+    if session["peak"] is not None:
+        lines.append(
+            f"<b>Зрители</b>: пик {session['peak']} • в среднем {session['avg']} • минимум {session['min']}"
+        )
+    await reply(update.message, "\n".join(lines), html=True)
+
+async def _reply_poll_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    scheduler = context.bot_data.get("poll_scheduler")
+    if scheduler is None:
+        await reply(update.message, "Опрос Twitch в этом процессе не запущен")
+        return
+    status = scheduler.status()
+    lines = [
+        "<b>📡 Опрос Twitch</b>",
+        "",
+        f"<b>Режим</b>: {status['mode']} — {escape(status['reason'])}",
+        f"<b>Интервал</b>: ~{status['interval']} с",
+        f"<b>Опросов</b>: {status['polls']} (эфир {status['live']} • окна старта {status['fast']}"
+        f" • редко {status['slow']} • сверка EventSub {status['eventsub']})",
+    ]
+    await reply(update.message, "\n".join(lines), html=True)
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /stats game <название> — сводка по категории из архива; /stats poll — как сейчас опрашиваем Twitch
+    args = context.args or []
+    if args and args[0].lower() == "poll":
+        await _reply_poll_stats(update, context)
+        return
+    if len(args) < 2 or args[0].lower() != "game":
+        await reply(update.message, "Использование: /stats game <название игры> или /stats poll")
+        return
+
+    name = " ".join(args[1:])
+    stats = await asyncio.to_thread(context.bot_data["archive"].category_stats, name)
+    if not stats:
+        await reply(update.message, f"По «{name}» эфиров в архиве нет")
+        return
+    if "candidates" in stats:
+        options = "\n".join(f"• {escape(c)}" for c in stats["candidates"])
+        await reply(update.message, f"По «{escape(name)}» подходит несколько игр, уточни:\n{options}", html=True)
+        return
+
+    lines = [
+        f"<b>🎮 {escape(stats['category'])}</b>",
+        "",
+        f"<b>Эфиров</b>: {stats['sessions']}",
+        f"<b>Всего в эфире</b>: {_fmt_duration(stats['seconds'])}",
+        f"<b>Впервые</b>: {_fmt_date(stats['first_started_at'])}",
+        f"<b>Последний раз</b>: {_fmt_date(stats['last_started_at'])}",
+    ]
+    if stats["peak"] is not None:
+        lines.append(f"<b>Зрители</b>: пик {stats['peak']} • в среднем {stats['avg']}")
+    await reply(update.message, "\n".join(lines), html=True)
 
 async def cmd_rules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Работает везде: в ЛС отвечаем тут же, в чатах — шлём в ЛС пользователю
@@ -384,10 +579,10 @@ async def cmd_rules(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     else:
         try:
             await _send_rules_pm(update.effective_user.id, context)
-            await update.message.reply_text("Правила отправила в личку ✅")
+            await reply(update.message, "Правила отправила в личку ✅")
         except Forbidden:
             username = context.bot_data["bot_username"]
-            await update.message.reply_text(f"Открой ЛС со мной: {_deeplink(username, 'rules')}")
+            await reply(update.message, f"Открой ЛС со мной: {_deeplink(username, 'rules')}")
 
 async def cmd_links(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_chat.type == ChatType.PRIVATE:
@@ -395,10 +590,10 @@ async def cmd_links(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     else:
         try:
             await _send_links_pm(update.effective_user.id, context)
-            await update.message.reply_text("Ссылки отправила в личку ✅")
+            await reply(update.message, "Ссылки отправила в личку ✅")
         except Forbidden:
             username = context.bot_data["bot_username"]
-            await update.message.reply_text(f"Открой ЛС со мной: {_deeplink(username, 'links')}")
+            await reply(update.message, f"Открой ЛС со мной: {_deeplink(username, 'links')}")
 
 async def cmd_welcome_preview(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     # Превью приветствия (в любом чате и в ЛС)
@@ -407,15 +602,10 @@ async def cmd_welcome_preview(update: Update, context: ContextTypes.DEFAULT_TYPE
         f"{(user.first_name or '').strip()} {(user.last_name or '').strip()}".strip() or "друг"
     )
     text = _welcome_text(mention, update.effective_chat.title or "наш чат")
-    if update.effective_chat.type == ChatType.PRIVATE:
-        kb = _build_pm_menu_inline(context.bot_data.get("streamer"), context.bot_data.get("social_links") or {})
-    else:
-        kb = _build_group_welcome_kb(
-            context.bot_data["bot_username"],
-            context.bot_data.get("streamer"),
-            context.bot_data.get("social_links") or {}
-        )
-    await update.message.reply_text(
+    replies: StaticReplies = context.bot_data["replies"]
+    kb = replies.pm_menu_kb if update.effective_chat.type == ChatType.PRIVATE else replies.group_welcome_kb
+    await reply(
+        update.message,
         text, parse_mode=ParseMode.MARKDOWN_V2,
         disable_web_page_preview=True,
         reply_markup=kb
@@ -460,60 +650,81 @@ async def welcome_members(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         welcomes.append(_welcome_text(mention, msg.chat.title))
 
-    kb = _build_group_welcome_kb(
-        context.bot_data["bot_username"],
-        context.bot_data.get("streamer"),
-        context.bot_data.get("social_links") or {}
-    )
-    await context.bot.send_message(
+    kb = context.bot_data["replies"].group_welcome_kb
+    await send_queue.submit(
+        lambda: context.bot.send_message(
+            chat_id=msg.chat.id,
+            text="\n\n".join(welcomes),
+            parse_mode=ParseMode.MARKDOWN_V2,
+            disable_web_page_preview=True,
+            reply_markup=kb
+        ),
         chat_id=msg.chat.id,
-        text="\n\n".join(welcomes),
-        parse_mode=ParseMode.MARKDOWN_V2,
-        disable_web_page_preview=True,
-        reply_markup=kb
     )
 
 # ---------- точка входа ----------
+def _apply_config(app: Application, cfg) -> None:
+    # ответы пересобираются целиком и подменяются одним присваиванием
+    app.bot_data["replies"] = StaticReplies(cfg, app.bot_data["bot_username"])
+
 async def start_group_dlc() -> Application | None:
     """
     Создаём и запускаем PTB‑приложение в режиме polling.
     Возвращаем Application (чтобы при желании остановить на shutdown)
     или None — если не настроен chat_id.
     """
-    cfg = _load_config()
+    cfg = get_config()
     token = cfg["TELEGRAM_TOKEN"]
     group_id = _resolve_group_id(cfg)
     if group_id is None:
         log.warning("DLC отключён: не задан DLC_GROUP_ID в config.json")
         return None
 
-    social_links: Dict[str, str] = cfg.get("SOCIAL_LINKS", {})
-    links_command: Dict[str, str] = cfg.get("LINKS_COMMAND", {})  # НОВОЕ: отдельные ссылки для /links
-    rules_text: Optional[str] = cfg.get("DLC_RULES")
-    streamer: Optional[str] = cfg.get("STREAMER")
-
-    app = ApplicationBuilder().token(token).build()
+    app = (
+        ApplicationBuilder()
+        .bot(get_bot(token))  # общий клиент с анонсером
+        # обработчики ждут лимитов Telegram в общей очереди: апдейты обрабатываются
+        # параллельно, чтобы занятая группа не задерживала личку, /start и мост
+        .concurrent_updates(int(cfg.get("DLC_CONCURRENT_UPDATES", 32)))
+        .build()
+    )
     app.bot_data["group_id"] = group_id
-    app.bot_data["social_links"] = social_links
-    app.bot_data["links_command"] = links_command  # сохраняем отдельно
-    app.bot_data["rules_text"] = rules_text
-    app.bot_data["streamer"] = streamer
 
     # username бота для deep‑link в групповой клавиатуре
     me = await app.bot.get_me()
     app.bot_data["bot_username"] = me.username
 
-    # handlers
-    # app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_members))
-    app.add_handler(ChatMemberHandler(chat_member_status_handler, ChatMemberHandler.CHAT_MEMBER))
-    app.add_handler(CommandHandler("start",  cmd_start))
-    app.add_handler(CommandHandler("ping",   cmd_ping))
-    app.add_handler(CommandHandler("id",     cmd_id))
-    app.add_handler(CommandHandler("help",   cmd_help))
-    app.add_handler(CommandHandler("rules",  cmd_rules))
-    app.add_handler(CommandHandler("links",  cmd_links))
-    app.add_handler(CommandHandler("welcome_preview", cmd_welcome_preview))  # скрытая тест‑команда
-    app.add_handler(CallbackQueryHandler(cb_buttons))
+    _apply_config(app, cfg)
+    subscribe_config(lambda new_cfg: _apply_config(app, new_cfg))  # ссылки и правила — без рестарта
+    app.bot_data["archive"] = get_archive(archive_path(cfg))
+
+    # кого уже приветствовали и мешки прощаний — в SQLite, чтобы не слать приветствие заново после рестарта
+    store = get_store(state_db_path(cfg))
+    store.start()
+    app.bot_data["welcomed_users"] = PersistentSet(store, "welcomed_users", int)
+    app.bot_data["FAREWELL_BAGS"] = PersistentDict(store, "farewell_bags")
+
+    # входы/выходы склеиваются за окно в одно сообщение на чат
+    app.bot_data["member_batch_max_mentions"] = int(cfg.get("DLC_MEMBER_BATCH_MAX_MENTIONS", 10))
+    app.bot_data["member_batcher"] = MemberEventBatcher(
+        float(cfg.get("DLC_MEMBER_BATCH_SECONDS", 3)),
+        lambda chat_id, title, joined, left: _send_member_batch(app, chat_id, title, joined, left),
+    )
+
+    # handlers — через общий диспетчер приложения (fun-DLC и мост добавляют свои туда же)
+    dispatch = get_dispatcher(app)
+    # dispatch.watch_chats("welcome", [group_id], welcome_members)
+    dispatch.chat_member(chat_member_status_handler)
+    dispatch.command(cmd_start,  "/start")
+    dispatch.command(cmd_ping,   "/ping")
+    dispatch.command(cmd_id,     "/id")
+    dispatch.command(cmd_help,   "/help")
+    dispatch.command(cmd_rules,  "/rules")
+    dispatch.command(cmd_links,  "/links")
+    dispatch.command(cmd_laststream, "/laststream")
+    dispatch.command(cmd_stats,  "/stats")
+    dispatch.command(cmd_welcome_preview, "/welcome_preview")  # скрытая тест‑команда
+    dispatch.callback(cb_buttons)
 
     # запуск (неблокирующий)
     await app.initialize()
@@ -0,0 +1,339 @@
+# tg_send_queue.py
+"""
+Общая очередь исходящих запросов в Telegram для всех модулей бота.
+
+• token bucket на весь бот и на каждый чат (лимиты Telegram: ~30 сообщений/с всего,
+  ~1/с в личку, ~20/мин в группу или канал);
+• приоритеты: анонс стрима уходит раньше fun-ответов;
+• RetryAfter — чат ставится на паузу на указанное время, запрос повторяется;
+• сетевой сбой — повтор; но таймаут повторяется только у правок (retry_on_timeout):
+  отправка, не дождавшаяся ответа, могла дойти, и повтор дал бы дубль сообщения;
+• правки одного и того же сообщения, ещё стоящие в очереди, схлопываются до последней —
+  устаревшие кадры (например, анимация кубика) не отправляются.
+
+Использование:
+    msg = await send_queue.submit(lambda: bot.send_message(chat_id, text), chat_id=chat_id)
+"""
+import asyncio
+import itertools
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Union
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+log = logging.getLogger("tg_send_queue")
+
+PRIORITY_ANNOUNCE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_FUN = 10
+
+BUCKET_SWEEP_SECONDS = 300  # как часто забывать лимиты чатов, которые давно ничего не отправляли
+
+RequestFactory = Callable[[], Awaitable[Any]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_key", "factory", "futures", "coalesce_key", "retry_on_timeout",
+                 "attempts", "not_before")
+
+    def __init__(self, priority, seq, chat_key, factory, coalesce_key, retry_on_timeout):
+        self.priority = priority
+        self.seq = seq
+        self.chat_key = chat_key
+        self.factory = factory
+        self.futures: List[asyncio.Future] = []
+        self.coalesce_key = coalesce_key
+        self.retry_on_timeout = retry_on_timeout
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+def _retry_after_seconds(e: RetryAfter) -> float:
+    value: Union[int, float, timedelta] = getattr(e, "retry_after", 1)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TelegramSendQueue:
+    def __init__(
+        self,
+        *,
+        global_rate: float = 25.0,
+        private_rate: float = 1.0,
+        private_burst: float = 3.0,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3.0,
+        max_in_flight: int = 8,
+        max_retries: int = 3,
+        max_flood_retries: int = 5,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.max_flood_retries = max_flood_retries
+
+        self._pending: List[_Job] = []
+        self._by_coalesce_key: Dict[Hashable, _Job] = {}
+        self._chat_buckets: Dict[str, TokenBucket] = {}
+        self._chat_blocked_until: Dict[str, float] = {}
+        self._busy_chats: set = set()
+        self._swept_at = time.monotonic()
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: set = set()  # задачи отправки, держим ссылки до завершения
+        self.stats = {"sent": 0, "coalesced": 0, "retry_after": 0, "timed_out": 0, "failed": 0}
+
+    # ---------- публичное API ----------
+    async def submit(
+        self,
+        factory: RequestFactory,
+        *,
+        chat_id: Union[int, str],
+        priority: int = PRIORITY_DEFAULT,
+        coalesce_key: Optional[Hashable] = None,
+        retry_on_timeout: Optional[bool] = None,
+    ) -> Any:
+        """
+        Ставит запрос в очередь и ждёт результат.
+        factory — функция без аргументов, возвращающая корутину запроса (её можно вызвать повторно).
+        coalesce_key — ключ правки (например, (chat_id, message_id)): если правка с тем же ключом
+        ещё ждёт отправки, она заменяется новой, и оба вызова получат результат последней.
+        retry_on_timeout — повторять ли запрос после таймаута; только для повторяемых без вреда
+        (правки). По умолчанию — если задан coalesce_key.
+        """
+        return await self.enqueue(
+            factory, chat_id=chat_id, priority=priority,
+            coalesce_key=coalesce_key, retry_on_timeout=retry_on_timeout,
+        )
+
+    def enqueue(
+        self,
+        factory: RequestFactory,
+        *,
+        chat_id: Union[int, str],
+        priority: int = PRIORITY_DEFAULT,
+        coalesce_key: Optional[Hashable] = None,
+        retry_on_timeout: Optional[bool] = None,
+    ) -> asyncio.Future:
+        """
+        То же, что submit, но ставит запрос в очередь сразу, без await, и возвращает future результата.
+        Порядок вызовов enqueue — порядок правок: более поздняя правка всегда заменяет более раннюю.
+        """
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        chat_key = str(chat_id)
+        if retry_on_timeout is None:
+            retry_on_timeout = coalesce_key is not None
+
+        job = self._by_coalesce_key.get(coalesce_key) if coalesce_key is not None else None
+        if job is not None:
+            job.factory = factory
+            job.priority = min(job.priority, priority)
+            job.futures.append(future)
+            self.stats["coalesced"] += 1
+        else:
+            job = _Job(priority, next(self._seq), chat_key, factory, coalesce_key, retry_on_timeout)
+            job.futures.append(future)
+            self._pending.append(job)
+            if coalesce_key is not None:
+                self._by_coalesce_key[coalesce_key] = job
+
+        self._wakeup.set()
+        return future
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Останавливает очередь: уже отправляемые запросы дожидаются (не дольше timeout), остальные отменяются."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._inflight:
+            _, unfinished = await asyncio.wait(set(self._inflight), timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*unfinished, return_exceptions=True)
+        for job in self._pending:
+            for future in job.futures:
+                future.cancel()
+        self._pending.clear()
+        self._by_coalesce_key.clear()
+
+    # ---------- внутреннее ----------
+    def _ensure_worker(self) -> None:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    def _chat_bucket(self, chat_key: str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_key)
+        if bucket is None:
+            # личка — положительный id; группы/каналы — отрицательный id или @username
+            if chat_key.isdigit():
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chat_buckets[chat_key] = bucket
+        return bucket
+
+    def _sweep_buckets(self, now: float) -> None:
+        """Забывает лимиты чатов без задач, у которых бакет снова полон: от нового такого же не отличить."""
+        self._swept_at = now
+        waiting = self._busy_chats | {job.chat_key for job in self._pending}
+        for chat_key, bucket in list(self._chat_buckets.items()):
+            if chat_key in waiting or self._chat_blocked_until.get(chat_key, 0.0) > now:
+                continue
+            bucket.wait_time(now)  # пополняет
+            if bucket.tokens >= bucket.capacity:
+                del self._chat_buckets[chat_key]
+                self._chat_blocked_until.pop(chat_key, None)
+
+    def _pick(self, now: float):
+        """Самая приоритетная задача, которую можно отправить прямо сейчас, и время до следующей."""
+        best: Optional[_Job] = None
+        wait = None
+        if len(self._busy_chats) >= self.max_in_flight:
+            return None, None
+        for job in self._pending:
+            if job.chat_key in self._busy_chats:
+                continue  # в одном чате строго по очереди
+            delay = max(
+                job.not_before - now,
+                self._chat_blocked_until.get(job.chat_key, 0.0) - now,
+                self._chat_bucket(job.chat_key).wait_time(now),
+            )
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if best is None or (job.priority, job.seq) < (best.priority, best.seq):
+                best = job
+        if best is not None:
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                return None, global_wait
+        return best, wait
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now - self._swept_at >= BUCKET_SWEEP_SECONDS:
+                self._sweep_buckets(now)
+            job, wait = self._pick(now)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._pending.remove(job)
+            if job.coalesce_key is not None:
+                self._by_coalesce_key.pop(job.coalesce_key, None)
+            self.global_bucket.take(now)
+            self._chat_bucket(job.chat_key).take(now)
+            self._busy_chats.add(job.chat_key)
+            task = asyncio.create_task(self._execute(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    def _requeue(self, job: _Job, delay: float) -> None:
+        job.not_before = time.monotonic() + delay
+        if job.coalesce_key is not None:
+            newer = self._by_coalesce_key.get(job.coalesce_key)
+            if newer is not None:
+                # пока ждали, пришла более свежая правка — отдаём ей наших ожидающих
+                newer.futures.extend(job.futures)
+                return
+            self._by_coalesce_key[job.coalesce_key] = job
+        self._pending.append(job)
+
+    async def _execute(self, job: _Job) -> None:
+        try:
+            result = await job.factory()
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            self.stats["retry_after"] += 1
+            self._chat_blocked_until[job.chat_key] = time.monotonic() + delay
+            job.attempts += 1
+            log.warning("Flood control в чате %s: ждём %.0f с (попытка %s)", job.chat_key, delay, job.attempts)
+            if job.attempts <= self.max_flood_retries:
+                self._requeue(job, delay)
+            else:
+                self._fail(job, e)
+        except BadRequest as e:
+            # BadRequest — наследник NetworkError, но повторять его бессмысленно
+            self._fail(job, e)
+        except TimedOut as e:
+            # TimedOut — тоже NetworkError; ответа нет, но сообщение могло уже уйти
+            self.stats["timed_out"] += 1
+            job.attempts += 1
+            if job.retry_on_timeout and job.attempts <= self.max_retries:
+                self._requeue(job, 0.5 * job.attempts)
+            else:
+                self._fail(job, e)
+        except NetworkError as e:
+            job.attempts += 1
+            if job.attempts <= self.max_retries:
+                self._requeue(job, 0.5 * job.attempts)
+            else:
+                self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.stats["sent"] += 1
+            for future in job.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._busy_chats.discard(job.chat_key)
+            self._wakeup.set()
+
+    def _fail(self, job: _Job, error: Exception) -> None:
+        self.stats["failed"] += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_exception(error)
+
+
+# Один экземпляр на процесс: лимиты Telegram общие для всех модулей с одним токеном
+send_queue = TelegramSendQueue()
+
+
+async def reply(message, text: str, *, html: bool = False, priority: int = PRIORITY_DEFAULT, **kwargs):
+    """message.reply_text / reply_html через общую очередь."""
+    send = message.reply_html if html else message.reply_text
+    return await send_queue.submit(lambda: send(text, **kwargs), chat_id=message.chat_id, priority=priority)
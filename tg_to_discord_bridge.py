@@ -1,171 +1,250 @@
 # tg_to_discord_bridge.py
-import json
-import aiohttp
-import re
-from telegram import Update
-from telegram.ext import Application, MessageHandler, ContextTypes, filters
-
-
-def load_config():
-    with open("config.json", "r", encoding="utf-8") as f:
-        return json.load(f)
-
-def remove_emoji(text: str) -> str:
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"
-        "\U0001F300-\U0001F5FF"
-        "\U0001F680-\U0001F6FF"
-        "\U0001F1E0-\U0001F1FF"
-        "\U00002700-\U000027BF"
-        "\U000024C2-\U0001F251"
-        "]+",
-        flags=re.UNICODE
-    )
-    return emoji_pattern.sub("", text).strip()
-
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Bot, Chat, Message, Update
+from telegram.ext import Application, ContextTypes
+
+from discord_outbox import outbox, chat_icon_ref
+from config_service import get_config, subscribe as subscribe_config
+from bridge_filters import strip_emoji, has_letters_or_digits
+from media_pipeline import media_of, plan_media, oversize_note
+from bridge_routes import get_routes
+from update_dispatch import get_dispatcher
+
+log = logging.getLogger("tg_to_discord_bridge")
+
+_cfg = get_config()
+CHAT_META_TTL_SECONDS = int(_cfg.get("CHAT_META_TTL_SECONDS", 24 * 3600))
+# ссылка на файл Telegram живёт не меньше часа — обновляем чуть раньше
+CHAT_ICON_URL_TTL_SECONDS = 50 * 60
+ALBUM_WINDOW_SECONDS = float(_cfg.get("ALBUM_WINDOW_SECONDS", 1.5))
+ALBUM_MAX_ATTACHMENTS = 10  # больше вложений Discord в одно сообщение не принимает
+
+
+class ChatMetaCache:
+    """
+    Аватар канала-источника для подвала embed.
+    get_chat — раз в CHAT_META_TTL_SECONDS (или когда в канале сменили фото),
+    get_file — когда протухает ссылка на файл; остальные посты идут без запросов к Bot API.
+    """
+
+    def __init__(self, meta_ttl: float, url_ttl: float):
+        self.meta_ttl = meta_ttl
+        self.url_ttl = url_ttl
+        self._entries: Dict[int, dict] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    async def icon_url(self, bot: Bot, chat_id: int) -> Optional[str]:
+        async with self._locks.setdefault(chat_id, asyncio.Lock()):  # параллельные посты ждут один запрос
+            now = time.monotonic()
+            entry = self._entries.get(chat_id)
+            if entry is None or now - entry["meta_at"] >= self.meta_ttl:
+                chat_info = await bot.get_chat(chat_id)
+                entry = {
+                    "meta_at": now,
+                    "file_id": chat_info.photo.small_file_id if chat_info.photo else None,
+                    "url": None,
+                    "url_at": 0.0,
+                }
+                self._entries[chat_id] = entry
+            if entry["file_id"] and (entry["url"] is None or now - entry["url_at"] >= self.url_ttl):
+                file = await bot.get_file(entry["file_id"])
+                entry["url"], entry["url_at"] = file.file_path, now
+            return entry["url"]
+
+    def invalidate(self, chat_id: int) -> None:
+        self._entries.pop(chat_id, None)
+
+
+chat_meta = ChatMetaCache(CHAT_META_TTL_SECONDS, CHAT_ICON_URL_TTL_SECONDS)
+
+
+class AlbumBuffer:
+    """Копит сообщения одного media_group_id, пока window секунд не придёт новых, затем отдаёт их в _forward."""
+
+    def __init__(self, window: float):
+        self.window = window
+        self._albums: Dict[Tuple[int, str], dict] = {}
+        self._tasks: set = set()  # держим ссылки, пока альбом не отправлен
+        self._draining: Optional[asyncio.Event] = None
+
+    def add(self, bot: Bot, chat: Chat, msg: Message) -> None:
+        if self._draining is None:
+            self._draining = asyncio.Event()
+        key = (chat.id, msg.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = {"msgs": [], "last": 0.0}
+            task = asyncio.create_task(self._flush_later(key, bot, chat))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        album["msgs"].append(msg)
+        album["last"] = time.monotonic()
+
+    async def _flush_later(self, key: Tuple[int, str], bot: Bot, chat: Chat) -> None:
+        album = self._albums[key]
+        while not self._draining.is_set() and (delay := album["last"] + self.window - time.monotonic()) > 0:
+            try:
+                await asyncio.wait_for(self._draining.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        del self._albums[key]
+        msgs = sorted(album["msgs"], key=lambda m: m.message_id)
+        try:
+            await _forward(bot, chat, msgs)
+        except Exception as e:
+            log.exception(f"Не удалось переслать альбом {key[1]}: {e}")
+
+    async def drain(self) -> None:
+        """При остановке: накопленные альбомы уходят в очередь сразу, не дожидаясь окна."""
+        if self._draining is None:
+            return
+        self._draining.set()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
 
-async def tg_to_discord(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cfg = load_config()
 
-    source_chat = str(cfg.get("TG_NEWS_SOURCE", "")).replace("@", "")
-    webhook_url = cfg.get("DISCORD_NEWS_WEBHOOK")
-    embed_color = int(str(cfg.get("DISCORD_EMBED_COLOR", "00BFFF")).replace("#", ""), 16)
+albums = AlbumBuffer(ALBUM_WINDOW_SECONDS)
 
-    if not webhook_url:
-        return
 
+async def tg_to_discord(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = update.effective_message
     chat = update.effective_chat
 
     if not msg or not chat:
         return
 
-    chat_id = str(chat.id)
-    chat_username = chat.username or ""
+    # маршруты из снимка конфига, поиск по id/username чата — без перебора
+    if not get_routes(get_config()).match(chat):
+        return
 
-    if chat_id != source_chat and chat_username != source_chat:
+    # 🖼 Сменили или удалили фото канала — аватар в подвале перезапросим со следующим постом
+    if msg.new_chat_photo or msg.delete_chat_photo:
+        chat_meta.invalidate(chat.id)
         return
 
-    text = msg.text or msg.caption or ""
-    text = remove_emoji(text)
+    # 🗂 Альбом приходит отдельными апдейтами — собираем его и шлём одним сообщением
+    if msg.media_group_id:
+        albums.add(context.bot, chat, msg)
+        return
 
-    # ❗ Фильтр: игнорируем мусор (эмодзи, стикеры и т.д.)
-    if not text.strip() and not msg.photo and not msg.video_note:
+    await _forward(context.bot, chat, [msg])
+
+
+async def _forward(bot: Bot, chat: Chat, msgs: List[Message]):
+    """Пересылает пост (или альбом — несколько сообщений) во все вебхуки маршрутов этого чата."""
+    routes = get_routes(get_config()).match(chat)
+    if not routes:
         return
 
-    if text.strip() and not msg.photo and not msg.video_note:
-        cleaned = text.strip()
-        has_letters_or_digits = any(ch.isalnum() for ch in cleaned)
+    msg = msgs[0]
+    # у альбома подпись обычно только у одного элемента
+    text = next((m.text or m.caption for m in msgs if m.text or m.caption), "")
+    text = strip_emoji(text)
+    # фото, видео, GIF, кружки и документы — только метаданные, файлы качаются при отправке
+    items = [item for item in map(media_of, msgs) if item][:ALBUM_MAX_ATTACHMENTS]
+
+    # ❗ Фильтр: игнорируем мусор (эмодзи, стикеры и т.д.)
+    if not text.strip() and not items:
+        return
 
-        if not has_letters_or_digits:
+    if text.strip() and not items:
+        if not has_letters_or_digits(text):
             return
 
-    # ❗ Фильтр по ключевым словам (например стримы)
-    block_keywords = cfg.get("TG_FILTER_BLOCK", [])
-    text_lower = text.lower()
+    # ❗ Фильтр по ключевым словам и регуляркам (например стримы) — у каждого маршрута свой
+    passed = []
+    for route in routes:
+        reason = route.filter.blocked_by(text)
+        if reason:
+            log.info(f"Пост {msg.message_id} не переслан по маршруту {route.name}: «{reason}»")
+        else:
+            passed.append(route)
 
-    if any(word.lower() in text_lower for word in block_keywords):
+    if not passed:
         return
 
     # Ссылка на пост (если канал публичный)
     post_url = None
     if chat.username:
         post_url = f"https://t.me/{chat.username}/{msg.message_id}"
-        
+
+    # 📏 что уйдёт файлом, что ужмётся при отправке, а что — только ссылкой (по размеру из Telegram)
+    planned, skipped = plan_media(items, post_url)
+    files = [ref for _, ref in planned]
+    notes = [oversize_note(post_url) for _ in skipped]
+
     # 🎥 Кружок (video_note) — отправляем БЕЗ embed
     if msg.video_note:
-        video = msg.video_note
-        tg_file = await context.bot.get_file(video.file_id)
-        video_bytes = await tg_file.download_as_bytearray()
-
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-
-            payload = {}
-
-            form.add_field("payload_json", json.dumps(payload, ensure_ascii=False))
-            form.add_field(
-                "file",
-                bytes(video_bytes),
-                filename="telegram_video.mp4",
-                content_type="video/mp4"
-            )
-    
-            await session.post(webhook_url, data=form)
-    
+        payload = {"content": notes[0]} if notes else {}
+        await _fan_out(chat, msg, [(url, payload, files) for route in passed for url in route.webhooks])
         return
-        
-    chat_photo_url = None
-
-    try:
-        chat_info = await context.bot.get_chat(chat.id)
-        if chat_info.photo:
-            file = await context.bot.get_file(chat_info.photo.small_file_id)
-            chat_photo_url = file.file_path
-    except Exception:
-        pass
-
-    embed = {
-        "title": "📢 Новость из Telegram",
-        "description": text if text.strip() else " ",
-        "color": embed_color,
-    }
-
-    footer_text = cfg.get("DISCORD_FOOTER_TEXT")
-
-    if footer_text:
-        embed["footer"] = {
-            "text": footer_text
+
+    # 📷 Первое фото (у альбома) — картинкой embed, остальное — вложениями
+    image = None
+    first_photo = next((ref for item, ref in planned if item.kind == "photo"), None)
+    if first_photo:
+        image = {
+            "url": f"attachment://{first_photo[1]}"
         }
 
-        if chat_photo_url:
-            embed["footer"]["icon_url"] = chat_photo_url
+    description = "\n\n".join(filter(None, [text.strip(), *notes])) or " "
 
+    jobs = []
+    for route in passed:
+        embed = {
+            "title": "📢 Новость из Telegram",
+            "description": description,
+            "color": route.color,
+        }
 
-    if post_url:
-        embed["url"] = post_url
+        if route.footer:
+            embed["footer"] = {
+                "text": route.footer
+            }
 
-    files = {}
+            # ссылка на аватар содержит токен бота — в очередь пишем заглушку, воркер подставит ссылку
+            embed["footer"]["icon_url"] = chat_icon_ref(chat.id)
 
-    # 📷 Фото
-    if msg.photo:
-        photo = msg.photo[-1]
-        tg_file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await tg_file.download_as_bytearray()
+        if post_url:
+            embed["url"] = post_url
 
-        files["file"] = (
-            "telegram_photo.jpg",
-            bytes(photo_bytes),
-            "image/jpeg"
-        )
+        if image:
+            embed["image"] = image
 
-        embed["image"] = {
-            "url": "attachment://telegram_photo.jpg"
+        payload = {
+            "embeds": [embed]
         }
+        jobs.extend((url, payload, files) for url in route.webhooks)
+
+    await _fan_out(chat, msg, jobs)
 
-    payload = {
-        "embeds": [embed]
-    }
-
-    async with aiohttp.ClientSession() as session:
-        if files:
-            form = aiohttp.FormData()
-            form.add_field("payload_json", json.dumps(payload, ensure_ascii=False))
-
-            for field_name, file_data in files.items():
-                filename, content, content_type = file_data
-                form.add_field(
-                    field_name,
-                    content,
-                    filename=filename,
-                    content_type=content_type
-                )
-
-            await session.post(webhook_url, data=form)
-        else:
-            await session.post(webhook_url, json=payload)
+
+async def _fan_out(chat: Chat, msg: Message, jobs: List[tuple]):
+    # у каждого вебхука своя запись в очереди: воркеры отправляют их параллельно,
+    # а дедупликация (чат, сообщение, вебхук) не даст отправить пост туда же дважды
+    await asyncio.gather(*(
+        outbox.enqueue(f"{chat.id}:{msg.message_id}:{_webhook_tag(url)}", url, payload, files)
+        for url, payload, files in jobs
+    ))
+
+
+def _webhook_tag(url: str) -> str:
+    return hashlib.sha1(url.encode()).hexdigest()[:12]
 
 
 def register_tg_to_discord_bridge(app: Application):
-    app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, tg_to_discord))
\ No newline at end of file
+    # отправка — воркерами очереди: файлы качаются и уходят в Discord уже вне обработчика апдейта
+    outbox.start(app.bot, resolve_icon=chat_meta.icon_url)
+
+    # мост наблюдает только за чатами-источниками маршрутов; список обновляется вместе с конфигом
+    dispatch = get_dispatcher(app)
+
+    def watch_sources(cfg):
+        dispatch.watch_chats("tg_to_discord", get_routes(cfg).sources(), tg_to_discord)
+
+    watch_sources(get_config())
+    subscribe_config(watch_sources)
\ No newline at end of file
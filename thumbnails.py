@@ -0,0 +1,132 @@
+# thumbnails.py
+"""
+Превью стрима: скачиваем сами, хэшируем и загружаем в Telegram только при реальной смене кадра.
+
+• ключ картинки — перцептивный dHash (если есть Pillow) или sha256 байтов;
+• почти одинаковые кадры (расстояние Хэмминга ≤ порога) считаются тем же превью —
+  edit_message_media не дёргается;
+• после первой загрузки Telegram возвращает file_id — повторные отправки
+  (IRL-картинка, финальная карточка) идут по file_id без повторной загрузки.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+import aiohttp
+
+from transport import http_session
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow не обязателен — без него сравниваем байты
+    Image = None
+
+log = logging.getLogger("thumbnails")
+
+URL_CACHE_LIMIT = 64
+FILE_ID_CACHE_LIMIT = 256
+MAX_THUMBNAIL_BYTES = 5 * 1024 * 1024
+
+
+def _dhash(data: bytes) -> str:
+    """64-битный difference hash: устойчив к перекодированию JPEG и мелкому шуму."""
+    with Image.open(io.BytesIO(data)) as img:
+        small = img.convert("L").resize((9, 8))
+        px = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = px[row * 9 + col]
+            right = px[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return f"{bits:016x}"
+
+
+def _content_key(data: bytes) -> str:
+    if Image is not None:
+        try:
+            return "p:" + _dhash(data)
+        except Exception as e:
+            log.debug("dHash не посчитался, берём sha256: %s", e)
+    return "s:" + hashlib.sha256(data).hexdigest()
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class ThumbnailPipeline:
+    def __init__(self, *, hash_threshold: int = 6, timeout: float = 15.0):
+        self.hash_threshold = hash_threshold
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # url -> {'key': str, 'data': bytes | None}
+        self._by_url: "OrderedDict[str, dict]" = OrderedDict()
+        # ключ картинки -> file_id в Telegram
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+
+    def _same_picture(self, a: Optional[str], b: str) -> bool:
+        if a == b:
+            return True
+        if a and a.startswith("p:") and b.startswith("p:"):
+            return _hamming(a[2:], b[2:]) <= self.hash_threshold
+        return False
+
+    async def _download(self, url: str) -> bytes:
+        async with http_session().get(url, timeout=self.timeout) as resp:
+            resp.raise_for_status()
+            data = await resp.content.read(MAX_THUMBNAIL_BYTES + 1)
+        if len(data) > MAX_THUMBNAIL_BYTES:
+            raise ValueError(f"превью больше {MAX_THUMBNAIL_BYTES} байт")
+        return data
+
+    async def resolve(self, url: str, prev_key: Optional[str] = None) -> Tuple[str, Union[str, bytes]]:
+        """
+        Возвращает (ключ картинки, что отдать в photo/media).
+        Если кадр визуально не изменился — возвращает prev_key, и вызывающий код не станет редактировать медиа.
+        При ошибке скачивания — (url, url): Telegram сам заберёт картинку, как раньше.
+        """
+        entry = self._by_url.get(url)
+        if entry is None:
+            try:
+                data = await self._download(url)
+            except Exception as e:
+                log.warning("Не удалось скачать превью %s: %s", url, e)
+                return url, url
+
+            key = await asyncio.to_thread(_content_key, data)
+            if self._same_picture(prev_key, key):
+                key = prev_key
+            entry = {"key": key, "data": None if key in self._file_ids else data}
+            self._by_url[url] = entry
+            while len(self._by_url) > URL_CACHE_LIMIT:
+                self._by_url.popitem(last=False)
+        else:
+            self._by_url.move_to_end(url)
+            if self._same_picture(prev_key, entry["key"]):
+                entry["key"] = prev_key
+
+        key = entry["key"]
+        file_id = self._file_ids.get(key)
+        if file_id:
+            return key, file_id
+        if entry["data"] is None:
+            # байты уже выброшены, а file_id вытеснен из кэша — отдаём ссылку
+            return key, url
+        return key, entry["data"]
+
+    def remember_file_id(self, key: str, message) -> None:
+        """Запоминает file_id из ответа send_photo/edit_message_media."""
+        photo = getattr(message, "photo", None)
+        if not photo or not key:
+            return
+        self._file_ids[key] = photo[-1].file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > FILE_ID_CACHE_LIMIT:
+            self._file_ids.popitem(last=False)
+        # байты больше не нужны — дальше отправляем по file_id
+        for entry in self._by_url.values():
+            if entry["key"] == key:
+                entry["data"] = None
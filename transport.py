@@ -0,0 +1,86 @@
+# transport.py
+"""
+Общий сетевой слой процесса.
+
+• get_bot() — один ExtBot на токен: им пользуются и анонсер, и DLC-приложение
+  (ApplicationBuilder().bot(...)), у них общий пул keep-alive соединений к api.telegram.org;
+  HTTP/2, если установлен пакет h2 (httpx[http2]); getUpdates — отдельным соединением,
+  чтобы long polling не занимал пул;
+• http_session() — одна aiohttp-сессия для Twitch Helix, превью, EventSub и Discord:
+  keep-alive пул и кэш DNS.
+
+Настройки (config.json): TELEGRAM_POOL_SIZE, HTTP_POOL_SIZE, HTTP_POOL_PER_HOST, DNS_CACHE_SECONDS.
+"""
+import importlib.util
+import logging
+from typing import Optional
+
+import aiohttp
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from config_service import get_config
+
+log = logging.getLogger("transport")
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+_cfg = get_config()
+TELEGRAM_POOL_SIZE = int(_cfg.get("TELEGRAM_POOL_SIZE", 16))  # общая очередь держит до 8 запросов в полёте + DLC
+HTTP_POOL_SIZE = int(_cfg.get("HTTP_POOL_SIZE", 32))
+HTTP_POOL_PER_HOST = int(_cfg.get("HTTP_POOL_PER_HOST", 8))
+DNS_CACHE_SECONDS = int(_cfg.get("DNS_CACHE_SECONDS", 300))
+
+_bots = {}
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_bot(token: str) -> ExtBot:
+    bot = _bots.get(token)
+    if bot is None:
+        http_version = "2" if HTTP2_AVAILABLE else "1.1"
+        request = HTTPXRequest(
+            connection_pool_size=TELEGRAM_POOL_SIZE,
+            connect_timeout=10.0,
+            read_timeout=20.0,
+            write_timeout=20.0,
+            pool_timeout=10.0,
+            http_version=http_version,
+        )
+        get_updates_request = HTTPXRequest(
+            connection_pool_size=1,
+            connect_timeout=10.0,
+            read_timeout=60.0,
+            pool_timeout=10.0,
+            http_version=http_version,
+        )
+        bot = _bots[token] = ExtBot(token, request=request, get_updates_request=get_updates_request)
+        log.info("Telegram: общий клиент, HTTP/%s, пул %s соединений", http_version, TELEGRAM_POOL_SIZE)
+    return bot
+
+
+def http_session() -> aiohttp.ClientSession:
+    """Общая aiohttp-сессия (создаётся при первом обращении внутри event loop)."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_SIZE,
+            limit_per_host=HTTP_POOL_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_SECONDS,
+            keepalive_timeout=60,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=30))
+    return _session
+
+
+async def close() -> None:
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    for bot in _bots.values():
+        try:
+            await bot.shutdown()
+        except Exception as e:
+            log.warning("Не удалось закрыть Telegram-клиент: %s", e)
@@ -0,0 +1,247 @@
+# twitch_eventsub.py
+"""
+EventSub (webhook) для мгновенного детекта начала/конца стрима.
+
+• EventSubWebhookServer — aiohttp-сервер, который принимает уведомления Twitch:
+  проверяет HMAC-подпись, отвечает на challenge, отсеивает повторы и старые сообщения
+  и передаёт (тип подписки, event) в колбэк.
+• sync_subscriptions() — приводит подписки на Twitch к нужному набору
+  (stream.online / stream.offline / channel.update для каждого канала).
+
+Для офлайн-проверки есть eventsub_fake.py — локальная замена Helix API и доставки событий.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from transport import http_session
+
+log = logging.getLogger("twitch_eventsub")
+
+HELIX_URL = "https://api.twitch.tv/helix"
+
+# тип подписки -> версия
+SUBSCRIPTION_VERSIONS: Dict[str, str] = {
+    "stream.online": "1",
+    "stream.offline": "1",
+    "channel.update": "2",
+}
+
+HDR_ID = "Twitch-Eventsub-Message-Id"
+HDR_TIMESTAMP = "Twitch-Eventsub-Message-Timestamp"
+HDR_SIGNATURE = "Twitch-Eventsub-Message-Signature"
+HDR_TYPE = "Twitch-Eventsub-Message-Type"
+
+MAX_MESSAGE_AGE = timedelta(minutes=10)  # Twitch рекомендует отбрасывать более старые
+SEEN_IDS_LIMIT = 1024
+
+EventCallback = Callable[[str, dict], Awaitable[None]]
+
+
+# ---------- подпись ----------
+def sign_message(secret: str, message_id: str, timestamp: str, body: bytes) -> str:
+    mac = hmac.new(secret.encode(), message_id.encode() + timestamp.encode() + body, hashlib.sha256)
+    return "sha256=" + mac.hexdigest()
+
+
+def _parse_timestamp(value: str) -> Optional[datetime]:
+    # Twitch шлёт RFC3339 с наносекундами: 2023-07-19T14:56:51.634234626Z
+    try:
+        value = value.rstrip("Z")
+        if "." in value:
+            head, frac = value.split(".", 1)
+            value = f"{head}.{frac[:6]}"
+            return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=timezone.utc)
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+# ---------- приём уведомлений ----------
+class EventSubWebhookServer:
+    def __init__(
+        self,
+        secret: str,
+        callback: EventCallback,
+        *,
+        host: str = "0.0.0.0",
+        port: int = 8080,
+        path: str = "/eventsub",
+        on_revocation: Optional[Callable[[dict], None]] = None,
+    ):
+        self.secret = secret
+        self.callback = callback
+        self.host = host
+        self.port = port
+        self.path = path
+        self.on_revocation = on_revocation
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._runner: Optional[web.AppRunner] = None
+        self._tasks: set = set()
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info("EventSub webhook слушает %s:%s%s", self.host, self.port, self.path)
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def _remember(self, message_id: str) -> bool:
+        """True, если сообщение новое (Twitch может доставить одно и то же повторно)."""
+        if message_id in self._seen:
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > SEEN_IDS_LIMIT:
+            self._seen.popitem(last=False)
+        return True
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        message_id = request.headers.get(HDR_ID, "")
+        timestamp = request.headers.get(HDR_TIMESTAMP, "")
+        signature = request.headers.get(HDR_SIGNATURE, "")
+        message_type = request.headers.get(HDR_TYPE, "")
+
+        if not (message_id and timestamp and signature):
+            return web.Response(status=400)
+
+        if not hmac.compare_digest(sign_message(self.secret, message_id, timestamp, body), signature):
+            log.warning("EventSub: неверная подпись (id=%s)", message_id)
+            return web.Response(status=403)
+
+        sent_at = _parse_timestamp(timestamp)
+        if sent_at is None or datetime.now(timezone.utc) - sent_at > MAX_MESSAGE_AGE:
+            log.warning("EventSub: устаревшее сообщение (id=%s, ts=%s)", message_id, timestamp)
+            return web.Response(status=403)
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+
+        if message_type == "webhook_callback_verification":
+            log.info("EventSub: подтверждение подписки %s", data.get("subscription", {}).get("type"))
+            return web.Response(text=data.get("challenge", ""), content_type="text/plain")
+
+        if not self._remember(message_id):
+            return web.Response(status=204)
+
+        subscription = data.get("subscription") or {}
+        if message_type == "revocation":
+            log.warning("EventSub: подписка отозвана: %s (%s)", subscription.get("type"), subscription.get("status"))
+            if self.on_revocation:
+                self.on_revocation(subscription)
+            return web.Response(status=204)
+
+        if message_type == "notification":
+            # Twitch ждёт ответ за пару секунд — обработку уводим в фон
+            task = asyncio.create_task(self._dispatch(subscription.get("type", ""), data.get("event") or {}))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        return web.Response(status=204)
+
+    async def _dispatch(self, sub_type: str, event: dict) -> None:
+        try:
+            await self.callback(sub_type, event)
+        except Exception as e:
+            log.exception("EventSub: ошибка обработки %s: %s", sub_type, e)
+
+
+# ---------- управление подписками ----------
+async def _helix(
+    session: aiohttp.ClientSession, method: str, url: str, headers: dict, **kwargs
+) -> dict:
+    async with session.request(method, url, headers=headers, **kwargs) as resp:
+        if resp.status >= 400:
+            text = await resp.text()
+            raise RuntimeError(f"Helix {method} {url}: HTTP {resp.status}: {text[:200]}")
+        if resp.status == 204:
+            return {}
+        return await resp.json()
+
+
+async def resolve_user_ids(
+    session: aiohttp.ClientSession, api_url: str, headers: dict, logins: Iterable[str]
+) -> Dict[str, str]:
+    """login -> broadcaster_user_id (Get Users, до 100 логинов за запрос)."""
+    logins = list(logins)
+    result: Dict[str, str] = {}
+    for i in range(0, len(logins), 100):
+        params = [("login", login) for login in logins[i:i + 100]]
+        data = await _helix(session, "GET", f"{api_url}/users", headers, params=params)
+        for user in data.get("data", []):
+            result[user["login"].lower()] = user["id"]
+    return result
+
+
+async def sync_subscriptions(
+    *,
+    client_id: str,
+    app_token: str,
+    callback_url: str,
+    secret: str,
+    logins: Iterable[str],
+    api_url: str = HELIX_URL,
+) -> int:
+    """
+    Создаёт недостающие подписки и удаляет сломанные/чужие для нашего callback.
+    Возвращает число созданных подписок.
+    """
+    headers = {"Client-Id": client_id, "Authorization": f"Bearer {app_token}"}
+    session = http_session()  # общий keep-alive пул процесса
+    user_ids = await resolve_user_ids(session, api_url, headers, logins)
+    wanted = {(t, uid) for uid in user_ids.values() for t in SUBSCRIPTION_VERSIONS}
+
+    existing: List[dict] = []
+    cursor = None
+    while True:
+        params = {"after": cursor} if cursor else {}
+        data = await _helix(session, "GET", f"{api_url}/eventsub/subscriptions", headers, params=params)
+        existing.extend(data.get("data", []))
+        cursor = (data.get("pagination") or {}).get("cursor")
+        if not cursor:
+            break
+
+    have = set()
+    for sub in existing:
+        transport = sub.get("transport") or {}
+        if transport.get("callback") != callback_url:
+            continue
+        key = (sub.get("type"), (sub.get("condition") or {}).get("broadcaster_user_id"))
+        ok = sub.get("status") in ("enabled", "webhook_callback_verification_pending")
+        if ok and key in wanted and key not in have:
+            have.add(key)
+            continue
+        await _helix(session, "DELETE", f"{api_url}/eventsub/subscriptions", headers, params={"id": sub["id"]})
+        log.info("EventSub: удалена подписка %s (%s)", sub.get("type"), sub.get("status"))
+
+    created = 0
+    for sub_type, uid in sorted(wanted - have):
+        await _helix(session, "POST", f"{api_url}/eventsub/subscriptions", headers, json={
+            "type": sub_type,
+            "version": SUBSCRIPTION_VERSIONS[sub_type],
+            "condition": {"broadcaster_user_id": uid},
+            "transport": {"method": "webhook", "callback": callback_url, "secret": secret},
+        })
+        created += 1
+
+    missing = set(map(str.lower, logins)) - set(user_ids)
+    if missing:
+        log.warning("EventSub: не найдены каналы: %s", ", ".join(sorted(missing)))
+    log.info("EventSub: подписок активно %s, создано %s", len(have) + created, created)
+    return created
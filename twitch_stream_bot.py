@@ -1,18 +1,34 @@
-import json
 import logging
 import asyncio
 import signal
 import locale
-from datetime import datetime, timezone
+import os
+from datetime import datetime, timedelta, timezone
 from twitchAPI.twitch import Twitch
+from twitchAPI.object.api import Stream
+from twitchAPI.type import (
+    TwitchResourceNotFound, TwitchAuthorizationException, UnauthorizedException,
+    InvalidTokenException, MissingAppSecretException, TwitchAPIException,
+)
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.error import BadRequest
 from tg_group_dlc import start_group_dlc  # DLC: фоновый модуль приветствий и команд
-from tg_to_discord_bridge import register_tg_to_discord_bridge
+from tg_to_discord_bridge import register_tg_to_discord_bridge, albums as bridge_albums
+from discord_outbox import outbox as discord_outbox
 from tg_fun_dlc import start_fun_dlc
 from html import escape as h
-import random
-from telegram.request import HTTPXRequest
+import time
+from twitch_eventsub import EventSubWebhookServer, sync_subscriptions, HELIX_URL
+from poll_scheduler import PollScheduler
+from twitch_token_cache import AppTokenCache
+from thumbnails import ThumbnailPipeline
+from tg_send_queue import send_queue, PRIORITY_ANNOUNCE
+from state_store import get_store, state_db_path
+from viewer_stats import ViewerSeries
+from stream_archive import get_archive, archive_path
+from caption_policy import CaptionEditPolicy
+from transport import get_bot, http_session, close as close_transport
+from config_service import config_service, get_config, subscribe as subscribe_config
 
 
 # Настройка логирования
@@ -26,14 +42,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-last_sent = {
-    'media_url': None,
-    'caption_html': None,
-    'reply_markup_key': None,
-    'is_ended': None,
-}
-send_lock = asyncio.Lock()
-
 # Установка русской локали
 try:
     locale.setlocale(locale.LC_TIME, 'ru_RU.UTF-8')
@@ -49,80 +57,320 @@ def format_duration(seconds, always_show_hours=False):
         return f"{hours} ч {remaining_minutes} мин"
     return f"{minutes} мин"
 
-# Загрузка конфигурации
+# Загрузка конфигурации (общий неизменяемый снимок, перечитывается при изменении файла)
 try:
-    with open('config.json') as f:
-        config = json.load(f)
+    config = get_config()
 except Exception as e:
     logger.error(f"Ошибка при чтении config.json: {e}")
     raise
 
-required_keys = ['TWITCH_CLIENT_ID', 'TWITCH_CLIENT_SECRET', 'TELEGRAM_TOKEN', 'CHANNEL_ID', 'STREAMER']
+required_keys = ['TWITCH_CLIENT_ID', 'TWITCH_CLIENT_SECRET', 'TELEGRAM_TOKEN', 'CHANNEL_ID']
 for key in required_keys:
     if key not in config:
         raise KeyError(f"Отсутствует ключ в конфиге: {key}")
+if not config.get('STREAMER') and not config.get('STREAMERS'):
+    raise KeyError("Отсутствует ключ в конфиге: STREAMER (или список STREAMERS)")
+
+
+def _resolve_streamers(cfg: dict) -> list:
+    # STREAMERS — список каналов для командного режима; STREAMER — старый одиночный режим
+    raw = cfg.get('STREAMERS') or [cfg['STREAMER']]
+    if isinstance(raw, str):
+        raw = [raw]
+    logins = []
+    for login in raw:
+        login = str(login).strip().lower()
+        if login and login not in logins:
+            logins.append(login)
+    return logins
 
 TWITCH_CLIENT_ID = config['TWITCH_CLIENT_ID']
 TWITCH_CLIENT_SECRET = config['TWITCH_CLIENT_SECRET']
 TELEGRAM_TOKEN = config['TELEGRAM_TOKEN']
 CHANNEL_ID = config['CHANNEL_ID']
-STREAMER = config['STREAMER']
+STREAMERS = _resolve_streamers(config)
 ALWAYS_SHOW_HOURS = config.get('ALWAYS_SHOW_HOURS', False)
 SOCIAL_LINKS = config.get('SOCIAL_LINKS', {})
 STREAM_LINKS = config.get('STREAM_LINKS', {})
 DELETE_STREAM_MESSAGE_AFTER_END = config.get('DELETE_STREAM_MESSAGE_AFTER_END', False)
 DELETE_STREAM_MESSAGE_DELAY_SECONDS = config.get('DELETE_STREAM_MESSAGE_DELAY_SECONDS', 600)
 
+
+def _resolve_announce_targets(cfg: dict) -> list:
+    # Куда слать анонс: ANNOUNCE_TARGETS, иначе — как раньше, только CHANNEL_ID
+    targets = list(cfg.get('ANNOUNCE_TARGETS') or [cfg['CHANNEL_ID']])
+    if cfg.get('ANNOUNCE_TO_DLC_GROUP') and cfg.get('DLC_GROUP_ID'):
+        targets.append(cfg['DLC_GROUP_ID'])
+    unique = []
+    for chat_id in targets:
+        if str(chat_id) not in {str(t) for t in unique}:
+            unique.append(chat_id)
+    return unique
+
+
+ANNOUNCE_TARGETS = _resolve_announce_targets(config)
+# Сколько чатов обновляем одновременно: медленный чат не задерживает остальные
+announce_semaphore = asyncio.Semaphore(max(1, int(config.get('ANNOUNCE_MAX_PARALLEL', 4))))
+
+# EventSub: мгновенный детект старта/конца стрима, опрос остаётся как редкая сверка
+EVENTSUB_ENABLED = config.get('EVENTSUB_ENABLED', False)
+EVENTSUB_CALLBACK_URL = config.get('EVENTSUB_CALLBACK_URL')
+EVENTSUB_SECRET = config.get('EVENTSUB_SECRET')
+EVENTSUB_HOST = config.get('EVENTSUB_HOST', '0.0.0.0')
+EVENTSUB_PORT = int(config.get('EVENTSUB_PORT', 8080))
+EVENTSUB_PATH = config.get('EVENTSUB_PATH', '/eventsub')
+EVENTSUB_API_URL = config.get('EVENTSUB_API_URL', HELIX_URL).rstrip('/')
+EVENTSUB_RECONCILE_SECONDS = int(config.get('EVENTSUB_RECONCILE_SECONDS', 900))
+if EVENTSUB_ENABLED and not (EVENTSUB_CALLBACK_URL and EVENTSUB_SECRET):
+    raise KeyError("Для EVENTSUB_ENABLED нужны EVENTSUB_CALLBACK_URL и EVENTSUB_SECRET")
+
+# Каталог для файлов состояния (в docker-compose — отдельный volume)
+DATA_DIR = config.get('DATA_DIR', 'data')
+os.makedirs(DATA_DIR, exist_ok=True)
+
+# Превью: своё скачивание + хэш, в Telegram грузим только реально новый кадр
+THUMBNAIL_WIDTH = int(config.get('THUMBNAIL_WIDTH', 1920))
+THUMBNAIL_HEIGHT = int(config.get('THUMBNAIL_HEIGHT', 1080))
+thumbnails = ThumbnailPipeline(hash_threshold=int(config.get('THUMBNAIL_HASH_THRESHOLD', 6)))
+
+# app token Twitch переживает рестарты
+token_cache = AppTokenCache(os.path.join(DATA_DIR, 'twitch_token.json'), TWITCH_CLIENT_ID)
+# Только эти ошибки означают проблему с авторизацией — остальные не повод выкидывать клиент
+TWITCH_AUTH_ERRORS = (
+    TwitchAuthorizationException, UnauthorizedException, InvalidTokenException, MissingAppSecretException,
+)
+
+# Адаптивный опрос: часто в привычные окна старта, редко вне их
+LIVE_POLL_SECONDS = int(config.get('POLL_LIVE_SECONDS', 60))  # во время эфира обновляем зрителей/длительность
+POLL_USE_TWITCH_SCHEDULE = config.get('POLL_USE_TWITCH_SCHEDULE', False)
+SCHEDULE_REFRESH_SECONDS = 6 * 3600
+scheduler = PollScheduler(
+    path=os.path.join(DATA_DIR, 'poll_schedule.json'),
+    fast_seconds=float(config.get('POLL_FAST_SECONDS', 10)),
+    slow_seconds=float(config.get('POLL_SLOW_SECONDS', 120)),
+    live_seconds=LIVE_POLL_SECONDS,
+    lead_minutes=int(config.get('POLL_WINDOW_LEAD_MINUTES', 15)),
+    window_minutes=int(config.get('POLL_WINDOW_MINUTES', 30)),
+    jitter=float(config.get('POLL_JITTER', 0.1)),
+)
+OFFLINE_EVENT_GRACE_SECONDS = 300  # Helix ещё какое-то время отдаёт завершённый стрим
+
+# Зрители за эфир: ограниченный по памяти ряд, итог — в финальной карточке
+VIEWER_SERIES_CAPACITY = int(config.get('VIEWER_SERIES_CAPACITY', 720))
+
+# Правки живого анонса: название/игра — сразу, зрители/длительность — не чаще порога
+caption_policy = CaptionEditPolicy(
+    min_interval=float(config.get('CAPTION_MIN_EDIT_INTERVAL', 120)),
+    max_interval=float(config.get('CAPTION_MAX_EDIT_INTERVAL', 600)),
+    viewer_delta_rel=float(config.get('CAPTION_VIEWER_DELTA_REL', 0.1)),
+    viewer_delta_abs=int(config.get('CAPTION_VIEWER_DELTA_ABS', 5)),
+)
+
+# Архив завершённых эфиров (его же читают команды /laststream и /stats в группе)
+archive = get_archive(archive_path(config))
+MAX_SEGMENTS = 200  # смены названия/категории за один эфир
+
 START_TIME = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-message_id = None
-delete_task = None
-is_streaming = False
-last_stream_data = None
+HELIX_MAX_LOGINS = 100  # лимит user_login на один запрос Get Streams
+HELIX_API_URL = config.get('HELIX_API_URL', HELIX_URL).rstrip('/')
+
+# Эти ключи подхватываются на лету, остальные (токены, стримеры, чаты, EventSub) — после рестарта
+RESTART_ONLY_KEYS = (
+    'TWITCH_CLIENT_ID', 'TWITCH_CLIENT_SECRET', 'TELEGRAM_TOKEN', 'CHANNEL_ID', 'STREAMER', 'STREAMERS',
+    'ANNOUNCE_TARGETS', 'ANNOUNCE_TO_DLC_GROUP', 'DLC_GROUP_ID', 'DATA_DIR', 'STATE_DB_PATH',
+)
+
+
+def _apply_config(cfg) -> None:
+    global config, ALWAYS_SHOW_HOURS, SOCIAL_LINKS, STREAM_LINKS
+    global DELETE_STREAM_MESSAGE_AFTER_END, DELETE_STREAM_MESSAGE_DELAY_SECONDS
+    changed = [key for key in RESTART_ONLY_KEYS if cfg.get(key) != config.get(key)]
+    if changed:
+        logger.warning(f"Изменения {', '.join(changed)} применятся только после рестарта")
+    config = cfg
+    ALWAYS_SHOW_HOURS = cfg.get('ALWAYS_SHOW_HOURS', False)
+    SOCIAL_LINKS = cfg.get('SOCIAL_LINKS', {})
+    STREAM_LINKS = cfg.get('STREAM_LINKS', {})
+    DELETE_STREAM_MESSAGE_AFTER_END = cfg.get('DELETE_STREAM_MESSAGE_AFTER_END', False)
+    DELETE_STREAM_MESSAGE_DELAY_SECONDS = cfg.get('DELETE_STREAM_MESSAGE_DELAY_SECONDS', 600)
+
+
+subscribe_config(_apply_config)
+
+
+def _empty_last_sent() -> dict:
+    return {
+        'media_key': None,
+        'caption_html': None,
+        'reply_markup_key': None,
+        'is_ended': None,
+    }
+
+
+def _new_target(chat_id) -> dict:
+    return {
+        'chat_id': chat_id,
+        'message_id': None,
+        'last_sent': _empty_last_sent(),
+    }
+
+
+def _new_streamer_state(login: str) -> dict:
+    # Своё состояние анонса на каждого стримера (раньше — глобальные переменные)
+    return {
+        'login': login,
+        # str(chat_id) -> своё сообщение и свой «что уже отправлено» в каждом чате
+        'targets': {str(chat_id): _new_target(chat_id) for chat_id in ANNOUNCE_TARGETS},
+        'delete_task': None,
+        'delete_at': None,  # unix-время запланированного удаления (переживает рестарт)
+        'is_streaming': False,
+        'last_stream_data': None,
+        'viewers': ViewerSeries(VIEWER_SERIES_CAPACITY),
+        'segments': [],  # [[unix-время, название, категория], ...] — для архива
+        'lock': asyncio.Lock(),
+        # (started_at, monotonic-дедлайн) стрима, закрытого событием stream.offline
+        'ended_by_event': None,
+    }
+
+
+streamer_states = {login: _new_streamer_state(login) for login in STREAMERS}
+
+# Состояние анонсов переживает рестарт: после перезапуска правим то же сообщение, а не шлём новое
+STATE_DB_PATH = state_db_path(config)
+store = get_store(STATE_DB_PATH)
+STATE_NS = 'announce'
+
+
+def checkpoint_state(state: dict) -> None:
+    last = state['last_stream_data']
+    if last:
+        last = {**last, 'started_at': last['started_at'].isoformat()}
+    store.set(STATE_NS, state['login'], {
+        'targets': {
+            key: {'message_id': t['message_id'], 'last_sent': t['last_sent']}
+            for key, t in state['targets'].items()
+        },
+        'is_streaming': state['is_streaming'],
+        'last_stream_data': last,
+        'viewers': state['viewers'].to_dict(),
+        'segments': state['segments'],
+        'delete_at': state['delete_at'],
+    })
+
+
+def restore_streamer_states(bot: Bot) -> None:
+    for login, state in streamer_states.items():
+        saved = store.get(STATE_NS, login)
+        if not saved:
+            continue
+        last = saved.get('last_stream_data')
+        if last:
+            last = {**last, 'started_at': datetime.fromisoformat(last['started_at'])}
+        saved_targets = saved.get('targets') or {}
+        # чаты, убранные из конфига, забываем; новые начинают с чистого листа
+        for key, target in state['targets'].items():
+            saved_target = saved_targets.get(key) or {}
+            target['message_id'] = saved_target.get('message_id')
+            target['last_sent'] = {**_empty_last_sent(), **(saved_target.get('last_sent') or {})}
+            # JSON возвращает кортежи кнопок списками — иначе после рестарта клавиатура всегда «изменилась»
+            rm_key = target['last_sent']['reply_markup_key']
+            if rm_key is not None:
+                target['last_sent']['reply_markup_key'] = tuple(tuple(map(tuple, row)) for row in rm_key)
+        state.update({
+            'is_streaming': saved.get('is_streaming', False),
+            'last_stream_data': last,
+            'viewers': ViewerSeries.from_dict(saved.get('viewers')),
+            'segments': saved.get('segments') or [],
+            'delete_at': saved.get('delete_at'),
+        })
+        message_ids = {key: t['message_id'] for key, t in state['targets'].items() if t['message_id']}
+        if state['delete_at'] and message_ids:
+            delay = max(0, state['delete_at'] - time.time())
+            state['delete_task'] = asyncio.create_task(delete_stream_message_later(bot, state, delay))
+        logger.info(f"[{login}] Восстановлено состояние: сообщения={message_ids}, в эфире={state['is_streaming']}")
 
 async def get_twitch_client():
     try:
-        twitch = Twitch(TWITCH_CLIENT_ID, TWITCH_CLIENT_SECRET)
-        await twitch.authenticate_app([])
-        logger.info("Успешная аутентификация Twitch")
+        twitch = Twitch(TWITCH_CLIENT_ID, TWITCH_CLIENT_SECRET, authenticate_app=False)
+        cached = token_cache.load()
+        if cached:
+            await twitch.set_app_authentication(cached, [])
+            logger.info("Twitch: используем сохранённый app token")
+        else:
+            await twitch.authenticate_app([])
+            await token_cache.remember(twitch.get_app_token())
+            logger.info("Успешная аутентификация Twitch")
+        # если токен всё же протух/отозван, twitchAPI перевыпустит его на 401 — сохраним новый
+        twitch.app_auth_refresh_callback = token_cache.remember
         return twitch
     except Exception as e:
         logger.error(f"Twitch auth error: {e}")
         return None
 
-async def get_stream_info(twitch):
-    try:
-        async for stream in twitch.get_streams(user_login=[STREAMER]):
-            quant = 300  # 5 минут
-            timestamp = int(datetime.now().timestamp() // quant * quant)
-
-            game_name = stream.game_name or ""
-            base_thumb = stream.thumbnail_url.format(width=1920, height=1080)
-
-            # Категории, при которых надо подменять превью (можно вынести в config)
-            irl_like = set(x.lower() for x in config.get("IRL_CATEGORIES", ["IRL"]))
-            thumbnail_url = base_thumb  # по умолчанию — твичевское превью
-
-            if game_name.lower() in irl_like:
-                # возьмём из конфига, если задано
-                custom = config.get("IRL_IMAGE_URL")
-                if custom:
-                    thumbnail_url = custom
-
-            # 👇 ВАЖНО: возвращаем УЖЕ ВЫБРАННЫЙ thumbnail_url
-            return {
-                'title': stream.title,
-                'game_name': game_name,
-                'thumbnail_url': f"{thumbnail_url}?t={timestamp}",
-                'started_at': stream.started_at,
-                'viewer_count': stream.viewer_count
-            }
-        return None
-    except Exception as e:
-        logger.error(f"Twitch stream error: {e}")
-        return None
-
 
-def build_stream_caption_html(stream_info, is_ended: bool, always_show_hours: bool, social_links: dict, streamer: str) -> str:
+async def refresh_twitch_token(twitch):
+    """Плановое обновление app token до истечения."""
+    await twitch.authenticate_app([])
+    await token_cache.remember(twitch.get_app_token())
+    logger.info("Twitch app token обновлён заранее")
+
+
+def _build_stream_info(stream) -> dict:
+    quant = 300  # 5 минут
+    timestamp = int(datetime.now().timestamp() // quant * quant)
+
+    game_name = stream.game_name or ""
+    base_thumb = stream.thumbnail_url.format(width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT)
+
+    # Категории, при которых надо подменять превью (можно вынести в config)
+    irl_like = set(x.lower() for x in config.get("IRL_CATEGORIES", ["IRL"]))
+    thumbnail_url = base_thumb  # по умолчанию — твичевское превью
+
+    if game_name.lower() in irl_like:
+        # возьмём из конфига, если задано
+        custom = config.get("IRL_IMAGE_URL")
+        if custom:
+            thumbnail_url = custom
+
+    # 👇 ВАЖНО: возвращаем УЖЕ ВЫБРАННЫЙ thumbnail_url
+    return {
+        'user_login': stream.user_login.lower(),
+        'user_name': stream.user_name,
+        'title': stream.title,
+        'game_name': game_name,
+        'thumbnail_url': f"{thumbnail_url}?t={timestamp}",
+        'started_at': stream.started_at,
+        'viewer_count': stream.viewer_count
+    }
+
+
+async def get_streams_info(twitch, logins: list) -> dict:
+    """
+    Один запрос Get Streams на каждые 100 логинов.
+    Возвращает {login: stream_info} только для тех, кто сейчас в эфире.
+    Ошибки Twitch пробрасываются наверх: сбой API не должен выглядеть как «стрим закончился».
+    """
+    # Частый запрос идёт через общий keep-alive пул (twitchAPI на каждый вызов открывает новую сессию);
+    # twitchAPI остаётся для авторизации и редких запросов
+    headers = {'Client-Id': TWITCH_CLIENT_ID, 'Authorization': f'Bearer {twitch.get_app_token()}'}
+    result = {}
+    for i in range(0, len(logins), HELIX_MAX_LOGINS):
+        params = [('user_login', login) for login in logins[i:i + HELIX_MAX_LOGINS]]
+        params.append(('first', str(HELIX_MAX_LOGINS)))
+        async with http_session().get(f"{HELIX_API_URL}/streams", params=params, headers=headers) as resp:
+            if resp.status == 401:
+                raise UnauthorizedException((await resp.text())[:200])
+            if resp.status >= 400:
+                raise TwitchAPIException(f"Get Streams: HTTP {resp.status}: {(await resp.text())[:200]}")
+            data = await resp.json()
+        for entry in data.get('data', []):
+            info = _build_stream_info(Stream(**entry))
+            result[info['user_login']] = info
+    return result
+
+
+def build_stream_caption_html(stream_info, is_ended: bool, always_show_hours: bool, social_links: dict, streamer: str,
+                              viewer_stats: dict | None = None) -> str:
     title = h(stream_info['title'])
     game  = h(stream_info['game_name'])
     viewers = stream_info.get('viewer_count')
@@ -137,8 +385,13 @@ def build_stream_caption_html(stream_info, is_ended: bool, always_show_hours: bo
             "",
             f"<b>Игра</b>: <b>{game}</b>",
             f"<b>Продолжительность</b>: <b>{dur_str}</b>",
-            "",
         ]
+        if viewer_stats:
+            lines.append(
+                f"<b>Зрители</b>: пик <b>{viewer_stats['peak']}</b> • "
+                f"в среднем <b>{viewer_stats['avg']}</b> • минимум <b>{viewer_stats['min']}</b>"
+            )
+        lines.append("")
     else:
         lines += [
             f"<i>🎬 {title}</i>",
@@ -162,21 +415,138 @@ def build_stream_caption_html(stream_info, is_ended: bool, always_show_hours: bo
     return "\n".join(lines)
 
 
-async def send_or_update_message(bot: Bot, stream_info: dict, is_ended: bool = False):
-    global message_id, last_sent, last_stream_data
-    async with send_lock:
-        # ВСЁ содержимое функции ниже — на один уровень глубже (внутри with)
+def _reply_markup_key(markup):
+    if not markup:
+        return None
+    rows = []
+    for row in markup.inline_keyboard:
+        rows.append(tuple((btn.text, getattr(btn, 'url', None)) for btn in row))
+    return tuple(rows)
+
+
+async def _update_target(bot: Bot, state: dict, target: dict, card: dict) -> None:
+    """Отправка/правка анонса в одном чате. card — общий для всех чатов результат рендера."""
+    streamer = state['login']
+    chat_id = target['chat_id']
+    last_sent = target['last_sent']
+    media_key, caption, reply_markup, rm_key, is_ended = (
+        card['media_key'], card['caption'], card['reply_markup'], card['rm_key'], card['is_ended']
+    )
+
+    changed_media   = (media_key != last_sent['media_key'])
+    changed_caption = (caption != last_sent['caption_html'])
+    changed_rm      = (rm_key   != last_sent['reply_markup_key'])
+    changed_state   = (is_ended != last_sent['is_ended'])
+
+    if target['message_id'] is not None and not (changed_media or changed_caption or changed_rm or changed_state):
+        return
+
+    def _mark_sent():
+        last_sent.update({
+            'media_key': media_key,
+            'caption_html': caption,
+            'reply_markup_key': rm_key,
+            'is_ended': is_ended,
+        })
+
+    async def _send_new():
+        sent = await send_queue.submit(
+            lambda: bot.send_photo(
+                chat_id=chat_id,
+                photo=card['media'],
+                caption=caption,
+                parse_mode="HTML",
+                reply_markup=reply_markup
+            ),
+            chat_id=chat_id,
+            priority=PRIORITY_ANNOUNCE,
+        )
+        thumbnails.remember_file_id(media_key, sent)
+        target['message_id'] = sent.message_id
+        logger.info(f"[{streamer}] Отправлено новое сообщение в {chat_id}: ID {target['message_id']}")
+        # новый message_id пишем сразу: упади процесс сейчас — после рестарта будет дубль
+        checkpoint_state(state)
+        await store.flush()
+
+    # Повторы при флуд-контроле и сетевых сбоях делает общая очередь отправки
+    try:
+        if target['message_id'] is None:
+            await _send_new()
+        else:
+            message_id = target['message_id']
+            if changed_media or changed_state:
+                edited = await send_queue.submit(
+                    lambda: bot.edit_message_media(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        media=InputMediaPhoto(
+                            media=card['media'],
+                            caption=caption,
+                            parse_mode="HTML",
+                        ),
+                        reply_markup=reply_markup
+                    ),
+                    chat_id=chat_id,
+                    priority=PRIORITY_ANNOUNCE,
+                    retry_on_timeout=True,
+                )
+                thumbnails.remember_file_id(media_key, edited)
+            elif changed_caption or changed_rm:
+                await send_queue.submit(
+                    lambda: bot.edit_message_caption(
+                        chat_id=chat_id,
+                        message_id=message_id,
+                        caption=caption,
+                        parse_mode="HTML",
+                        reply_markup=reply_markup
+                    ),
+                    chat_id=chat_id,
+                    priority=PRIORITY_ANNOUNCE,
+                    retry_on_timeout=True,
+                )
+
+        _mark_sent()
+
+    except BadRequest as e:
+        msg = str(e).lower()
+        logger.warning(f"[{streamer}] BadRequest в {chat_id}: {e}")
+
+        if "message is not modified" in msg:
+            _mark_sent()
+        elif "message to edit not found" in msg:
+            # сообщение удалили руками — публикуем заново
+            await _send_new()
+            _mark_sent()
+
+
+async def _run_on_targets(state: dict, targets: list, action) -> None:
+    """Запускает action(target) параллельно, но не больше ANNOUNCE_MAX_PARALLEL чатов разом."""
+    async def _guarded(target):
+        async with announce_semaphore:
+            await action(target)
+
+    results = await asyncio.gather(*(_guarded(t) for t in targets), return_exceptions=True)
+    for target, result in zip(targets, results):
+        if isinstance(result, Exception):
+            logger.error(f"[{state['login']}] Ошибка анонса в {target['chat_id']}: {result}")
+
+
+async def send_or_update_message(bot: Bot, state: dict, stream_info: dict, is_ended: bool = False):
+    streamer = state['login']
+    async with state['lock']:
         # защита от наивной даты
         started_at = stream_info['started_at']
         if started_at.tzinfo is None:
             started_at = started_at.replace(tzinfo=timezone.utc)
 
+        # Подпись, кнопки и картинку готовим один раз — во все чаты уходит одно и то же
         caption_html = build_stream_caption_html(
             stream_info={**stream_info, 'started_at': started_at},
             is_ended=is_ended,
             always_show_hours=ALWAYS_SHOW_HOURS,
             social_links=SOCIAL_LINKS,
-            streamer=STREAMER
+            streamer=streamer,
+            viewer_stats=state['viewers'].summary() if is_ended else None,
         )
 
         reply_markup = None
@@ -185,7 +555,7 @@ async def send_or_update_message(bot: Bot, stream_info: dict, is_ended: bool = F
 
             # 1-я строка: смотреть стрим
             buttons.append([
-                InlineKeyboardButton("Смотреть стрим", url=f"https://www.twitch.tv/{STREAMER}")
+                InlineKeyboardButton("Смотреть стрим", url=f"https://www.twitch.tv/{streamer}")
             ])
 
             # Соцсети: по 2 кнопки в ряд
@@ -197,195 +567,344 @@ async def send_or_update_message(bot: Bot, stream_info: dict, is_ended: bool = F
                     row = []
             if row:
                 buttons.append(row)
-        
-            reply_markup = InlineKeyboardMarkup(buttons)
 
+            reply_markup = InlineKeyboardMarkup(buttons)
 
-        def _reply_markup_key(markup):
-            if not markup:
-                return None
-            rows = []
-            for row in markup.inline_keyboard:
-                rows.append(tuple((btn.text, getattr(btn, 'url', None)) for btn in row))
-            return tuple(rows)
+        targets = list(state['targets'].values())
+        thumbnail_url = stream_info['thumbnail_url']
+        prev_key = next((t['last_sent']['media_key'] for t in targets if t['last_sent']['media_key']), None)
+        media_key, media = await thumbnails.resolve(thumbnail_url, prev_key)
+        card = {
+            'media_key': media_key,
+            'media': media,
+            'caption': caption_html,
+            'reply_markup': reply_markup,
+            'rm_key': _reply_markup_key(reply_markup),
+            'is_ended': is_ended,
+        }
+
+        def _sent_differs(target, *fields):
+            ls = target['last_sent']
+            current = {'media_key': media_key, 'caption_html': caption_html,
+                       'reply_markup_key': card['rm_key'], 'is_ended': is_ended}
+            return any(ls[f] != current[f] for f in (fields or current))
+
+        # В чаты, где сообщения ещё нет, шлём всегда; правки существующих — по политике
+        stale = [t for t in targets if t['message_id'] is not None and _sent_differs(t)]
+        edit_allowed = not stale or caption_policy.should_edit(
+            streamer,
+            title=stream_info['title'],
+            game=stream_info['game_name'],
+            viewers=stream_info.get('viewer_count'),
+            media_changed=any(_sent_differs(t, 'media_key') for t in stale),
+            force=is_ended or any(_sent_differs(t, 'reply_markup_key', 'is_ended') for t in stale),
+        )
+        if not edit_allowed:
+            targets = [t for t in targets if t['message_id'] is None]
+        attempted = [t for t in targets if t['message_id'] is None or _sent_differs(t)]
+
+        async def _update(target):
+            await _update_target(bot, state, target, card)
+
+        # Новую картинку грузим в первый чат, остальным отдаём уже полученный file_id
+        if isinstance(media, bytes) and len(targets) > 1:
+            uploads = [t for t in targets if t['message_id'] is None or t['last_sent']['media_key'] != media_key]
+            if uploads:
+                await _run_on_targets(state, uploads[:1], _update)
+                _, card['media'] = await thumbnails.resolve(thumbnail_url, media_key)
+                targets = [t for t in targets if t is not uploads[0]]
+
+        await _run_on_targets(state, targets, _update)
+
+        # интервал отсчитываем от правки, которая дошла: упавшая или отменённая не должна
+        # придерживать следующую
+        if edit_allowed and any(not _sent_differs(t) for t in attempted):
+            caption_policy.mark_sent(
+                streamer,
+                title=stream_info['title'],
+                game=stream_info['game_name'],
+                viewers=stream_info.get('viewer_count'),
+            )
+
+        state['last_stream_data'] = {
+            'user_login': streamer,
+            'title': stream_info['title'],
+            'game_name': stream_info['game_name'],
+            'viewer_count': stream_info.get('viewer_count'),
+            'thumbnail_url': thumbnail_url,
+            'started_at': started_at,
+        }
+
+async def delete_stream_message_later(bot: Bot, state: dict, delay: int):
+    streamer = state['login']
+    try:
+        await asyncio.sleep(delay)
 
-        media_url = stream_info['thumbnail_url']
-        caption = caption_html
-        rm_key = _reply_markup_key(reply_markup)
+        async def _delete(target):
+            message_id = target['message_id']
+            if not message_id:
+                return
+            await send_queue.submit(
+                lambda: bot.delete_message(chat_id=target['chat_id'], message_id=message_id),
+                chat_id=target['chat_id'],
+            )
+            logger.info(f"[{streamer}] Сообщение о стриме удалено в {target['chat_id']} (ID {message_id})")
+            target['message_id'] = None
+
+        await _run_on_targets(state, list(state['targets'].values()), _delete)
+        state['delete_at'] = None
+        checkpoint_state(state)
+    except asyncio.CancelledError:
+        logger.info(f"[{streamer}] Удаление сообщения отменено (стрим возобновился)")
+        raise
+    except Exception as e:
+        logger.error(f"[{streamer}] Ошибка при удалении сообщения: {e}")
 
-        changed_media   = (media_url != last_sent['media_url'])
-        changed_caption = (caption != last_sent['caption_html'])
-        changed_rm      = (rm_key   != last_sent['reply_markup_key'])
-        changed_state   = (is_ended != last_sent['is_ended'])
+def _track_segment(state: dict, stream_info: dict, at: float | None = None) -> None:
+    segments = state['segments']
+    title, game = stream_info['title'], stream_info['game_name']
+    if segments and segments[-1][1] == title and segments[-1][2] == game:
+        return
+    if len(segments) >= MAX_SEGMENTS:
+        segments[-1] = [segments[-1][0], title, game]  # дальше просто держим последнее состояние
+        return
+    segments.append([int(at if at is not None else time.time()), title, game])
 
-        if message_id is not None and not (changed_media or changed_caption or changed_rm or changed_state):
-            return
 
-        for attempt in range(3):
-            try:
-                if message_id is None:
-                    msg = await bot.send_photo(
-                        chat_id=CHANNEL_ID,
-                        photo=media_url,
-                        caption=caption,
-                        parse_mode="HTML",
-                        reply_markup=reply_markup
-                    )
-                    message_id = msg.message_id
-                    logger.info(f"Отправлено новое сообщение: ID {message_id}")
-                else:
-                    if changed_media or changed_state:
-                        await bot.edit_message_media(
-                            chat_id=CHANNEL_ID,
-                            message_id=message_id,
-                            media=InputMediaPhoto(
-                                media=media_url,
-                                caption=caption,
-                                parse_mode="HTML",
-                            ),
-                            reply_markup=reply_markup
-                        )
-                    elif changed_caption or changed_rm:
-                        await bot.edit_message_caption(
-                            chat_id=CHANNEL_ID,
-                            message_id=message_id,
-                            caption=caption,
-                            parse_mode="HTML",
-                            reply_markup=reply_markup
-                        )
+async def archive_session(state: dict) -> None:
+    last = state['last_stream_data']
+    try:
+        await asyncio.to_thread(
+            archive.record_session,
+            state['login'],
+            last['started_at'],
+            datetime.now(timezone.utc),
+            state['segments'] or [[int(last['started_at'].timestamp()), last['title'], last['game_name']]],
+            state['viewers'],
+        )
+    except Exception as e:
+        logger.error(f"[{state['login']}] Не удалось сохранить эфир в архив: {e}")
 
-                last_sent.update({
-                    'media_url': media_url,
-                    'caption_html': caption,
-                    'reply_markup_key': rm_key,
-                    'is_ended': is_ended,
-                })
-                last_stream_data = {
-                    'title': stream_info['title'],
-                    'game_name': stream_info['game_name'],
-                    'viewer_count': stream_info.get('viewer_count'),
-                    'thumbnail_url': media_url,
-                    'started_at': started_at,
-                }
-                break
-
-            except BadRequest as e:
-                msg = str(e).lower()
-                logger.warning(f"Попытка {attempt+1}: BadRequest: {e}")
-
-                if "message is not modified" in msg:
-                    last_sent.update({
-                        'media_url': media_url,
-                        'caption_html': caption,
-                        'reply_markup_key': rm_key,
-                        'is_ended': is_ended,
-                    })
-                    break
-
-                if "message to edit not found" in msg:
-                    if message_id is not None:
-                        sent = await bot.send_photo(
-                            chat_id=CHANNEL_ID,
-                            photo=media_url,
-                            caption=caption,
-                            parse_mode="HTML",
-                            reply_markup=reply_markup
-                        )
-                        message_id = sent.message_id
-                        last_sent.update({
-                            'media_url': media_url,
-                            'caption_html': caption,
-                            'reply_markup_key': rm_key,
-                            'is_ended': is_ended,
-                        })
-                    break
-
-                if attempt < 2:
-                    await asyncio.sleep(1.5 + random.random())
-                    continue
-                break
 
-            except Exception as e:
-                logger.error(f"Ошибка при отправке: {e}")
-                if attempt == 2:
-                    raise
-                await asyncio.sleep(1.5 + random.random())
+async def apply_stream_info(bot: Bot, state: dict, stream_info: dict | None):
+    """Переходы автомата анонса одного стримера: старт → обновления → завершение."""
+    ended = state['ended_by_event']
+    if stream_info and not state['is_streaming'] and ended:
+        ended_started_at, deadline = ended
+        if time.monotonic() < deadline and stream_info['started_at'] == ended_started_at:
+            # Helix ещё не убрал стрим, который EventSub уже закрыл — не переобъявляем
+            return
+        state['ended_by_event'] = None
+
+    if stream_info and not state['is_streaming']:
+        state['is_streaming'] = True
+        scheduler.record_go_live(stream_info['started_at'])
+        state['viewers'] = ViewerSeries(VIEWER_SERIES_CAPACITY)
+        state['viewers'].add(stream_info.get('viewer_count'))
+        state['segments'] = []
+        caption_policy.forget(state['login'])
+        _track_segment(state, stream_info, at=stream_info['started_at'].timestamp())
+
+        delete_task = state['delete_task']
+        if delete_task and not delete_task.done():
+            delete_task.cancel()
+        state['delete_task'] = None
+        state['delete_at'] = None
+
+        await send_or_update_message(bot, state, stream_info, is_ended=False)
+
+    elif not stream_info and state['is_streaming']:
+        state['is_streaming'] = False
+
+        if state['last_stream_data']:
+            await send_or_update_message(bot, state, state['last_stream_data'], is_ended=True)
+            await archive_session(state)
+
+            if DELETE_STREAM_MESSAGE_AFTER_END:
+                delete_task = state['delete_task']
+                if delete_task and not delete_task.done():
+                    delete_task.cancel()
 
-async def delete_stream_message_later(bot: Bot, delay: int):
-    global message_id
-    try:
-        await asyncio.sleep(delay)
-        if message_id:
-            await bot.delete_message(chat_id=CHANNEL_ID, message_id=message_id)
-            logger.info(f"Сообщение о стриме удалено (ID {message_id})")
-            message_id = None
-    except asyncio.CancelledError:
-        logger.info("Удаление сообщения отменено (стрим возобновился)")
-        raise
-    except Exception as e:
-        logger.error(f"Ошибка при удалении сообщения: {e}")
+                state['delete_at'] = time.time() + DELETE_STREAM_MESSAGE_DELAY_SECONDS
+                state['delete_task'] = asyncio.create_task(
+                    delete_stream_message_later(
+                        bot,
+                        state,
+                        DELETE_STREAM_MESSAGE_DELAY_SECONDS
+                    )
+                )
 
-async def check_stream():
-    global is_streaming, message_id, last_stream_data, last_sent, delete_task
+        state['last_stream_data'] = None
+        for target in state['targets'].values():
+            target['last_sent'] = _empty_last_sent()
 
-    request = HTTPXRequest(
-        connect_timeout=10.0,
-        read_timeout=20.0,
-        write_timeout=20.0,
-        pool_timeout=10.0,
-    )
-    bot = Bot(token=TELEGRAM_TOKEN, request=request)
-    twitch = None
+    elif stream_info and state['is_streaming']:
+        state['viewers'].add(stream_info.get('viewer_count'))
+        _track_segment(state, stream_info)
+        await send_or_update_message(bot, state, stream_info, is_ended=False)
 
-    while True:
-        try:
-            if twitch is None:
-                twitch = await get_twitch_client()
+    else:
+        return
 
-            stream_info = await get_stream_info(twitch)
+    checkpoint_state(state)
 
-            if stream_info and not is_streaming:
-                is_streaming = True
+async def refresh_streamers(bot: Bot, twitch, logins: list) -> dict:
+    """Один запрос Helix на пачку логинов и применение результата к их анонсам."""
+    live = await get_streams_info(twitch, logins)
 
-                if delete_task and not delete_task.done():
-                    delete_task.cancel()
-                delete_task = None
+    # Один упавший канал не должен мешать остальным
+    results = await asyncio.gather(
+        *(apply_stream_info(bot, streamer_states[login], live.get(login)) for login in logins),
+        return_exceptions=True
+    )
+    for login, res in zip(logins, results):
+        if isinstance(res, Exception):
+            logger.error(f"[{login}] Ошибка обновления анонса: {res}")
+    return live
 
-                await send_or_update_message(bot, stream_info, is_ended=False)
 
-            elif not stream_info and is_streaming:
-                is_streaming = False
+async def refresh_twitch_schedule(twitch, logins: list):
+    """Ближайшие старты из расписания каналов Twitch — подсказка для планировщика опроса."""
+    now = datetime.now(timezone.utc)
+    starts = []
+    for i in range(0, len(logins), HELIX_MAX_LOGINS):
+        async for user in twitch.get_users(logins=logins[i:i + HELIX_MAX_LOGINS]):
+            try:
+                schedule = await twitch.get_channel_stream_schedule(user.id, first=10)
+            except TwitchResourceNotFound:
+                continue  # расписание не заполнено
+            for segment in schedule.segments or []:
+                if segment.canceled_until or not segment.start_time:
+                    continue
+                if segment.start_time < now + timedelta(days=7):
+                    starts.append(segment.start_time)
+    scheduler.set_scheduled_starts(starts)
+    logger.info(f"Расписание Twitch: ближайших стартов {len(starts)}")
+
+
+async def handle_eventsub(bot: Bot, get_twitch, sub_type: str, event: dict):
+    login = (event.get('broadcaster_user_login') or '').lower()
+    state = streamer_states.get(login)
+    if state is None:
+        return
+    logger.info(f"[{login}] EventSub: {sub_type}")
+
+    if sub_type == 'stream.offline':
+        last = state['last_stream_data']
+        if last:
+            state['ended_by_event'] = (last['started_at'], time.monotonic() + OFFLINE_EVENT_GRACE_SECONDS)
+        await apply_stream_info(bot, state, None)
+        return
+
+    if sub_type == 'channel.update' and not state['is_streaming']:
+        # смена названия/категории вне эфира анонс не трогает
+        return
+
+    # stream.online приходит раньше, чем стрим появляется в Get Streams — даём Helix догнать
+    delays = (0, 5, 10, 20, 30) if sub_type == 'stream.online' else (0,)
+    for delay in delays:
+        await asyncio.sleep(delay)
+        twitch = get_twitch()
+        if twitch is None:
+            continue
+        live = await get_streams_info(twitch, [login])
+        if login in live:
+            await apply_stream_info(bot, state, live[login])
+            return
+    logger.warning(f"[{login}] EventSub {sub_type}: Helix так и не показал стрим, ждём сверки")
 
-                if last_stream_data:
-                    await send_or_update_message(bot, last_stream_data, is_ended=True)
 
-                    if DELETE_STREAM_MESSAGE_AFTER_END:
-                        if delete_task and not delete_task.done():
-                            delete_task.cancel()
+async def check_stream():
+    bot = get_bot(TELEGRAM_TOKEN)  # тот же клиент и пул соединений, что у DLC-приложения
+    twitch = None
+    logins = list(streamer_states)
+    logger.info(f"Отслеживаем стримеров: {', '.join(logins)}")
+
+    store.start()
+    restore_streamer_states(bot)
+
+    eventsub = None
+    eventsub_synced = False
+    schedule_refreshed_at = 0.0
+    stats_logged_at = time.monotonic()
+    poll_wakeup = asyncio.Event()  # событие EventSub будит цикл, чтобы сразу начать обновлять эфир
+
+    if EVENTSUB_ENABLED:
+        def _resync(_subscription):
+            nonlocal eventsub_synced
+            eventsub_synced = False
+
+        async def _on_event(sub_type: str, event: dict):
+            await handle_eventsub(bot, lambda: twitch, sub_type, event)
+            poll_wakeup.set()
+
+        eventsub = EventSubWebhookServer(
+            EVENTSUB_SECRET,
+            _on_event,
+            host=EVENTSUB_HOST,
+            port=EVENTSUB_PORT,
+            path=EVENTSUB_PATH,
+            on_revocation=_resync,
+        )
+        await eventsub.start()
 
-                        delete_task = asyncio.create_task(
-                            delete_stream_message_later(
-                                bot,
-                                DELETE_STREAM_MESSAGE_DELAY_SECONDS
-                            )
+    try:
+        while True:
+            try:
+                if twitch is None:
+                    twitch = await get_twitch_client()
+
+                if twitch is not None:
+                    if token_cache.needs_refresh():
+                        await refresh_twitch_token(twitch)
+
+                    if eventsub and not eventsub_synced:
+                        await sync_subscriptions(
+                            client_id=TWITCH_CLIENT_ID,
+                            app_token=twitch.get_app_token(),
+                            callback_url=EVENTSUB_CALLBACK_URL,
+                            secret=EVENTSUB_SECRET,
+                            logins=logins,
+                            api_url=EVENTSUB_API_URL,
                         )
+                        eventsub_synced = True
 
-                last_stream_data = None
-                last_sent = {
-                    'media_url': None,
-                    'caption_html': None,
-                    'reply_markup_key': None,
-                    'is_ended': None,
-                }
+                    await refresh_streamers(bot, twitch, logins)
 
-            elif stream_info and is_streaming:
-                await send_or_update_message(bot, stream_info, is_ended=False)
+                    if POLL_USE_TWITCH_SCHEDULE and time.monotonic() - schedule_refreshed_at > SCHEDULE_REFRESH_SECONDS:
+                        schedule_refreshed_at = time.monotonic()
+                        try:
+                            await refresh_twitch_schedule(twitch, logins)
+                        except Exception as e:
+                            logger.warning(f"Не удалось получить расписание Twitch: {e}")
 
-        except Exception as e:
-            logger.error(f"Ошибка check_stream: {e}")
-            twitch = None
-
-        await asyncio.sleep(60)
+            except TWITCH_AUTH_ERRORS as e:
+                logger.error(f"Ошибка авторизации Twitch: {e}")
+                token_cache.clear()
+                twitch = None
+            except Exception as e:
+                # сетевые сбои и 5xx Twitch — клиент и токен остаются, просто ждём следующий цикл
+                logger.error(f"Ошибка check_stream: {e}")
+
+            # С EventSub опрос нужен только пока кто-то в эфире (зрители) и как редкая сверка
+            any_live = any(state['is_streaming'] for state in streamer_states.values())
+            interval = scheduler.next_interval(
+                any_live, reconcile_seconds=EVENTSUB_RECONCILE_SECONDS if eventsub and eventsub_synced else None,
+            )
+
+            if time.monotonic() - stats_logged_at > 3600:
+                stats_logged_at = time.monotonic()
+                logger.info(f"Опрос Twitch: {scheduler.status()}")
+                logger.info(f"Правки анонсов: {caption_policy.stats}")
+            try:
+                await asyncio.wait_for(poll_wakeup.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            poll_wakeup.clear()
+    finally:
+        if eventsub:
+            await eventsub.stop()
+        await send_queue.close()
 
 async def shutdown():
     logger.info("Остановка бота...")
@@ -402,8 +921,10 @@ async def main():
     loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
     loop.add_signal_handler(signal.SIGINT, stop.set_result, None)
 
+    config_service.start()
+
     # фоновая корутина твича
-    loop.create_task(check_stream())
+    poll_task = loop.create_task(check_stream())
 
     # 1) запускаем DLC для группы и получаем его Application
     dlc_app = None
@@ -414,6 +935,8 @@ async def main():
     
             register_tg_to_discord_bridge(dlc_app)
             logger.info("Telegram → Discord bridge подключён")
+
+            dlc_app.bot_data["poll_scheduler"] = scheduler  # для /stats poll
     
     except Exception as e:
         logger.exception(f"DLC не запустился: {e}")
@@ -434,16 +957,40 @@ async def main():
     # ждём сигнала остановки
     await stop
 
-    # мягко гасим DLC-приложение(я)
+    # Telegram-клиент общий для анонсов, моста и DLC, поэтому гасим по шагам:
+    # сначала перестаём брать апдейты — stop() дожидается обработчиков, уже взявших апдейт
+    # (клиент при этом остаётся открытым)
     try:
         if dlc_app:
             await dlc_app.updater.stop()
             await dlc_app.stop()
+    except Exception as e:
+        logger.warning(f"При остановке DLC: {e}")
+
+    # пачки входов/выходов, ещё ждущие окна, отправляем сейчас — пока очередь отправки открыта
+    if dlc_app:
+        await dlc_app.bot_data["member_batcher"].drain()
+
+    # опрос Twitch: его finally останавливает EventSub и очередь отправки в Telegram
+    poll_task.cancel()
+    await asyncio.gather(poll_task, return_exceptions=True)
+
+    # мост: альбомы, ещё копящиеся в буфере, ставим в очередь Discord — и только потом её закрываем
+    await bridge_albums.drain()
+    await discord_outbox.close()
+
+    # клиентом больше никто не пользуется — теперь можно закрыть приложение
+    try:
+        if dlc_app:
             await dlc_app.shutdown()
     except Exception as e:
         logger.warning(f"При остановке DLC: {e}")
 
+    # последняя отложенная запись состояния — явно и до общей отмены задач, чтобы её не прервали
+    await store.close()
     await shutdown()
+    await config_service.stop()
+    await close_transport()
 
 
 if __name__ == '__main__':
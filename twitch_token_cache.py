@@ -0,0 +1,80 @@
+# twitch_token_cache.py
+"""
+Кэш app access token Twitch на диске.
+
+Токен переживает рестарты контейнера (не нужен OAuth-запрос на каждый старт)
+и обновляется заранее — до истечения, а не после первого 401.
+"""
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from twitchAPI.oauth import validate_token
+
+log = logging.getLogger("twitch_token_cache")
+
+DEFAULT_TTL = 24 * 3600           # если validate не ответил — считаем, что токен живёт сутки
+REFRESH_MARGIN_SECONDS = 6 * 3600  # обновляем за 6 часов до истечения (app token живёт ~60 дней)
+
+
+class AppTokenCache:
+    def __init__(self, path: str, client_id: str, refresh_margin: float = REFRESH_MARGIN_SECONDS):
+        self.path = path
+        self.client_id = client_id
+        self.refresh_margin = refresh_margin
+        self.expires_at: float = 0.0
+
+    def load(self) -> Optional[str]:
+        """Токен из файла, если он наш и не истекает в ближайшее время."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning("Не удалось прочитать кэш токена %s: %s", self.path, e)
+            return None
+
+        if data.get("client_id") != self.client_id:
+            return None  # поменяли приложение в конфиге
+        expires_at = float(data.get("expires_at", 0))
+        if expires_at - time.time() <= self.refresh_margin:
+            return None
+        self.expires_at = expires_at
+        return data.get("access_token")
+
+    def save(self, token: str, expires_at: float) -> None:
+        self.expires_at = expires_at
+        tmp = f"{self.path}.tmp"
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"client_id": self.client_id, "access_token": token, "expires_at": expires_at}, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log.warning("Не удалось сохранить кэш токена %s: %s", self.path, e)
+
+    def clear(self) -> None:
+        self.expires_at = 0.0
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning("Не удалось удалить кэш токена %s: %s", self.path, e)
+
+    def needs_refresh(self) -> bool:
+        return self.expires_at - time.time() <= self.refresh_margin
+
+    async def remember(self, token: str) -> None:
+        """Сохраняет свежий токен; срок жизни узнаём у /oauth2/validate."""
+        ttl = DEFAULT_TTL
+        try:
+            info = await validate_token(token)
+            ttl = int(info.get("expires_in") or ttl)
+        except Exception as e:
+            log.warning("Не удалось узнать срок жизни токена: %s", e)
+        self.save(token, time.time() + ttl)
+        log.info("Twitch app token сохранён, истекает через %.1f ч", ttl / 3600)
@@ -0,0 +1,159 @@
+# update_dispatch.py
+"""
+Единый диспетчер апдейтов для всех DLC-модулей одного Application.
+
+Вместо длинного списка обработчиков, которые PTB проверяет по очереди (и где первый
+подходящий «съедает» апдейт), в приложении один TypeHandler, а обработчики
+разложены по словарям:
+
+• команды — по первому слову сообщения: «/roll», «!кубик», «/кубик»;
+  суффикс «@имя_бота» отрезается (команды другим ботам игнорируются), остальные
+  слова попадают в context.args;
+• наблюдатели — по id или username чата: получают каждое новое сообщение/пост
+  этого чата (кроме /команд и известных !алиасов) и не мешают ни командам, ни друг другу;
+• callback-кнопки — по точному callback_data, прочие — в один общий обработчик;
+• chat_member — всем подписанным.
+
+Поиск обработчика — обращение к словарю, сколько бы их ни было.
+
+Использование:
+    dispatch = get_dispatcher(app)
+    dispatch.command(cmd_roll, "/roll", "!кубик", "/кубик")
+    dispatch.watch_chats("bridge", ["@news", "-100123"], on_post)
+"""
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram import Chat, Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+log = logging.getLogger("update_dispatch")
+
+Callback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[None]]
+
+COMMAND_PREFIXES = ("/", "!")
+
+
+def _chat_key(key) -> str:
+    # id чата — строкой, username — без @ и в нижнем регистре
+    return str(key).strip().lstrip("@").lower()
+
+
+def split_command(text: str, bot_username: Optional[str]) -> Optional[Tuple[str, List[str]]]:
+    """«/Roll@MyBot 20» -> ("/roll", ["20"]); None — не команда или команда другому боту."""
+    if not text or text[0] not in COMMAND_PREFIXES:
+        return None
+    parts = text.split()
+    token, _, addressee = parts[0].lower().partition("@")
+    if addressee and (not bot_username or addressee != bot_username.lower()):
+        return None
+    return token, parts[1:]
+
+
+class UpdateDispatcher:
+    def __init__(self):
+        self._commands: Dict[str, Callback] = {}
+        self._watchers: Dict[str, Dict[str, Callback]] = {}  # ключ чата -> {имя наблюдателя: обработчик}
+        self._watched_keys: Dict[str, List[str]] = {}          # имя наблюдателя -> его ключи чатов
+        self._callbacks: Dict[str, Callback] = {}
+        self._callback_fallback: Optional[Callback] = None
+        self._chat_member: List[Callback] = []
+        self.stats = {"commands": 0, "watched": 0, "callbacks": 0, "chat_member": 0}
+
+    # ---------- регистрация ----------
+    def command(self, fn: Callback, *tokens: str) -> None:
+        for token in tokens:
+            token = token.lower()
+            if token[0] not in COMMAND_PREFIXES:
+                token = "/" + token
+            if token in self._commands and self._commands[token] is not fn:
+                log.warning("Команда %s переназначена на %s", token, fn.__qualname__)
+            self._commands[token] = fn
+
+    def watch_chats(self, name: str, chats: Iterable, fn: Callback) -> None:
+        """Подписывает наблюдателя name на сообщения чатов; повторный вызов заменяет список чатов."""
+        for key in self._watched_keys.pop(name, []):
+            watchers = self._watchers.get(key, {})
+            watchers.pop(name, None)
+            if not watchers:
+                self._watchers.pop(key, None)
+        keys = sorted({_chat_key(c) for c in chats if c not in (None, "")})
+        for key in keys:
+            self._watchers.setdefault(key, {})[name] = fn
+        self._watched_keys[name] = keys
+
+    def callback(self, fn: Callback, data: Optional[str] = None) -> None:
+        """data — точное значение callback_data; без него — обработчик для всех остальных кнопок (один)."""
+        if data is None:
+            if self._callback_fallback is not None and self._callback_fallback is not fn:
+                raise ValueError(
+                    f"Общий обработчик кнопок уже задан ({self._callback_fallback.__qualname__}), "
+                    f"{fn.__qualname__} — регистрируй по callback_data"
+                )
+            self._callback_fallback = fn
+        else:
+            self._callbacks[data] = fn
+
+    def chat_member(self, fn: Callback) -> None:
+        self._chat_member.append(fn)
+
+    # ---------- маршрутизация ----------
+    def _watchers_of(self, chat: Chat) -> List[Callback]:
+        found = dict(self._watchers.get(str(chat.id), {}))
+        if chat.username:
+            found.update(self._watchers.get(chat.username.lower(), {}))
+        return list(found.values())
+
+    async def _call(self, fn: Callback, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        # ошибка одного модуля не мешает остальным получить апдейт
+        try:
+            await fn(update, context)
+        except Exception as e:
+            log.exception("Ошибка в обработчике %s: %s", getattr(fn, "__qualname__", fn), e)
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if update.callback_query:
+            query = update.callback_query
+            fn = self._callbacks.get(query.data, self._callback_fallback)
+            self.stats["callbacks"] += 1
+            if fn:
+                await self._call(fn, update, context)
+            return
+
+        if update.chat_member:
+            self.stats["chat_member"] += 1
+            for fn in self._chat_member:
+                await self._call(fn, update, context)
+            return
+
+        msg = update.message or update.channel_post
+        if not msg or not msg.chat:
+            return
+
+        text = (msg.text or "").lstrip()
+        if update.message and text[:1] in COMMAND_PREFIXES:
+            command = split_command(text, context.bot.username)
+            fn = self._commands.get(command[0]) if command else None
+            if fn:
+                self.stats["commands"] += 1
+                context.args = command[1]
+                await self._call(fn, update, context)
+                return
+            if text.startswith("/"):
+                return  # неизвестная или чужая /команда — наблюдателям не отдаём
+
+        for fn in self._watchers_of(msg.chat):
+            self.stats["watched"] += 1
+            await self._call(fn, update, context)
+
+
+_dispatchers: Dict[int, UpdateDispatcher] = {}
+
+
+def get_dispatcher(app: Application) -> UpdateDispatcher:
+    """Диспетчер приложения; при первом обращении он сам регистрируется в app."""
+    dispatcher = _dispatchers.get(id(app))
+    if dispatcher is None:
+        dispatcher = _dispatchers[id(app)] = UpdateDispatcher()
+        app.add_handler(TypeHandler(Update, dispatcher.dispatch))
+    return dispatcher
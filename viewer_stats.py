@@ -0,0 +1,93 @@
+# viewer_stats.py
+"""
+Ряд значений зрителей за один стрим в фиксированном объёме памяти.
+
+• точки хранятся в array('I') (4 байта на точку), ёмкость ограничена;
+• когда буфер заполнен, соседние точки усредняются попарно, а шаг (сколько опросов
+  в одной точке) удваивается — длинный стрим просто становится «крупнее», память не растёт;
+• пик, минимум и среднее считаются по всем сырым значениям, поэтому от прореживания не зависят.
+"""
+from array import array
+from typing import Optional
+
+DEFAULT_CAPACITY = 720  # 12 часов при опросе раз в минуту, дальше — прореживание
+
+
+class ViewerSeries:
+    __slots__ = ("capacity", "step", "points", "_acc", "_acc_n", "count", "total", "peak", "low")
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        if capacity < 2 or capacity % 2:
+            raise ValueError("capacity должна быть чётной и не меньше 2")
+        self.capacity = capacity
+        self.step = 1                # сколько сырых значений в одной точке
+        self.points = array("I")
+        self._acc = 0                # накопитель незавершённой точки
+        self._acc_n = 0
+        self.count = 0
+        self.total = 0
+        self.peak = 0
+        self.low: Optional[int] = None
+
+    def add(self, value) -> None:
+        if value is None:
+            return
+        value = max(0, int(value))
+        self.count += 1
+        self.total += value
+        self.peak = max(self.peak, value)
+        self.low = value if self.low is None else min(self.low, value)
+
+        self._acc += value
+        self._acc_n += 1
+        if self._acc_n < self.step:
+            return
+        self.points.append(round(self._acc / self._acc_n))
+        self._acc = self._acc_n = 0
+        if len(self.points) >= self.capacity:
+            self._downsample()
+
+    def _downsample(self) -> None:
+        pts = self.points
+        self.points = array("I", ((pts[i] + pts[i + 1] + 1) // 2 for i in range(0, len(pts) - 1, 2)))
+        self.step *= 2
+
+    def summary(self) -> Optional[dict]:
+        """{'peak', 'avg', 'min', 'samples'} или None, если значений не было."""
+        if not self.count:
+            return None
+        return {
+            "peak": self.peak,
+            "avg": round(self.total / self.count),
+            "min": self.low,
+            "samples": self.count,
+        }
+
+    # ---------- сохранение в state_store ----------
+    def to_dict(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "step": self.step,
+            "points": self.points.tolist(),
+            "acc": self._acc,
+            "acc_n": self._acc_n,
+            "count": self.count,
+            "total": self.total,
+            "peak": self.peak,
+            "min": self.low,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> "ViewerSeries":
+        series = cls(int((data or {}).get("capacity", DEFAULT_CAPACITY)))
+        if not data:
+            return series
+        series.step = int(data.get("step", 1))
+        series.points = array("I", data.get("points", [])[: series.capacity])
+        series._acc = int(data.get("acc", 0))
+        series._acc_n = int(data.get("acc_n", 0))
+        series.count = int(data.get("count", 0))
+        series.total = int(data.get("total", 0))
+        series.peak = int(data.get("peak", 0))
+        series.low = data.get("min")
+        return series